@@ -1,5 +1,11 @@
-﻿import logging
+﻿import time
+BOOT_STARTED = time.perf_counter()  # startup report: everything below counts as import time
+
+import asyncio
+import importlib
+import logging
 import sys
+from datetime import datetime
 
 from telegram.ext import (
     ApplicationBuilder, 
@@ -10,15 +16,27 @@ from telegram.ext import (
     ConversationHandler
 )
 from src.config import Config
+from src.metrics import start_metrics_server
+from src.api.client import async_api_client
+from src.api.stock import refresh_hot_quantities
+from src.ai.intent_cache import intent_cache
+from src.ai.agent import warm_up_model
+from src.bot.traced_request import TracedHTTPXRequest
+from src.bot.outbox import outbox_worker
+from src.bot.utils import clock_time
+from src.bot.reports import precompute_reports, keep_reports_warm, send_digest
 from src.bot.handlers import (
     start_command, 
+    stats_command,
+    subscribe_command, unsubscribe_command, digest_command,
     handle_text_message, 
     handle_button_click,
-    start_invoice_flow, receive_debtor, receive_item, receive_qty, complete_invoice, cancel_invoice, cancel_invoice_inline,
+    start_invoice_flow, receive_debtor, receive_item, receive_qty, add_invoice_item, complete_invoice, cancel_invoice, cancel_invoice_inline,
     INVOICE_DEBTOR, INVOICE_ITEM, INVOICE_QTY, INVOICE_CONFIRM,
     start_debtor_flow, receive_debtor_name, receive_debtor_phone, complete_debtor,
     DEBTOR_NAME, DEBTOR_PHONE, DEBTOR_CONFIRM
 )
+IMPORTS_DONE = time.perf_counter()
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -28,6 +46,99 @@ logging.getLogger("httpx").setLevel(logging.WARNING)
 logging.getLogger("telegram").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
+def local_time(text):
+    """ "08:30" -> a time in the server's timezone, for JobQueue.run_daily."""
+    at = clock_time(text)
+    return datetime.now().astimezone().timetz().replace(hour=at.hour, minute=at.minute, second=0, microsecond=0)
+
+def preload(module_name):
+    """Imports a heavy module (e.g. pandas via analytics) off the event loop so its first user does not pay for it."""
+    started = time.perf_counter()
+    importlib.import_module(module_name)
+    logger.info(f"📦 {module_name} preloaded in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+async def connect_erp():
+    """First AutoCount login, in the background. Until the ERP answers, handlers reply "ERP unavailable"."""
+    started = time.perf_counter()
+    if await async_api_client.login():
+        logger.info(f"🔌 ERP connected in {(time.perf_counter() - started) * 1000:.0f} ms")
+    else:
+        logger.warning("⚠️ ERP unavailable at startup; the bot keeps polling and logs in again on the next request.")
+
+async def on_startup(application):
+    """Starts the slow warm-ups (ERP login, intent model, analytics) in the background so polling starts immediately."""
+    loop = asyncio.get_running_loop()
+    loop.run_in_executor(None, warm_up_model)
+    loop.run_in_executor(None, preload, "src.api.analytics")
+    application.create_task(connect_erp())
+    outbox_worker.kick(application.bot)  # sends writes left queued by the previous run
+    if Config.METRICS_PORT:
+        application.bot_data["metrics_server"] = start_metrics_server(Config.METRICS_HOST, Config.METRICS_PORT)
+    logger.info(
+        f"⏱️ Startup: imports {(IMPORTS_DONE - BOOT_STARTED) * 1000:.0f} ms, "
+        f"ready to poll {(time.perf_counter() - BOOT_STARTED) * 1000:.0f} ms after launch"
+    )
+
+async def on_shutdown(application):
+    """Stops the outbox worker, closes the pooled AutoCount connections and flushes the intent cache."""
+    await outbox_worker.stop()
+    await async_api_client.aclose()
+    intent_cache.save()
+    if application.bot_data.get("metrics_server"):
+        application.bot_data["metrics_server"].shutdown()
+
+def register_handlers(application):
+    """Wires the wizards and standard handlers (shared with tests/loadtest.py)."""
+    # --- REGISTER INVOICE WIZARD ---
+    invoice_conv = ConversationHandler(
+        entry_points=[CallbackQueryHandler(start_invoice_flow, pattern='^btn_create_invoice$')],
+        states={
+            # Allow text input OR clicking the inline buttons generated during the flow
+            INVOICE_DEBTOR: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, receive_debtor),
+                CallbackQueryHandler(receive_debtor, pattern='^sel_debtor_')
+            ],
+            INVOICE_ITEM: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, receive_item),
+                CallbackQueryHandler(receive_item, pattern='^sel_item_')
+            ],
+            INVOICE_QTY: [MessageHandler(filters.TEXT & ~filters.COMMAND, receive_qty)],
+            INVOICE_CONFIRM: [
+                CallbackQueryHandler(complete_invoice, pattern='^inv_confirm_'),
+                CallbackQueryHandler(add_invoice_item, pattern='^inv_add_item$')
+            ]
+        },
+        fallbacks=[
+            CommandHandler("cancel", cancel_invoice),
+            CallbackQueryHandler(cancel_invoice_inline, pattern='^inv_cancel$')
+        ]
+    )
+    application.add_handler(invoice_conv)
+
+    # --- REGISTER DEBTOR WIZARD ---
+    debtor_conv = ConversationHandler(
+        entry_points=[CallbackQueryHandler(start_debtor_flow, pattern='^btn_create_debtor$')],
+        states={
+            DEBTOR_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, receive_debtor_name)],
+            DEBTOR_PHONE: [MessageHandler(filters.TEXT & ~filters.COMMAND, receive_debtor_phone)],
+            DEBTOR_CONFIRM: [CallbackQueryHandler(complete_debtor, pattern='^debtor_confirm_')]
+        },
+        fallbacks=[
+            CommandHandler("cancel", cancel_invoice),
+            CallbackQueryHandler(cancel_invoice_inline, pattern='^inv_cancel$')
+        ]
+    )
+    application.add_handler(debtor_conv)
+    
+    # --- STANDARD HANDLERS ---
+    application.add_handler(CommandHandler("start", start_command))
+    application.add_handler(CommandHandler("stats", stats_command))
+    application.add_handler(CommandHandler("subscribe", subscribe_command))
+    application.add_handler(CommandHandler("unsubscribe", unsubscribe_command))
+    application.add_handler(CommandHandler("digest", digest_command))
+    application.add_handler(CallbackQueryHandler(handle_button_click)) 
+    application.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), handle_text_message))
+
 if __name__ == '__main__':
     print("========================================")
     print("🚀  AIAA AGENT - STARTING UP")
@@ -35,51 +146,31 @@ if __name__ == '__main__':
 
     try:
         Config.validate()
-        application = ApplicationBuilder().token(Config.TELEGRAM_TOKEN).build()
-        
-        # --- REGISTER INVOICE WIZARD ---
-        invoice_conv = ConversationHandler(
-            entry_points=[CallbackQueryHandler(start_invoice_flow, pattern='^btn_create_invoice$')],
-            states={
-                # Allow text input OR clicking the inline buttons generated during the flow
-                INVOICE_DEBTOR: [
-                    MessageHandler(filters.TEXT & ~filters.COMMAND, receive_debtor),
-                    CallbackQueryHandler(receive_debtor, pattern='^sel_debtor_')
-                ],
-                INVOICE_ITEM: [
-                    MessageHandler(filters.TEXT & ~filters.COMMAND, receive_item),
-                    CallbackQueryHandler(receive_item, pattern='^sel_item_')
-                ],
-                INVOICE_QTY: [MessageHandler(filters.TEXT & ~filters.COMMAND, receive_qty)],
-                INVOICE_CONFIRM: [CallbackQueryHandler(complete_invoice, pattern='^inv_confirm_')]
-            },
-            fallbacks=[
-                CommandHandler("cancel", cancel_invoice),
-                CallbackQueryHandler(cancel_invoice_inline, pattern='^inv_cancel$')
-            ]
-        )
-        application.add_handler(invoice_conv)
-
-        # --- REGISTER DEBTOR WIZARD ---
-        debtor_conv = ConversationHandler(
-            entry_points=[CallbackQueryHandler(start_debtor_flow, pattern='^btn_create_debtor$')],
-            states={
-                DEBTOR_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, receive_debtor_name)],
-                DEBTOR_PHONE: [MessageHandler(filters.TEXT & ~filters.COMMAND, receive_debtor_phone)],
-                DEBTOR_CONFIRM: [CallbackQueryHandler(complete_debtor, pattern='^debtor_confirm_')]
-            },
-            fallbacks=[
-                CommandHandler("cancel", cancel_invoice),
-                CallbackQueryHandler(cancel_invoice_inline, pattern='^inv_cancel$')
-            ]
+        # concurrent_updates: one user's slow request must not hold up everyone else
+        application = (
+            ApplicationBuilder()
+            .token(Config.TELEGRAM_TOKEN)
+            .concurrent_updates(True)
+            .request(TracedHTTPXRequest(connection_pool_size=256))
+            .post_init(on_startup)
+            .post_shutdown(on_shutdown)
+            .build()
         )
-        application.add_handler(debtor_conv)
-        
-        # --- STANDARD HANDLERS ---
-        application.add_handler(CommandHandler("start", start_command))
-        application.add_handler(CallbackQueryHandler(handle_button_click)) 
-        application.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), handle_text_message))
         
+        register_handlers(application)
+
+        # --- BACKGROUND JOBS ---
+        if application.job_queue:
+            application.job_queue.run_repeating(refresh_hot_quantities, interval=Config.STOCK_QTY_TTL, first=Config.STOCK_QTY_TTL)
+            application.job_queue.run_repeating(async_api_client.refresh_token_if_due, interval=Config.API_TOKEN_REFRESH_AHEAD / 2)
+            application.job_queue.run_repeating(intent_cache.flush, interval=intent_cache.save_interval, first=intent_cache.save_interval)
+            # Menu reports: all built before opening time, the intraday ones kept warm in office hours, then the digest
+            application.job_queue.run_daily(precompute_reports, local_time(Config.REPORTS_PRECOMPUTE_AT), days=Config.REPORT_DAYS)
+            application.job_queue.run_repeating(keep_reports_warm, interval=Config.REPORTS_REFRESH_INTERVAL, first=Config.REPORTS_REFRESH_INTERVAL)
+            application.job_queue.run_daily(send_digest, local_time(Config.DIGEST_AT), days=Config.REPORT_DAYS)
+        else:
+            logger.warning("JobQueue unavailable (install python-telegram-bot[job-queue]); hot stock quantities, the ERP token and menu reports refresh on read only, the intent cache is saved on shutdown only, and no digest is sent.")
+
         print("🟢 Bot is polling...")
         application.run_polling()
         
@@ -1,14 +1,26 @@
-﻿import ollama
-import json
+﻿import json
+import logging
 import re
+import time
+from collections import Counter, defaultdict
 from datetime import datetime
 from src.config import Config
+from src.ai.rules import classify
+from src.ai.inference import inference_queue
+from src.ai.intent_cache import intent_cache
+from src.tracing import tracer
+from src.api.resilience import budget_paused
+from src.api.debtor import debtor_cache
+from src.api.stock import stock_cache
 
-# Dynamic Date Context
-current_date = datetime.now().strftime("%Y/%m/%d")
-current_day = datetime.now().strftime("%A")
+logger = logging.getLogger(__name__)
 
-SYSTEM_PROMPT = f"""
+# Which tier answered each message ("cache" / "rules" / "llm"), for hit-rate tracking
+TIER_STATS = Counter()
+# Cumulative latency per tier in ms, so models chosen via OLLAMA_MODEL can be compared
+TIER_LATENCY_MS = defaultdict(float)
+
+SYSTEM_PROMPT_TEMPLATE = """
 You are an AutoCount API Assistant. Today is {current_day}, {current_date}.
 Your job is to map User Requests to Functions.
 Return ONLY a valid JSON object.
@@ -16,45 +28,171 @@ Return ONLY a valid JSON object.
 Available Intents:
 1. "get_sales" -> Args: {{"date": "YYYY/MM/DD"}} (Default to today if unspecified)
 2. "compare_sales" -> Args: {{"date1": "YYYY/MM/DD", "date2": "YYYY/MM/DD"}}
-3. "list_debtors_outstanding" -> Args: {{"limit": 5}}
+3. "list_debtors_outstanding" -> Args: {{"limit": 5}} (only those owing over an amount: {{"limit": 20, "min_balance": number}})
 4. "list_all_debtors" -> Args: {{}}
 5. "profile_debtor" -> Args: {{"keyword": "name_or_code"}}
 6. "list_all_stock" -> Args: {{}}
 7. "profile_stock" -> Args: {{"keyword": "item_name_or_code"}}
-8. "create_invoice_fast" -> Args: {{"debtor": "code_or_name", "item": "code_or_name", "qty": number}}
+8. "create_invoice_fast" -> Args: {{"debtor": "code_or_name", "item": "code_or_name", "qty": number}} (several items: {{"debtor": "code_or_name", "lines": [{{"item": "code_or_name", "qty": number}}]}})
+9. "sales_period" -> Args: {{"period": "week|last_week|month|last_month|7d|30d|ytd"}}
+10. "sales_by_debtor" -> Args: {{"period": "week|last_week|month|last_month|7d|30d|ytd", "limit": 5}}
+11. "sales_by_item" -> Args: {{"period": "week|last_week|month|last_month|7d|30d|ytd", "limit": 5}}
+12. "debtor_ageing" -> Args: {{}} (ageing buckets, credit limit exposure, customers over their limit)
 
 CRITICAL: Convert ALL dates to "YYYY/MM/DD" format.
 
 Examples:
 "Sales today" -> {{"intent": "get_sales", "args": {{"date": "{current_date}"}}}}
 "Compare sales 29 Jan vs 12 Aug" -> {{"intent": "compare_sales", "args": {{"date1": "2026/01/29", "date2": "2026/08/12"}}}}
+"Sales this month" -> {{"intent": "sales_period", "args": {{"period": "month"}}}}
+"Top customers last week" -> {{"intent": "sales_by_debtor", "args": {{"period": "last_week", "limit": 5}}}}
+"Best selling items last 30 days" -> {{"intent": "sales_by_item", "args": {{"period": "30d", "limit": 5}}}}
 "Who owes money" -> {{"intent": "list_debtors_outstanding", "args": {{"limit": 5}}}}
+"Debtors owing over RM 10k" -> {{"intent": "list_debtors_outstanding", "args": {{"limit": 20, "min_balance": 10000}}}}
+"Debtor ageing report" -> {{"intent": "debtor_ageing", "args": {{}}}}
 "Get debtor Green" -> {{"intent": "profile_debtor", "args": {{"keyword": "Green"}}}}   <-- ADD THIS LINE
 "Check stock Apple" -> {{"intent": "profile_stock", "args": {{"keyword": "Apple"}}}}
 "Customer list" -> {{"intent": "list_all_debtors", "args": {{}}}}
 "Create invoice for 300-T001 for 5 Apple" -> {{"intent": "create_invoice_fast", "args": {{"debtor": "300-T001", "item": "Apple", "qty": 5}}}}
+"Invoice Green for 5 Apple and 2 Helmet" -> {{"intent": "create_invoice_fast", "args": {{"debtor": "Green", "lines": [{{"item": "Apple", "qty": 5}}, {{"item": "Helmet", "qty": 2}}]}}}}
 """
 
-def interpret_intent(user_text):
+def build_system_prompt():
+    """Dynamic Date Context: rebuilt per call so the date is right after midnight."""
+    now = datetime.now()
+    return SYSTEM_PROMPT_TEMPLATE.format(current_day=now.strftime("%A"), current_date=now.strftime("%Y/%m/%d"))
+
+# Intent names the model may return (mirrors "Available Intents" above)
+INTENTS = [
+    "get_sales", "compare_sales", "list_debtors_outstanding", "list_all_debtors",
+    "profile_debtor", "list_all_stock", "profile_stock", "create_invoice_fast",
+    "sales_period", "sales_by_debtor", "sales_by_item", "debtor_ageing", "unknown"
+]
+
+# Structured output: Ollama constrains decoding to this JSON schema
+INTENT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "intent": {"type": "string", "enum": INTENTS},
+        "args": {"type": "object"}
+    },
+    "required": ["intent", "args"]
+}
+
+# Flipped off if the configured model rejects the `think` flag
+_think_supported = True
+
+def _chat(messages):
+    """One constrained, length-capped, reasoning-free call to the intent model."""
+    global _think_supported
+    import ollama  # deferred: ~0.4 s to import, and most messages never reach the LLM
+    kwargs = dict(
+        model=Config.OLLAMA_MODEL,
+        messages=messages,
+        format=INTENT_SCHEMA,
+        options={"num_predict": Config.OLLAMA_NUM_PREDICT, "temperature": 0},
+        keep_alive=Config.OLLAMA_KEEP_ALIVE
+    )
+    if _think_supported:
+        try:
+            return ollama.chat(think=Config.OLLAMA_THINK, **kwargs)
+        except ollama.ResponseError as e:
+            if "think" not in str(e).lower():
+                raise
+            logger.warning(f"{Config.OLLAMA_MODEL} does not accept the think flag; retrying without it.")
+            _think_supported = False
+    return ollama.chat(**kwargs)
+
+def _parse_content(raw_content):
+    # Constrained output is plain JSON; older models may still wrap it in <think> tags
     try:
-        response = ollama.chat(
-            model=Config.OLLAMA_MODEL,
-            messages=[
-                {'role': 'system', 'content': SYSTEM_PROMPT},
-                {'role': 'user', 'content': user_text},
-            ]
-        )
-        
-        raw_content = response['message']['content']
-        # Clean <think> tags
+        return json.loads(raw_content)
+    except ValueError:
         clean_content = re.sub(r'<think>.*?</think>', '', raw_content, flags=re.DOTALL).strip()
-        
-        # Extract JSON
-        json_match = re.search(r'\{.*\}', clean_content, re.DOTALL)
-        if json_match:
-            return json.loads(json_match.group(0))
-        return json.loads(clean_content)
+        start = clean_content.find('{')
+        # raw_decode stops at the end of the first object instead of greedily matching
+        return json.JSONDecoder().raw_decode(clean_content[start:])[0]
+
+def _interpret_with_llm(user_text):
+    try:
+        response = _chat([
+            {'role': 'system', 'content': build_system_prompt()},
+            {'role': 'user', 'content': user_text},
+        ])
+        return _parse_content(response['message']['content'])
 
     except Exception as e:
         print(f"🧠 AI Parsing Error: {e}")
-        return {"intent": "unknown", "args": {}}
\ No newline at end of file
+        return {"intent": "unknown", "args": {}}
+
+def warm_up_model():
+    """Loads the model into memory at startup so the first user does not pay for it."""
+    started = time.perf_counter()
+    try:
+        import ollama
+        ollama.generate(model=Config.OLLAMA_MODEL, prompt="", keep_alive=Config.OLLAMA_KEEP_ALIVE)
+        logger.info(f"🧠 {Config.OLLAMA_MODEL} warmed up in {(time.perf_counter() - started) * 1000:.0f} ms")
+    except Exception as e:
+        logger.warning(f"🧠 Warm-up of {Config.OLLAMA_MODEL} failed: {e}")
+
+def _classify(user_text):
+    return classify(user_text, debtor_lookup=debtor_cache.lookup, item_lookup=stock_cache.lookup)
+
+def _record_tier(intent_data, tier, started):
+    if not isinstance(intent_data, dict):
+        intent_data = {"intent": "unknown", "args": {}}
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    intent_data["tier"] = tier
+    tracer.annotate(intent=intent_data.get("intent"), tier=tier)
+    TIER_STATS[tier] += 1
+    TIER_LATENCY_MS[tier] += elapsed_ms
+    total = sum(TIER_STATS.values())
+    model = f" model={Config.OLLAMA_MODEL}" if tier == "llm" else ""
+    logger.info(
+        f"Intent '{intent_data.get('intent')}' via {tier} in {elapsed_ms:.1f} ms{model} "
+        f"(avg {TIER_LATENCY_MS[tier] / TIER_STATS[tier]:.1f} ms; LLM avoided for {1 - TIER_STATS['llm'] / total:.0%} of {total})"
+    )
+    return intent_data
+
+def _remember(user_text, intent_data):
+    # Failed/unknown parses are not cached so the next attempt retries the LLM
+    if isinstance(intent_data, dict) and intent_data.get("intent") not in (None, "unknown"):
+        intent_cache.put(user_text, intent_data)
+
+def interpret_intent(user_text):
+    """
+    Maps free text to {"intent", "args", "tier"}.
+    Tier 0 is the intent cache, tier 1 the deterministic rule classifier
+    (checked against cached master data); the LLM is only called when both miss.
+    """
+    started = time.perf_counter()
+    cached = intent_cache.get(user_text)
+    if cached:
+        return _record_tier(cached, "cache", started)
+    intent_data, confidence = _classify(user_text)
+    if confidence >= Config.INTENT_RULE_CONFIDENCE:
+        return _record_tier(intent_data, "rules", started)
+    result = _interpret_with_llm(user_text)
+    _remember(user_text, result)
+    return _record_tier(result, "llm", started)
+
+async def interpret_intent_async(user_id, user_text, on_status=None):
+    """
+    Non-blocking interpret_intent for the handlers. Cache and rules run inline;
+    LLM calls go through inference_queue (may raise QueueFull or Superseded);
+    the time spent there is not charged to the caller's request budget.
+    """
+    started = time.perf_counter()
+    with tracer.span("intent.cache"):
+        cached = intent_cache.get(user_text)
+    if cached:
+        return _record_tier(cached, "cache", started)
+    with tracer.span("intent.rules") as span:
+        intent_data, confidence = _classify(user_text)
+        span["confidence"] = confidence
+    if confidence >= Config.INTENT_RULE_CONFIDENCE:
+        return _record_tier(intent_data, "rules", started)
+    with tracer.span("intent.llm", model=Config.OLLAMA_MODEL), budget_paused():
+        result = await inference_queue.submit(user_id, _interpret_with_llm, user_text, on_status=on_status)
+    _remember(user_text, result)
+    return _record_tier(result, "llm", started)
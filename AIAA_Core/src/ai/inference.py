@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from src.config import Config
+
+logger = logging.getLogger(__name__)
+
+class QueueFull(Exception):
+    """Raised when more than Config.INFERENCE_QUEUE_SIZE requests are waiting."""
+
+class Superseded(Exception):
+    """Raised when a newer message from the same user replaced this request."""
+
+class _Ticket:
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.cancelled = False
+        self.wake = asyncio.Event()
+        self.future = None  # concurrent.futures.Future once it has a slot
+
+class InferenceQueue:
+    """
+    Runs blocking LLM calls on a dedicated thread pool behind a bounded FIFO.
+
+    At most `workers` inferences run at once (matched to CPU cores); at most
+    `max_pending` wait behind them. A newer request from the same user
+    supersedes an older one: if the old one is still queued it never runs,
+    if it is already running its result is discarded. A slot is only freed
+    when the pool thread is actually done, so a superseded call that is still
+    running keeps counting against `workers`.
+    """
+    def __init__(self, workers, max_pending, status_interval):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.status_interval = status_interval
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm")
+        self._waiting = []
+        self._running = 0
+        self._latest = {}
+
+    def _release(self, _future=None):
+        self._running -= 1
+        self._notify()
+
+    def _notify(self):
+        for ticket in self._waiting:
+            ticket.wake.set()
+
+    def position(self, ticket):
+        return self._waiting.index(ticket) + 1 if ticket in self._waiting else 0
+
+    def stats(self):
+        return {"running": self._running, "waiting": len(self._waiting), "workers": self.workers}
+
+    async def _wait_for_slot(self, ticket, on_status):
+        last_position = None
+        while True:
+            if ticket.cancelled:
+                raise Superseded()
+            if self._running < self.workers and self._waiting and self._waiting[0] is ticket:
+                return
+            position = self.position(ticket)
+            if on_status and position != last_position:
+                last_position = position
+                await on_status("queued", position)
+            ticket.wake.clear()
+            await ticket.wake.wait()
+
+    async def submit(self, user_id, fn, *args, on_status=None):
+        """
+        Runs fn(*args) on the pool and returns its result.
+        on_status(state, value) is awaited with ("queued", position) while
+        waiting and ("thinking", seconds) while the model is running.
+        """
+        if len(self._waiting) >= self.max_pending:
+            raise QueueFull()
+
+        previous = self._latest.get(user_id)
+        if previous is not None:
+            previous.cancelled = True
+            previous.wake.set()
+            if previous.future is not None:
+                previous.future.cancel()  # only stops it if the pool has not started it
+        ticket = _Ticket(user_id)
+        self._latest[user_id] = ticket
+        self._waiting.append(ticket)
+        self._notify()
+
+        try:
+            await self._wait_for_slot(ticket, on_status)
+        finally:
+            self._waiting.remove(ticket)
+            self._notify()
+
+        loop = asyncio.get_running_loop()
+        self._running += 1
+        ticket.future = self._executor.submit(fn, *args)
+        # Runs on the pool thread (or here, if cancelled before starting)
+        ticket.future.add_done_callback(lambda f: loop.call_soon_threadsafe(self._release, f))
+        result_future = asyncio.wrap_future(ticket.future)
+        started = time.monotonic()
+        try:
+            while not ticket.cancelled:
+                ticket.wake.clear()
+                superseded = asyncio.ensure_future(ticket.wake.wait())
+                try:
+                    done, _ = await asyncio.wait({result_future, superseded}, timeout=self.status_interval, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    superseded.cancel()
+                if result_future in done:
+                    result = result_future.result()
+                    break
+                if not done and on_status:
+                    await on_status("thinking", int(time.monotonic() - started))
+        finally:
+            if self._latest.get(user_id) is ticket:
+                del self._latest[user_id]
+
+        if ticket.cancelled:
+            raise Superseded()
+        return result
+
+# Singleton Instance
+inference_queue = InferenceQueue(
+    workers=Config.INFERENCE_WORKERS,
+    max_pending=Config.INFERENCE_QUEUE_SIZE,
+    status_interval=Config.INFERENCE_STATUS_INTERVAL
+)
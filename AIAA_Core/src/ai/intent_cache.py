@@ -0,0 +1,112 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from src.config import Config
+
+logger = logging.getLogger(__name__)
+
+_PUNCT_RE = re.compile(r"[^\w\s/\-.]")
+
+class IntentCache:
+    """
+    LRU + TTL cache of parsed intents, keyed on normalised text plus today's
+    date (relative dates like "sales today" resolve differently each day).
+    Persisted to a JSON file so it survives restarts: every `save_interval`
+    seconds by a JobQueue job (flush) and on shutdown, never from put().
+    """
+    def __init__(self, path, max_entries, ttl, save_interval=30):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.save_interval = save_interval
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.load()
+
+    @staticmethod
+    def key(user_text, day=None):
+        day = day or datetime.now().strftime("%Y/%m/%d")
+        text = _PUNCT_RE.sub("", user_text.lower())
+        return f"{day}|{' '.join(text.split())}"
+
+    def get(self, user_text):
+        key = self.key(user_text)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.time() - entry[0] < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return dict(entry[1])
+            if entry:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, user_text, intent_data):
+        with self._lock:
+            key = self.key(user_text)
+            self._entries[key] = (time.time(), {"intent": intent_data.get("intent"), "args": intent_data.get("args", {})})
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._dirty = True
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+    # --- PERSISTENCE ---
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                rows = json.load(f)
+            now = time.time()
+            for key, stored_at, intent_data in rows[-self.max_entries:]:
+                if now - stored_at < self.ttl:
+                    self._entries[key] = (stored_at, intent_data)
+            logger.info(f"Loaded {len(self._entries)} cached intents from {self.path}")
+        except Exception as e:
+            logger.error(f"Intent cache load failed ({self.path}): {e}")
+
+    def save(self):
+        """Atomic write (temp file + rename) so a crash never leaves a torn file."""
+        with self._lock:
+            if not self._dirty:
+                return
+            rows = [[key, stored_at, data] for key, (stored_at, data) in self._entries.items()]
+            self._dirty = False
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(rows, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.error(f"Intent cache save failed ({self.path}): {e}")
+
+    async def flush(self, context=None):
+        """JobQueue callback (repeating): saves new entries in a worker thread, off the event loop."""
+        await asyncio.to_thread(self.save)
+
+# Singleton Instance
+intent_cache = IntentCache(
+    path=Config.INTENT_CACHE_PATH,
+    max_entries=Config.INTENT_CACHE_SIZE,
+    ttl=Config.INTENT_CACHE_TTL
+)
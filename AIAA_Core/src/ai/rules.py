@@ -0,0 +1,212 @@
+import re
+from datetime import datetime, timedelta
+
+# Deterministic pre-classifier for the intents in SYSTEM_PROMPT.
+# Each rule returns (intent_data, confidence); interpret_intent only falls
+# back to the LLM when the best confidence is below Config.INTENT_RULE_CONFIDENCE.
+
+MONTHS = {
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6,
+    "jul": 7, "aug": 8, "sep": 9, "oct": 10, "nov": 11, "dec": 12
+}
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+_MONTH_RE = r"(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*"
+_DATE_PATTERNS = [
+    # 2026/01/29, 2026-01-29
+    (re.compile(r"\b(\d{4})[/-](\d{1,2})[/-](\d{1,2})\b"), lambda m: (int(m[1]), int(m[2]), int(m[3]))),
+    # 29/01/2026, 29-01-2026 (day first, local convention)
+    (re.compile(r"\b(\d{1,2})[/-](\d{1,2})[/-](\d{4})\b"), lambda m: (int(m[3]), int(m[2]), int(m[1]))),
+    # 29 Jan, 29 January 2026
+    (re.compile(r"\b(\d{1,2})(?:st|nd|rd|th)?\s+" + _MONTH_RE + r"(?:\s+(\d{4}))?\b"), lambda m: (m[3], MONTHS[m[2]], int(m[1]))),
+    # Jan 29, January 29 2026
+    (re.compile(r"\b" + _MONTH_RE + r"\s+(\d{1,2})(?:st|nd|rd|th)?(?:,?\s+(\d{4}))?\b"), lambda m: (m[3], MONTHS[m[1]], int(m[2]))),
+]
+# Anything shaped like a numeric date, valid or not ("2026/13/45", "31/2")
+_DATE_TOKEN_RE = re.compile(r"\b\d{1,4}[/-]\d{1,2}(?:[/-]\d{1,4})?\b")
+_RELATIVE_RE = re.compile(r"\b(today|yesterday|(?:last\s+)?(?:monday|tuesday|wednesday|thursday|friday|saturday|sunday))\b")
+
+_PERIOD_PATTERNS = [
+    (re.compile(r"\blast\s+week\b"), "last_week"),
+    (re.compile(r"\blast\s+month\b"), "last_month"),
+    (re.compile(r"\b(?:last|past)\s+7\s+days\b"), "7d"),
+    (re.compile(r"\b(?:last|past)\s+30\s+days\b"), "30d"),
+    (re.compile(r"\b(?:this\s+week|week\s+to\s+date|wtd)\b"), "week"),
+    (re.compile(r"\b(?:this\s+month|month\s+to\s+date|mtd)\b"), "month"),
+    (re.compile(r"\b(?:this\s+year|year\s+to\s+date|ytd)\b"), "ytd"),
+]
+
+# "invoice (for) <debtor> for 5 apple, 2 helmet and 3 cable": one line per "<qty> <item>"
+_INVOICE_RE = re.compile(r"\binvoice\s+(?:(?:for|to)\s+)?(.+?)\s+for\s+(\d+(?:\.\d+)?\s*.+)$", re.IGNORECASE)
+_INVOICE_LINE_RE = re.compile(r"(\d+(?:\.\d+)?)\s*(?:(?:x|pcs|units?)\s+)?(?:of\s+)?(.+?)\s*(?=(?:,|&|\+|\band\b)\s*\d|$)", re.IGNORECASE)
+
+_CODE_RE = re.compile(r"\b[a-z0-9][a-z0-9\-/.]*\d[a-z0-9\-/.]*\b|\b[a-z]{2,}\d*\b", re.IGNORECASE)
+
+def _fmt(dt):
+    return dt.strftime("%Y/%m/%d")
+
+def _absolute_dates(text, now):
+    """(found, spans): parsed (offset, YYYY/MM/DD) pairs, and the spans of every match that parsed."""
+    found, spans = [], []
+    for pattern, parts in _DATE_PATTERNS:
+        for m in pattern.finditer(text):
+            year, month, day = parts(m)
+            try:
+                found.append((m.start(), _fmt(datetime(int(year) if year else now.year, month, day))))
+                spans.append(m.span())
+            except ValueError:
+                continue
+    return found, spans
+
+def has_unreadable_date(text, now=None):
+    """True if `text` mentions something date-like that find_dates cannot read ("2026/13/45", "31 feb")."""
+    now = now or datetime.now()
+    _, spans = _absolute_dates(text, now)
+    parsed = lambda m: any(start <= m.start() < end for start, end in spans)
+    if any(not parsed(m) for m in _DATE_TOKEN_RE.finditer(text)):
+        return True
+    return any(not parsed(m) for pattern, _ in _DATE_PATTERNS for m in pattern.finditer(text))
+
+def find_dates(text, now=None):
+    """All dates mentioned in `text`, in order of appearance, as YYYY/MM/DD."""
+    now = now or datetime.now()
+    found, _ = _absolute_dates(text, now)
+
+    for m in _RELATIVE_RE.finditer(text):
+        word = m.group(1)
+        if word == "today":
+            dt = now
+        elif word == "yesterday":
+            dt = now - timedelta(days=1)
+        else:
+            # Most recent past occurrence of that weekday
+            target = WEEKDAYS.index(word.split()[-1])
+            dt = now - timedelta(days=(now.weekday() - target) % 7 or 7)
+        found.append((m.start(), _fmt(dt)))
+
+    # Overlapping patterns (e.g. "29 jan 2026") can hit twice at different offsets
+    result = []
+    for _, date in sorted(found):
+        if date not in result:
+            result.append(date)
+    return result
+
+def find_period(text):
+    """The first reporting period named in `text` (a key of analytics.PERIODS), or None."""
+    found = [(m.start(), period) for pattern, period in _PERIOD_PATTERNS for m in [pattern.search(text)] if m]
+    return min(found)[1] if found else None
+
+def _limit(text, default=5):
+    m = re.search(r"\btop\s+(\d+)\b", text)
+    return int(m.group(1)) if m else default
+
+_AMOUNT_RE = re.compile(r"\b(?:over|above|more\s+than|exceeding|greater\s+than)\s*(?:rm\s*)?(\d[\d,]*(?:\.\d+)?)\s*(k|m)?\b")
+
+def _min_amount(text):
+    """"owing over RM 10k" -> 10000.0; None without an amount."""
+    m = _AMOUNT_RE.search(text)
+    if not m:
+        return None
+    return float(m.group(1).replace(",", "")) * {"k": 1e3, "m": 1e6}.get(m.group(2), 1)
+
+# Keyword taken from the words after "stock"/"customer" without a known code
+# behind it: only a hint, scored below Config.INTENT_RULE_CONFIDENCE so the LLM
+# decides ("how much stock do we have left", "add a new customer called Acme")
+_GUESS = 0.6
+
+def _known_code(text, lookup):
+    """First token in `text` that is an exact code in the cached master data."""
+    if lookup is None:
+        return None
+    for m in _CODE_RE.finditer(text):
+        row = lookup(m.group(0))
+        if row is not None:
+            return m.group(0)
+    return None
+
+def _tail(text, words):
+    """Text after the first of `words` (e.g. 'stock for Apple' -> 'Apple')."""
+    m = re.search(r"\b(?:" + "|".join(words) + r")\b(?:\s+(?:for|of|on|about|info|details|profile))*\s+(.+)$", text, re.IGNORECASE)
+    if not m:
+        return None
+    tail = m.group(1).strip(" ?.!")
+    return tail or None
+
+def classify(user_text, debtor_lookup=None, item_lookup=None, now=None):
+    """
+    Returns (intent_data, confidence) for `user_text`.
+    debtor_lookup / item_lookup are exact-code lookups against cached master data.
+    """
+    # `original` keeps the user's casing for keywords shown back to them
+    original = " ".join(user_text.split())
+    text = original.lower()
+    dates = find_dates(text, now)
+    today = _fmt(now or datetime.now())
+
+    # --- FAST TRACK INVOICE: "invoice for 300-T001 for 5 apple" (or "5 apple, 2 helmet and 3 cable") ---
+    m = _INVOICE_RE.search(original)
+    if m:
+        lines = [{"item": item.strip(" ?.!,"), "qty": float(qty)} for qty, item in _INVOICE_LINE_RE.findall(m.group(2))]
+        if len(lines) > 1:
+            return {"intent": "create_invoice_fast", "args": {"debtor": m.group(1), "lines": lines}}, 0.95
+        if lines:
+            return {"intent": "create_invoice_fast", "args": {"debtor": m.group(1), **lines[0]}}, 0.95
+
+    # --- SALES ANALYTICS: "best selling items this month", "top buyers last week" ---
+    period = find_period(text)
+    ranked = re.search(r"\b(top|best|biggest|most)\b", text)
+    if ranked and re.search(r"\b(items?|products?|sellers?|selling|sold)\b", text) and not re.search(r"\b(customers?|debtors?|clients?|buyers?)\b", text):
+        return {"intent": "sales_by_item", "args": {"period": period or "month", "limit": _limit(text)}}, 0.9 if period else 0.85
+    if ranked and re.search(r"\b(customers?|debtors?|clients?|buyers?)\b", text) and (period or re.search(r"\b(buyers?|sales|revenue|bought)\b", text)):
+        return {"intent": "sales_by_debtor", "args": {"period": period or "month", "limit": _limit(text)}}, 0.9 if period else 0.85
+    if period and re.search(r"\b(sales|revenue|sold|turnover)\b", text):
+        return {"intent": "sales_period", "args": {"period": period}}, 0.95
+
+    # --- SALES ---
+    if re.search(r"\b(sales|revenue|sold|turnover)\b", text):
+        if has_unreadable_date(text, now):
+            # Never answer for a different day than the one asked about; the LLM may read it
+            return {"intent": "unknown", "args": {}}, 0.0
+        if len(dates) >= 2 and re.search(r"\b(compare|vs|versus|against)\b", text):
+            return {"intent": "compare_sales", "args": {"date1": dates[0], "date2": dates[1]}}, 0.95
+        if len(dates) == 1:
+            return {"intent": "get_sales", "args": {"date": dates[0]}}, 0.95
+        if not dates and not re.search(r"\b(compare|vs|versus|week|month|year)\b", text):
+            return {"intent": "get_sales", "args": {"date": today}}, 0.85
+
+    # --- DEBTORS ---
+    if re.search(r"\b(age?ing|aged\s+(?:debtors?|receivables?|debts?)|credit\s+(?:exposure|utili[sz]ation)|(?:over|above|exceed(?:ed|ing)?)\s+(?:their\s+|the\s+)?(?:credit\s+)?limits?)\b", text):
+        return {"intent": "debtor_ageing", "args": {}}, 0.9
+    if re.search(r"\b(owes?|owing|outstanding|overdue|(?:top|biggest)\s+(?:\d+\s+)?(?:debtors?|customers?))\b", text):
+        min_balance = _min_amount(text)
+        if min_balance:
+            return {"intent": "list_debtors_outstanding", "args": {"limit": _limit(text, 20), "min_balance": min_balance}}, 0.9
+        return {"intent": "list_debtors_outstanding", "args": {"limit": _limit(text)}}, 0.9
+
+    if re.search(r"\b(customer|debtor|client)s?\s+(list|directory)\b|\b(all|list)\s+(customers|debtors|clients)\b", text):
+        return {"intent": "list_all_debtors", "args": {}}, 0.9
+
+    # --- STOCK ---
+    if re.search(r"\b(stock|item|product)s?\s+(list|catalog|catalogue)\b|\b(all|list)\s+(stock|items|products)\b|\binventory\b|\bcatalog(ue)?\b", text):
+        return {"intent": "list_all_stock", "args": {}}, 0.9
+
+    item_code = _known_code(original, item_lookup)
+    debtor_code = _known_code(original, debtor_lookup)
+
+    if re.search(r"\b(stock|qty|quantity|price|item)\b", text):
+        keyword = item_code or _tail(original, ["stock", "qty", "quantity", "price", "item"])
+        if keyword:
+            return {"intent": "profile_stock", "args": {"keyword": keyword}}, 0.9 if item_code else _GUESS
+
+    if re.search(r"\b(debtor|customer|client)\b", text):
+        keyword = debtor_code or _tail(original, ["debtor", "customer", "client"])
+        if keyword:
+            return {"intent": "profile_debtor", "args": {"keyword": keyword}}, 0.9 if debtor_code else _GUESS
+
+    # A bare code with no keywords ("HLMINK", "300-T001")
+    if item_code and len(text.split()) <= 2:
+        return {"intent": "profile_stock", "args": {"keyword": item_code}}, 0.85
+    if debtor_code and len(text.split()) <= 2:
+        return {"intent": "profile_debtor", "args": {"keyword": debtor_code}}, 0.85
+
+    return {"intent": "unknown", "args": {}}, 0.0
@@ -0,0 +1,473 @@
+import asyncio
+import calendar
+import threading
+import time
+from datetime import date, datetime, timedelta
+import numpy as np
+import pandas as pd
+from src.config import Config
+from src.api.client import api_client, async_api_client
+from src.api.resilience import detached, wait_shared
+from src.api.sales import INVOICE_LIST_ENDPOINT
+import src.api.sales as sales_api
+from src.api.records import InvoiceHeader
+import src.api.debtor as debtor_api
+from src.tracing import tracer
+
+# Period analytics: totals and trends come from the daily sales rollup
+# (src/api/sales.py), so only its open days are fetched again; the debtor and
+# item breakdowns need raw invoices, fetched once per period (see BREAKDOWNS).
+# Aggregation is vectorised in pandas.
+
+PERIODS = {
+    "week": "This Week",
+    "last_week": "Last Week",
+    "month": "Month to Date",
+    "last_month": "Last Month",
+    "7d": "Last 7 Days",
+    "30d": "Last 30 Days",
+    "ytd": "Year to Date",
+}
+
+def _shift_month(d, months):
+    month_index = d.month - 1 + months
+    year, month = d.year + month_index // 12, month_index % 12 + 1
+    return date(year, month, min(d.day, calendar.monthrange(year, month)[1]))
+
+def resolve_period(period, today=None):
+    """
+    Returns (start, end, prev_start, prev_end) as dates for a PERIODS key.
+    Open periods (week, month, ytd) compare against the same number of days
+    in the previous period, so part-weeks are compared like for like.
+    """
+    today = today or date.today()
+    if period == "week":
+        start = today - timedelta(days=today.weekday())
+        return start, today, start - timedelta(days=7), today - timedelta(days=7)
+    if period == "last_week":
+        start = today - timedelta(days=today.weekday() + 7)
+        return start, start + timedelta(days=6), start - timedelta(days=7), start - timedelta(days=1)
+    if period == "month":
+        start = today.replace(day=1)
+        return start, today, _shift_month(start, -1), _shift_month(today, -1)
+    if period == "last_month":
+        end = today.replace(day=1) - timedelta(days=1)
+        start = end.replace(day=1)
+        prev_end = start - timedelta(days=1)
+        return start, end, prev_end.replace(day=1), prev_end
+    if period in ("7d", "30d"):
+        days = int(period[:-1])
+        start = today - timedelta(days=days - 1)
+        return start, today, start - timedelta(days=days), start - timedelta(days=1)
+    if period == "ytd":
+        start = today.replace(month=1, day=1)
+        return start, today, start.replace(year=start.year - 1), _shift_month(today, -12)
+    raise ValueError(f"Unknown period: {period}")
+
+def _days(start, end):
+    """YYYY/MM/DD strings from start to end (inclusive)."""
+    return [(start + timedelta(days=n)).strftime("%Y/%m/%d") for n in range((end - start).days + 1)]
+
+def _payload(start, end):
+    return {"DateFrom": start.strftime("%Y/%m/%d"), "DateTo": end.strftime("%Y/%m/%d")}
+
+def _rows(response):
+    if response and isinstance(response, dict):
+        return response.get("ResultTable", [])
+    return None
+
+def fetch_invoices(start, end):
+    """All invoice headers between two dates (inclusive), or None on API failure."""
+    return _rows(api_client.post(INVOICE_LIST_ENDPOINT, json_payload=_payload(start, end)))
+
+async def fetch_invoices_async(start, end):
+    """Async version of fetch_invoices; streamed, so a month of invoices is parsed chunk by chunk instead of in one call on the event loop."""
+    stream = await async_api_client.stream_rows(INVOICE_LIST_ENDPOINT, json_payload=_payload(start, end))
+    return await stream.take() if stream is not None else None
+
+# --- FRAMES ---
+
+def _numeric(df, *columns):
+    """First present numeric column (e.g. FinalTotal, else NetTotal), as float."""
+    result = pd.Series(np.nan, index=df.index)
+    for column in columns:
+        if column in df:
+            result = result.fillna(pd.to_numeric(df[column], errors="coerce"))
+    return result.fillna(0.0)
+
+def invoice_frame(rows):
+    """Invoice headers -> DataFrame[doc_no, day, debtor, debtor_name, amount, cancelled]."""
+    df = pd.DataFrame.from_records(rows or [])
+    if df.empty:
+        return pd.DataFrame({
+            "doc_no": pd.Series(dtype=object), "day": pd.Series(dtype="datetime64[ns]"),
+            "debtor": pd.Series(dtype=object), "debtor_name": pd.Series(dtype=object),
+            "amount": pd.Series(dtype=float), "cancelled": pd.Series(dtype=bool),
+        })
+    return pd.DataFrame({
+        "doc_no": df.get("DocNo"),
+        "day": pd.to_datetime(df["DocDate"].astype(str).str[:10], errors="coerce"),
+        "debtor": df.get("DebtorCode", pd.Series("", index=df.index)).fillna(""),
+        "debtor_name": df.get("DebtorName", df.get("DebtorCode", pd.Series("", index=df.index))).fillna(""),
+        "amount": _numeric(df, "FinalTotal", "NetTotal"),
+        "cancelled": df.get("Cancelled", pd.Series("F", index=df.index)).eq("T"),
+    })
+
+def line_frame(rows):
+    """Invoice detail lines (IVDTL) -> DataFrame[day, item, description, qty, amount]; empty if absent."""
+    records = [row for row in rows or [] if isinstance(row.get("IVDTL"), list) and row.get("Cancelled") != "T"]
+    if not records:
+        return pd.DataFrame({
+            "day": pd.Series(dtype="datetime64[ns]"), "item": pd.Series(dtype=object),
+            "description": pd.Series(dtype=object), "qty": pd.Series(dtype=float), "amount": pd.Series(dtype=float),
+        })
+    lines = pd.json_normalize(records, record_path="IVDTL", meta=["DocDate"], errors="ignore")
+    qty = _numeric(lines, "Qty")
+    amount = _numeric(lines, "SubTotal", "SubTotalExTax", "Amount")
+    # Lines without an amount fall back to qty x unit price
+    amount = amount.where(amount != 0, qty * _numeric(lines, "UnitPrice"))
+    return pd.DataFrame({
+        "day": pd.to_datetime(lines["DocDate"].astype(str).str[:10], errors="coerce"),
+        "item": lines.get("ItemCode", pd.Series("", index=lines.index)).fillna(""),
+        "description": lines.get("Description", lines.get("ItemCode", pd.Series("", index=lines.index))).fillna(""),
+        "qty": qty,
+        "amount": amount,
+    })
+
+def daily_frame(totals):
+    """Daily rollup rows ({day: {"sales", "count", "cancelled"}}) -> DataFrame[day, sales, count, cancelled]."""
+    days = sorted(totals)
+    return pd.DataFrame({
+        "day": pd.to_datetime(pd.Series(days, dtype=object), format="%Y/%m/%d", errors="coerce"),
+        "sales": np.array([totals[d]["sales"] for d in days], dtype=float),
+        "count": np.array([totals[d]["count"] for d in days], dtype=int),
+        "cancelled": np.array([totals[d]["cancelled"] for d in days], dtype=int),
+    })
+
+def _daily_from_rows(rows):
+    """Invoice headers -> the same per-day frame as daily_frame."""
+    df = invoice_frame(rows)
+    active = ~df["cancelled"]
+    return pd.DataFrame({
+        "day": df["day"], "sales": df["amount"].where(active, 0.0),
+        "count": active.astype(int), "cancelled": df["cancelled"].astype(int),
+    }).groupby("day", as_index=False).sum()
+
+def _between(df, start, end):
+    return df[(df["day"] >= pd.Timestamp(start)) & (df["day"] <= pd.Timestamp(end))]
+
+def _change(current, previous):
+    return (current - previous) / previous * 100 if previous else None
+
+# --- REPORTS ---
+
+@tracer.traced("analytics.period_report")
+def period_report(daily, period, today=None):
+    """Totals, breakdown and period-over-period change for one PERIODS key, from a daily_frame."""
+    start, end, prev_start, prev_end = resolve_period(period, today)
+    current, previous = _between(daily, start, end), _between(daily, prev_start, prev_end)
+    count, prev_count = int(current["count"].sum()), int(previous["count"].sum())
+
+    # Daily breakdown for short periods, weekly for months, monthly for the year
+    span = (end - start).days + 1
+    rule = "D" if span <= 10 else "W-MON" if span <= 62 else "MS"
+    label = "%d %b" if rule != "MS" else "%b %Y"
+    series = pd.Series(dtype=float)
+    if count:
+        # closed/label "left": weekly bins run Monday..Sunday and are labelled by their Monday
+        sold = current[current["count"] > 0]
+        series = sold.set_index("day")["sales"].resample(rule, closed="left", label="left").sum()
+
+    sales, prev_sales = float(current["sales"].sum()), float(previous["sales"].sum())
+    return {
+        "period": period,
+        "label": PERIODS[period],
+        "start": start.strftime("%Y/%m/%d"),
+        "end": end.strftime("%Y/%m/%d"),
+        "sales": sales,
+        "count": count,
+        "cancelled": int(current["cancelled"].sum()),
+        "avg_invoice": sales / count if count else 0.0,
+        "prev_sales": prev_sales,
+        "prev_count": prev_count,
+        "change_pct": _change(sales, prev_sales),
+        "breakdown": [(ts.strftime(label), float(v)) for ts, v in series.items()],
+    }
+
+def period_report_from_rows(rows, period, today=None):
+    """period_report over raw invoice headers instead of the rollup (scripts, tests)."""
+    return period_report(_daily_from_rows(rows), period, today)
+
+@tracer.traced("analytics.period_sums")
+def period_sums(rows, period, today=None):
+    """Per-debtor and per-item sales in the period: what debtor_breakdown and item_breakdown rank."""
+    start, end, _, _ = resolve_period(period, today)
+    invoices = _between(invoice_frame(rows), start, end)
+    invoices = invoices[~invoices["cancelled"]]
+    lines = _between(line_frame(rows), start, end)
+    return {
+        "total": float(invoices["amount"].sum()),
+        "debtors": invoices.groupby(["debtor", "debtor_name"], sort=False)["amount"].agg(["sum", "count"]),
+        "items": lines.groupby(["item", "description"], sort=False)[["amount", "qty"]].sum(),
+        "has_lines": not lines.empty,
+    }
+
+def debtor_breakdown(sums, period, limit=5):
+    """Top debtors by sales in the period, with their share of total."""
+    total = sums["total"]
+    grouped = sums["debtors"].nlargest(limit, "sum")
+    return {
+        "period": period, "label": PERIODS[period], "total": total,
+        "rows": [
+            {"code": code, "name": name, "sales": float(r["sum"]), "count": int(r["count"]),
+             "share": float(r["sum"]) / total * 100 if total else 0.0}
+            for (code, name), r in grouped.iterrows()
+        ]
+    }
+
+def item_breakdown(sums, period, limit=5):
+    """Top items by sales in the period (requires IVDTL lines in the GetInvoice response)."""
+    grouped = sums["items"].nlargest(limit, "amount")
+    return {
+        "period": period, "label": PERIODS[period], "has_lines": sums["has_lines"],
+        "rows": [
+            {"code": code, "name": name, "sales": float(r["amount"]), "qty": float(r["qty"])}
+            for (code, name), r in grouped.iterrows()
+        ]
+    }
+
+def _fetch_window(period, with_previous):
+    start, end, prev_start, _ = resolve_period(period)
+    return (prev_start if with_previous else start), end
+
+# Aggregation runs in a worker thread so large periods don't stall the bot
+
+async def sales_period_report_async(period):
+    """Totals and period-over-period change for a PERIODS key (from the daily rollup), or None on API failure."""
+    start, end = _fetch_window(period, with_previous=True)
+    totals = await sales_api.get_daily_totals_async(_days(start, end))
+    return await asyncio.to_thread(lambda: period_report(daily_frame(totals), period)) if totals is not None else None
+
+def sales_period_report(period):
+    """Sync version of sales_period_report_async (scripts, benchmarks)."""
+    start, end = _fetch_window(period, with_previous=True)
+    totals = sales_api.get_daily_totals(_days(start, end))
+    return period_report(daily_frame(totals), period) if totals is not None else None
+
+# --- BREAKDOWNS ---
+# Top debtors and top items need raw invoices: one streamed GetInvoice per
+# period feeds both. The sums (not the rows) are kept for ANALYTICS_MAX_AGE
+# seconds, and concurrent requests for a period share one download.
+
+_sums = {}  # period -> (day, built_at, sums)
+_sums_in_flight = {}
+
+async def _build_period_sums(period):
+    start, end = _fetch_window(period, with_previous=False)
+    rows = await fetch_invoices_async(start, end)
+    if rows is None:
+        return None
+    sums = await asyncio.to_thread(period_sums, rows, period)
+    _sums[period] = (date.today(), time.monotonic(), sums)
+    return sums
+
+async def period_sums_async(period):
+    """period_sums for a PERIODS key, reused for ANALYTICS_MAX_AGE seconds; None on API failure."""
+    cached = _sums.get(period)
+    if cached and cached[0] == date.today() and time.monotonic() - cached[1] < Config.ANALYTICS_MAX_AGE:
+        return cached[2]
+    if period not in _sums_in_flight:
+        task = _sums_in_flight[period] = detached(_build_period_sums(period), Config.REQUEST_BUDGET)
+        task.add_done_callback(lambda _: _sums_in_flight.pop(period, None))
+    return await wait_shared(_sums_in_flight[period])
+
+async def sales_by_debtor_async(period, limit=5):
+    """Top debtors by sales for a PERIODS key, or None on API failure."""
+    sums = await period_sums_async(period)
+    return debtor_breakdown(sums, period, limit) if sums is not None else None
+
+async def sales_by_item_async(period, limit=5):
+    """Top items by sales for a PERIODS key, or None on API failure."""
+    sums = await period_sums_async(period)
+    return item_breakdown(sums, period, limit) if sums is not None else None
+
+# --- AGEING & CREDIT EXPOSURE ---
+# GetInvoice rows carry no payment allocation, so each debtor's balance is
+# allocated to their newest invoices first (payments settle the oldest): the
+# open part of an invoice is what is left of the balance after every newer
+# invoice, capped at its amount. Only the last 90 days are fetched - balance
+# those invoices do not explain is older, i.e. 90+. The report is computed
+# once per day and shared by the intent, the menu button and the CSV.
+
+AGEING_BUCKETS = ("0-30", "31-60", "61-90", "90+")
+_BUCKET_EDGES = np.array([30, 60, 90])
+_ageing = {"day": None, "report": None, "at": 0.0}
+_ageing_lock = asyncio.Lock()
+_ageing_thread_lock = threading.Lock()
+
+def _ageing_window(today):
+    return today - timedelta(days=int(_BUCKET_EDGES[-1])), today
+
+class _OpenInvoices:
+    """Column buffers for the invoices of debtors with a balance, filled while streaming."""
+    def __init__(self, codes):
+        self.codes = codes
+        self.debtors, self.days, self.amounts = [], [], []
+
+    def add(self, rows):
+        for row in rows:
+            inv = InvoiceHeader.from_row(row)
+            if inv.cancelled or inv.debtor_code not in self.codes:
+                continue
+            self.debtors.append(inv.debtor_code)
+            self.days.append(inv.day)
+            self.amounts.append(inv.total)
+
+def _owing(debtors):
+    return {d.acc_no for d in debtors if d.balance > 0}
+
+def _fetch_open_invoices(start, end, codes):
+    stream = api_client.stream_rows(INVOICE_LIST_ENDPOINT, json_payload=_payload(start, end))
+    if stream is None:
+        return None
+    invoices = _OpenInvoices(codes)
+    for batch in stream.batches():
+        invoices.add(batch)
+    return invoices if stream.complete else None
+
+async def _fetch_open_invoices_async(start, end, codes):
+    stream = await async_api_client.stream_rows(INVOICE_LIST_ENDPOINT, json_payload=_payload(start, end))
+    if stream is None:
+        return None
+    invoices = _OpenInvoices(codes)
+    async for batch in stream.batches():
+        invoices.add(batch)
+    return invoices if stream.complete else None
+
+@tracer.traced("analytics.ageing")
+def ageing_frame(debtors, invoices, today=None):
+    """
+    One row per debtor with a balance: the balance split into AGEING_BUCKETS,
+    credit limit, utilisation (balance / limit, NaN without a limit) and an
+    over-limit flag. Sorted by balance, highest first.
+    """
+    today = today or date.today()
+    owing = [d for d in debtors if d.balance > 0]
+    table = pd.DataFrame({
+        "acc_no": [d.acc_no for d in owing],
+        "company_name": [d.company_name for d in owing],
+        "balance": np.array([d.balance for d in owing], dtype=float),
+        "credit_limit": np.array([d.credit_limit for d in owing], dtype=float),
+        "credit_term": [d.credit_term for d in owing],
+    })
+
+    inv = pd.DataFrame({
+        "acc_no": invoices.debtors,
+        "day": pd.to_datetime(pd.Series(invoices.days, dtype=object), format="%Y/%m/%d", errors="coerce"),
+        "amount": np.array(invoices.amounts, dtype=float),
+    }).dropna(subset=["day"])
+    # Newest first within each debtor; `newer` = total of the debtor's more recent invoices
+    inv = inv.sort_values(["acc_no", "day"], ascending=[True, False], kind="stable")
+    inv["balance"] = inv["acc_no"].map(table.set_index("acc_no")["balance"])
+    newer = inv.groupby("acc_no", sort=False)["amount"].cumsum() - inv["amount"]
+    inv["open"] = np.minimum(np.maximum(inv["balance"].to_numpy() - newer.to_numpy(), 0.0), inv["amount"].to_numpy())
+    age = (pd.Timestamp(today) - inv["day"]).dt.days.to_numpy()
+    inv["bucket"] = np.searchsorted(_BUCKET_EDGES, age, side="left")
+
+    buckets = (
+        inv.groupby(["acc_no", "bucket"])["open"].sum().unstack(fill_value=0.0)
+        .reindex(columns=range(len(AGEING_BUCKETS)), fill_value=0.0)
+    )
+    buckets.columns = list(AGEING_BUCKETS)
+    table = table.join(buckets, on="acc_no").fillna({label: 0.0 for label in AGEING_BUCKETS})
+    # Balance not covered by the last 90 days of invoices is older than that
+    unexplained = table["balance"] - table[list(AGEING_BUCKETS)].sum(axis=1)
+    table[AGEING_BUCKETS[-1]] += unexplained.clip(lower=0.0)
+    table[list(AGEING_BUCKETS)] = table[list(AGEING_BUCKETS)].round(2)
+
+    limit = table["credit_limit"].where(table["credit_limit"] > 0)
+    table["utilisation"] = table["balance"] / limit
+    table["over_limit"] = table["balance"] > limit
+    return table.sort_values("balance", ascending=False, kind="stable").reset_index(drop=True)
+
+def ageing_summary(table, limit=5):
+    """Portfolio totals and the largest exposures from an ageing_frame."""
+    over = table[table["over_limit"]]
+    excess = (over["balance"] - over["credit_limit"]).sort_values(ascending=False)
+    return {
+        "debtors": int(len(table)),
+        "total": float(table["balance"].sum()),
+        "buckets": {label: float(table[label].sum()) for label in AGEING_BUCKETS},
+        "over_limit": int(len(over)),
+        "over_limit_amount": float(excess.sum()),
+        "top": table.head(limit).to_dict("records"),
+        "top_over_limit": over.loc[excess.index[:limit]].to_dict("records"),
+    }
+
+def _build_ageing(debtors, invoices, today):
+    table = ageing_frame(debtors, invoices, today)
+    report = ageing_summary(table)
+    report.update(day=today.strftime("%Y/%m/%d"), as_of=datetime.now(), table=table)
+    return report
+
+def _cached_ageing(today, since=None):
+    """Today's report, if there is one (computed after `since`, a monotonic time, if given)."""
+    if _ageing["day"] == today and (since is None or _ageing["at"] >= since):
+        return _ageing["report"]
+    return None
+
+def _store_ageing(today, report):
+    if report is not None:
+        _ageing.update(day=today, report=report, at=time.monotonic())
+    return report
+
+async def ageing_report_async(refresh=False):
+    """
+    Today's ageing/credit-exposure report (see ageing_summary, plus `table`
+    and `as_of`), computed once per day; None if AutoCount could not be read.
+    """
+    today, asked = date.today(), time.monotonic()
+    report = None if refresh else _cached_ageing(today)
+    if report is not None:
+        return report
+    async with _ageing_lock:
+        # Concurrent requests wait here and share the report the first one built
+        report = _cached_ageing(today, asked if refresh else None)
+        if report is not None:
+            return report
+        debtors = await debtor_api.debtor_cache.get_async()
+        start, end = _ageing_window(today)
+        invoices = await _fetch_open_invoices_async(start, end, _owing(debtors))
+        if not debtors or invoices is None:
+            return None
+        return _store_ageing(today, await asyncio.to_thread(_build_ageing, debtors, invoices, today))
+
+def ageing_report(refresh=False):
+    """Sync version of ageing_report_async (scripts, benchmarks)."""
+    today, asked = date.today(), time.monotonic()
+    with _ageing_thread_lock:
+        report = _cached_ageing(today, asked if refresh else None)
+        if report is not None:
+            return report
+        debtors = debtor_api.debtor_cache.get()
+        start, end = _ageing_window(today)
+        invoices = _fetch_open_invoices(start, end, _owing(debtors))
+        if not debtors or invoices is None:
+            return None
+        return _store_ageing(today, _build_ageing(debtors, invoices, today))
+
+def ageing_csv(report):
+    """The per-debtor ageing table as CSV bytes (for the bot's file download)."""
+    columns = ["acc_no", "company_name", "balance", *AGEING_BUCKETS, "credit_limit", "utilisation", "over_limit", "credit_term"]
+    table = report["table"][columns].copy()
+    table["utilisation"] = (table["utilisation"] * 100).round(1)
+    table = table.rename(columns={"utilisation": "utilisation_pct"})
+    return table.to_csv(index=False, float_format="%.2f").encode("utf-8")
+
+def debtor_ageing(acc_no):
+    """One debtor's row of today's cached report, or None (never triggers a fetch)."""
+    report = _ageing["report"] if _ageing["day"] == date.today() else None
+    if report is None:
+        return None
+    rows = report["table"][report["table"]["acc_no"] == acc_no]
+    return rows.iloc[0].to_dict() if len(rows) else None
@@ -0,0 +1,186 @@
+import asyncio
+import gc
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from src.metrics import metrics
+from src.tracing import tracer
+from src.api.resilience import note_stale, detached
+
+logger = logging.getLogger(__name__)
+
+# --- GARBAGE COLLECTION ---
+_gc_lock = threading.Lock()
+_gc_builds = 0
+
+@contextmanager
+def _collector_paused():
+    """
+    Pauses automatic collection while a snapshot is built, then freezes the result.
+
+    A 50k-row build allocates millions of objects, and each full collection over them
+    ran 100-400 ms holding the GIL, which stalled the event loop. The snapshot objects
+    are acyclic, so refcounting still frees the old snapshot after the swap.
+    """
+    global _gc_builds
+    with _gc_lock:
+        _gc_builds += 1
+        if _gc_builds == 1:
+            gc.disable()
+    try:
+        yield
+    finally:
+        with _gc_lock:
+            _gc_builds -= 1
+            if _gc_builds == 0:
+                # Keep the long-lived snapshot out of the generations later collections scan
+                gc.freeze()
+                gc.enable()
+
+class SnapshotCache:
+    """
+    Process-wide cache for one AutoCount master-data table.
+
+    Holds the whole table as a list of records (built from the raw rows by
+    `record`, e.g. Debtor.from_row) plus a dict keyed on the record's
+    `key_field` attribute, so lookups are served from memory. Rows older than `refresh_ahead * ttl`
+    are refreshed in the background while the current snapshot keeps serving;
+    only an empty or fully expired snapshot makes the caller wait.
+    """
+    def __init__(self, name, fetch, fetch_async, ttl, key_field=None, max_rows=None,
+                 refresh_ahead=0.8, record=None):
+        self.name = name
+        self.ttl = ttl
+        self.key_field = key_field
+        self.max_rows = max_rows
+        self.refresh_ahead = refresh_ahead
+        self._fetch = fetch
+        self._fetch_async = fetch_async
+        self._record = record
+
+        self.rows = []
+        self.by_key = {}
+        self.loaded_at = 0.0
+        self.listeners = []
+
+        self._thread_lock = threading.Lock()
+        self._async_lock = asyncio.Lock()
+        self._refreshing = False
+
+    # --- STATE ---
+    def age(self):
+        return time.monotonic() - self.loaded_at if self.loaded_at else None
+
+    def is_loaded(self):
+        return self.loaded_at > 0
+
+    def is_expired(self):
+        return not self.is_loaded() or self.age() >= self.ttl
+
+    def _due_for_refresh(self):
+        return self.is_loaded() and self.age() >= self.ttl * self.refresh_ahead
+
+    def invalidate(self):
+        """Forces the next read to fetch a fresh snapshot."""
+        self.loaded_at = 0.0
+
+    def peek(self):
+        """Current rows without triggering any fetch (may be empty or stale)."""
+        return self.rows
+
+    def lookup(self, key):
+        """O(1) lookup on key_field against the current snapshot."""
+        if key is None:
+            return None
+        return self.by_key.get(str(key).lower())
+
+    # --- LOADING ---
+    def _store(self, rows):
+        if rows is None:
+            # Keep serving the previous snapshot when the ERP call fails
+            logger.warning(f"[{self.name}] Refresh failed, keeping {len(self.rows)} cached rows.")
+            return False
+
+        if self.max_rows and len(rows) > self.max_rows:
+            logger.warning(f"[{self.name}] {len(rows)} rows exceeds cap of {self.max_rows}; truncating.")
+            rows = rows[:self.max_rows]
+
+        started = time.perf_counter()
+        with tracer.span("cache.build", cache=self.name, rows=len(rows)), _collector_paused():
+            if self._record:
+                rows = [self._record(row) for row in rows]
+
+            by_key = {}
+            if self.key_field:
+                for row in rows:
+                    key = getattr(row, self.key_field, None)
+                    if key is not None:
+                        by_key[str(key).lower()] = row
+
+            # Swap in one go so readers never see a half-built snapshot
+            self.rows, self.by_key, self.loaded_at = rows, by_key, time.monotonic()
+            for listener in self.listeners:
+                try:
+                    listener(rows)
+                except Exception as e:
+                    logger.error(f"[{self.name}] Refresh listener failed: {e}")
+        metrics.observe("cache_build_seconds", time.perf_counter() - started, cache=self.name)
+        return True
+
+    def refresh(self):
+        """Synchronous fetch + swap."""
+        with tracer.span("cache.refresh", cache=self.name), self._thread_lock:
+            return self._store(self._fetch())
+
+    async def refresh_async(self, force=False):
+        """
+        Async fetch + swap. Concurrent callers share one upstream fetch, unless
+        `force`: then the rows are always fetched after the call (e.g. to see a write).
+        """
+        started = self.loaded_at
+        with tracer.span("cache.refresh", cache=self.name):
+            async with self._async_lock:
+                if not force and self.loaded_at != started and not self.is_expired():
+                    return True
+                rows = await self._fetch_async()
+                # Record building and listeners (e.g. search index builds) run off the event loop
+                return await asyncio.to_thread(self._store, rows)
+
+    async def _background_refresh(self):
+        try:
+            await self.refresh_async()
+        finally:
+            self._refreshing = False
+
+    def _background_refresh_sync(self):
+        try:
+            self.refresh()
+        finally:
+            self._refreshing = False
+
+    # --- READ PATHS ---
+    def _note_if_stale(self):
+        # The refresh failed (ERP down or circuit open): the last good snapshot is served, labelled with its age
+        if self.is_loaded() and self.is_expired():
+            note_stale(self.age())
+
+    def get(self):
+        """Sync read: blocks only if the snapshot is empty or expired."""
+        if self.is_expired():
+            self.refresh()
+        elif self._due_for_refresh() and not self._refreshing:
+            self._refreshing = True
+            threading.Thread(target=self._background_refresh_sync, daemon=True).start()
+        self._note_if_stale()
+        return self.rows
+
+    async def get_async(self):
+        """Async read: blocks only if the snapshot is empty or expired."""
+        if self.is_expired():
+            await self.refresh_async()
+        elif self._due_for_refresh() and not self._refreshing:
+            self._refreshing = True
+            detached(self._background_refresh())
+        self._note_if_stale()
+        return self.rows
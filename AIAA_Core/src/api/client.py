@@ -1,9 +1,366 @@
-﻿import requests
+﻿import asyncio
+import base64
+import codecs
+import json
+import re
+import threading
+import time
+import requests
+import httpx
 import logging
 from src.config import Config
+from src.metrics import metrics
+from src.tracing import tracer
+from src.api.resilience import breaker_for, backoff_delay, remaining_budget, detached, wait_shared, note_deadline_exceeded
 
 logger = logging.getLogger(__name__)
 
+LOGIN_ENDPOINT = "api/v3/Login"
+
+def _timeout_for(endpoint):
+    """Per-endpoint timeout (seconds), falling back to Config.API_TIMEOUT."""
+    return Config.API_ENDPOINT_TIMEOUTS.get(endpoint.lstrip('/'), Config.API_TIMEOUT)
+
+def _login_payload():
+    return {"UserID": Config.API_USER, "Password": Config.API_PASSWORD, "Token": Config.API_TOKEN}
+
+def _extract_jwt(data):
+    """Pulls the JWTToken out of a Login response body."""
+    if data and len(data) > 0:
+        return data[0].get("JWTToken")
+    return None
+
+# --- TOKEN LIFECYCLE ---
+# The JWT's expiry is read from its `exp` claim (or assumed API_TOKEN_TTL after
+# login). Inside the API_TOKEN_REFRESH_AHEAD window the next request starts a
+# background refresh and keeps using the still-valid token, so no request pays
+# for a login or a failed first attempt. The 401 retry remains as a fallback.
+
+EXPIRY_SKEW = 5  # seconds: a token this close to expiry is treated as expired
+REFRESH_RETRY = 15  # seconds before another proactive attempt while one is running or after it failed
+
+def _jwt_expiry(token):
+    """Epoch seconds from the JWT `exp` claim, else now + Config.API_TOKEN_TTL."""
+    try:
+        claims = token.split(".")[1]
+        return float(json.loads(base64.urlsafe_b64decode(claims + "=" * (-len(claims) % 4)))["exp"])
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+        return time.time() + Config.API_TOKEN_TTL
+
+def _token_state(auth_key, expires_at):
+    """"missing", "expired", "due" (inside the refresh-ahead window) or "fresh"."""
+    if not auth_key:
+        return "missing"
+    remaining = expires_at - time.time()
+    if remaining <= EXPIRY_SKEW:
+        return "expired"
+    if remaining <= Config.API_TOKEN_REFRESH_AHEAD:
+        return "due"
+    return "fresh"
+
+def _token_acquired(client, token):
+    expires_at = _jwt_expiry(token)
+    metrics.set("autocount_token_expiry_timestamp_seconds", expires_at, client=client)
+    return expires_at
+
+class ErpStatus:
+    """Reachability of the AutoCount server, as seen by the latest call of either client."""
+    def __init__(self):
+        self.down_since = None
+        self.reason = None
+
+    def record(self, status, detail=""):
+        """status: an HTTP status code, or "error" for a connection failure."""
+        if status == "error" or status >= 500:
+            if self.down_since is None:
+                self.down_since = time.time()
+                logger.warning(f"⚠️ ERP unavailable: {detail or status}")
+            self.reason = detail or str(status)
+        elif self.down_since is not None:
+            logger.info(f"✅ ERP reachable again after {time.time() - self.down_since:.0f}s")
+            self.down_since = self.reason = None
+        metrics.set("autocount_up", 0 if self.down_since else 1)
+
+    def is_down(self):
+        return self.down_since is not None
+
+erp_status = ErpStatus()
+
+# --- INSTRUMENTATION ---
+# Shared by both clients: request latency covers the whole call (including a
+# 401 re-login and the JSON decode), so it is comparable to what users see.
+
+def _label(endpoint):
+    return endpoint.strip('/')
+
+def _begin(endpoint):
+    metrics.inc("autocount_in_flight", 1, endpoint=_label(endpoint))
+    return time.perf_counter()
+
+def _end(endpoint, started):
+    metrics.inc("autocount_in_flight", -1, endpoint=_label(endpoint))
+    metrics.observe("autocount_request_seconds", time.perf_counter() - started, endpoint=_label(endpoint))
+
+def _count_status(endpoint, status, detail=""):
+    metrics.inc("autocount_responses_total", endpoint=_label(endpoint), status=status)
+    erp_status.record(status, detail or f"{_label(endpoint)} returned {status}")
+
+def _decode(endpoint, response):
+    """response.json() with body size and decode time recorded."""
+    metrics.observe("autocount_response_bytes", len(response.content), endpoint=_label(endpoint))
+    started = time.perf_counter()
+    with tracer.span("json.decode", bytes=len(response.content)):
+        data = response.json()
+    metrics.observe("autocount_json_decode_seconds", time.perf_counter() - started, endpoint=_label(endpoint))
+    return data
+
+# --- RETRIES & BUDGET ---
+# Each upstream attempt goes through the endpoint's circuit breaker. Reads get
+# API_READ_RETRIES extra attempts with jittered backoff, and their timeouts are
+# capped by the caller's request budget. Writes get one attempt with the full
+# timeout: a write cut off client-side may still be committed by the ERP.
+
+def _attempt_timeout(endpoint, read):
+    """Timeout for the next attempt, or None if the request budget is spent."""
+    timeout = _timeout_for(endpoint)
+    if not read:
+        return timeout
+    timeout = min(timeout, remaining_budget())
+    if timeout <= 0:
+        metrics.inc("autocount_deadline_exceeded_total", endpoint=_label(endpoint))
+        note_deadline_exceeded()
+        return None
+    return timeout
+
+def _retry_delay(endpoint, attempt):
+    """Backoff before retry `attempt`, or None if it would not fit in the request budget."""
+    delay = backoff_delay(attempt)
+    if delay >= remaining_budget():
+        metrics.inc("autocount_deadline_exceeded_total", endpoint=_label(endpoint))
+        note_deadline_exceeded()
+        return None
+    metrics.inc("autocount_retries_total", endpoint=_label(endpoint))
+    return delay
+
+# --- SINGLE-FLIGHT ---
+# Concurrent identical reads (same endpoint + payload) share one upstream call
+# and its parsed result, which callers must treat as read-only. Writes
+# (creating invoices/debtors) always go upstream individually.
+
+def _is_read(endpoint):
+    """AutoCount exposes reads as POST .../GetXxx; anything else may write."""
+    return _label(endpoint).rsplit('/', 1)[-1].lower().startswith("get")
+
+def _flight_key(endpoint, json_payload):
+    return _label(endpoint), json.dumps(json_payload, sort_keys=True, default=str)
+
+def _count_coalesced(endpoint):
+    metrics.inc("autocount_coalesced_total", endpoint=_label(endpoint))
+
+class _Flight:
+    __slots__ = ("done", "result")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+# --- STREAMING ---
+# stream_rows() hands out the rows of a large list response (a top-level array,
+# or the "ResultTable" array of an object) as the body arrives, instead of
+# response.json() on the whole body. The raw body and the full parse tree are
+# never held at once, and the connection is closed as soon as the caller has
+# enough rows. Streams are not coalesced or retried once rows have been read.
+
+STREAM_CHUNK = 64 * 1024
+_ROWS_START = re.compile(r'"ResultTable"\s*:\s*\[')
+_ROW_GAP = re.compile(r'[\s,]*')
+_json_decoder = json.JSONDecoder()
+
+class _RowParser:
+    """Incremental parser: feed() text chunks, get back the rows they completed."""
+    def __init__(self):
+        self.buf = ""
+        self.in_rows = False
+        self.done = False
+        self._scanned = 0
+
+    def _find_rows(self):
+        head = self.buf.lstrip()
+        if not head:
+            return False
+        if head[0] == "[":
+            self.buf = head[1:]
+            return True
+        match = _ROWS_START.search(self.buf, max(0, self._scanned - 32))
+        if match is None:
+            self._scanned = len(self.buf)
+            return False
+        self.buf = self.buf[match.end():]
+        return True
+
+    @staticmethod
+    def _bulk(buf, pos):
+        """
+        Rows from pos up to the last "}," in one json.loads call (a cut that is
+        not a row boundary leaves invalid JSON, so the next one is tried).
+        """
+        end = buf.rfind("},", pos)
+        for _ in range(3):
+            if end < pos:
+                break
+            try:
+                return json.loads("[" + buf[pos:end + 1] + "]"), end + 1
+            except ValueError:
+                end = buf.rfind("},", pos, end)
+        return [], pos
+
+    def feed(self, text):
+        self.buf += text
+        if not self.in_rows:
+            self.in_rows = self._find_rows()
+            if not self.in_rows:
+                return []
+        buf = self.buf
+        pos = _ROW_GAP.match(buf).end()
+        rows, pos = ([], pos) if buf.startswith("]", pos) else self._bulk(buf, pos)
+        # Whatever is left (the last row before "]", non-object rows) goes row by row
+        while not self.done:
+            pos = _ROW_GAP.match(buf, pos).end()
+            if pos == len(buf):
+                break
+            if buf[pos] == "]":
+                self.done = True
+                break
+            try:
+                row, pos = _json_decoder.raw_decode(buf, pos)
+            except ValueError:
+                break  # row not complete yet
+            rows.append(row)
+        self.buf = buf[pos:]
+        return rows
+
+class _StreamBase:
+    def __init__(self, endpoint, response, started):
+        self.endpoint = endpoint
+        self.response = response
+        self.complete = False  # True once the row array was read to its end
+        self.truncated = False  # True if the caller stopped early
+        self.rows_read = 0
+        self._parser = _RowParser()
+        self._text = codecs.getincrementaldecoder("utf-8")()
+        self._started = started
+        self._bytes = 0
+        self._parse_seconds = 0.0
+        self._finished = False
+
+    def _feed(self, chunk):
+        self._bytes += len(chunk)
+        t = time.perf_counter()
+        rows = self._parser.feed(self._text.decode(chunk))
+        self._parse_seconds += time.perf_counter() - t
+        self.rows_read += len(rows)
+        return rows
+
+    def _failed(self, e):
+        _count_status(self.endpoint, "error", f"{_label(self.endpoint)}: body interrupted: {str(e) or type(e).__name__}")
+        logger.error(f"API Stream Error ({self.endpoint}) after {self.rows_read} rows: {e}")
+
+    def _finish(self):
+        if self._finished:
+            return
+        self._finished = True
+        self.complete = self._parser.done
+        metrics.observe("autocount_response_bytes", self._bytes, endpoint=_label(self.endpoint))
+        metrics.observe("autocount_json_decode_seconds", self._parse_seconds, endpoint=_label(self.endpoint))
+        metrics.inc("autocount_streamed_rows_total", self.rows_read, endpoint=_label(self.endpoint))
+        _end(self.endpoint, self._started)
+
+class RowStream(_StreamBase):
+    """
+    Rows of one streamed response (sync). Iterate it (or its batches()), or
+    take(limit). After iterating, `complete` tells whether the body arrived in full.
+    """
+    def batches(self):
+        """Rows in the batches they arrived in (one list per network chunk)."""
+        try:
+            for chunk in self.response.iter_content(STREAM_CHUNK):
+                rows = self._feed(chunk)
+                if rows:
+                    yield rows
+                if self._parser.done:
+                    break
+        except requests.exceptions.RequestException as e:
+            self._failed(e)
+        finally:
+            self.close()
+
+    def __iter__(self):
+        for rows in self.batches():
+            yield from rows
+
+    def take(self, limit=None):
+        """Up to `limit` rows (all if None), or None if the body broke off first."""
+        rows = []
+        batches = self.batches()
+        with tracer.span("autocount.stream", endpoint=_label(self.endpoint)) as span:
+            try:
+                for batch in batches:
+                    rows.extend(batch)
+                    if limit is not None and len(rows) >= limit:
+                        self.truncated = True
+                        del rows[limit:]
+                        break
+            finally:
+                batches.close()
+            span["rows"] = len(rows)
+        return rows if self.complete or self.truncated else None
+
+    def close(self):
+        self.response.close()
+        self._finish()
+
+class AsyncRowStream(_StreamBase):
+    """Async twin of RowStream: `async for row in stream`, or await take(limit)."""
+    async def batches(self):
+        """Rows in the batches they arrived in (one list per network chunk)."""
+        try:
+            async for chunk in self.response.aiter_bytes(STREAM_CHUNK):
+                rows = self._feed(chunk)
+                if rows:
+                    yield rows
+                if self._parser.done:
+                    break
+        except httpx.HTTPError as e:
+            self._failed(e)
+        finally:
+            await self.aclose()
+
+    async def __aiter__(self):
+        async for rows in self.batches():
+            for row in rows:
+                yield row
+
+    async def take(self, limit=None):
+        """Up to `limit` rows (all if None), or None if the body broke off first."""
+        rows = []
+        batches = self.batches()
+        with tracer.span("autocount.stream", endpoint=_label(self.endpoint)) as span:
+            try:
+                async for batch in batches:
+                    rows.extend(batch)
+                    if limit is not None and len(rows) >= limit:
+                        self.truncated = True
+                        del rows[limit:]
+                        break
+            finally:
+                await batches.aclose()
+            span["rows"] = len(rows)
+        return rows if self.complete or self.truncated else None
+
+    async def aclose(self):
+        await self.response.aclose()
+        self._finish()
+
 class AutoCountClient:
     def __init__(self):
         # Remove trailing slash to handle endpoints cleanly
@@ -12,74 +369,389 @@ class AutoCountClient:
         self.password = Config.API_PASSWORD
         self.token = Config.API_TOKEN
         self.auth_key = None
+        self.expires_at = 0.0
         self.session = requests.Session()
-        
-        # Initial Login
-        self.login()
-
-    def login(self):
-        """Exchanges License Key for a Session JWT Token."""
-        url = f"{self.base_url}/api/v3/Login"
-        payload = {"UserID": self.user_id, "Password": self.password, "Token": self.token}
-        
-        try:
-            print(f"🔐 Attempting Login to {url}...")
-            response = self.session.post(url, json=payload, timeout=10)
-            
-            if response.status_code == 200:
-                data = response.json()
-                if data and len(data) > 0:
-                    self.auth_key = data[0].get("JWTToken")
-                    print(f"✅ [AutoCount] Login Successful. Token acquired.")
-                    return True
+        # One shared login: threads that find the token stale wait on the same call
+        self._login_lock = threading.Lock()
+        self._refresh_not_before = 0.0
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+        # No login here: importing the client must not block on the ERP.
+        # _get_headers() logs in on first use.
+
+    def login(self, stale_key=None, reason="401"):
+        """
+        Exchanges License Key for a Session JWT Token.
+        If another thread already replaced `stale_key` while we waited, reuse its token.
+        """
+        with self._login_lock:
+            if self.auth_key and self.auth_key != stale_key:
+                metrics.inc("autocount_login_waits_total")
+                return True
+            metrics.inc("autocount_token_refreshes_total", reason=reason)
+            breaker = breaker_for(LOGIN_ENDPOINT)
+            timeout = _attempt_timeout(LOGIN_ENDPOINT, read=True)
+            if timeout is None or not breaker.allow():
+                return False
+
+            url = f"{self.base_url}/{LOGIN_ENDPOINT}"
+            payload = {"UserID": self.user_id, "Password": self.password, "Token": self.token}
+
+            try:
+                print(f"🔐 Attempting Login to {url}...")
+                with tracer.span("autocount.login"):
+                    response = self.session.post(url, json=payload, timeout=timeout)
+                erp_status.record(response.status_code, f"login returned {response.status_code}")
+                breaker.record(response.status_code < 500)
+
+                if response.status_code == 200:
+                    self.auth_key = _extract_jwt(response.json())
+                    if self.auth_key:
+                        self.expires_at = _token_acquired("sync", self.auth_key)
+                        self._refresh_not_before = 0.0
+                        print(f"✅ [AutoCount] Login Successful. Token acquired.")
+                        metrics.inc("autocount_logins_total", result="ok")
+                        return True
+                    else:
+                        print(f"❌ [AutoCount] Login Failed: Empty response.")
                 else:
-                    print(f"❌ [AutoCount] Login Failed: Empty response.")
-            else:
-                print(f"❌ [AutoCount] Login Failed: Status {response.status_code} - {response.text}")
-                
-        except Exception as e:
-            print(f"❌ [AutoCount] Login Exception: {e}")
-        
-        return False
+                    print(f"❌ [AutoCount] Login Failed: Status {response.status_code} - {response.text}")
+
+            except Exception as e:
+                print(f"❌ [AutoCount] Login Exception: {e}")
+                erp_status.record("error", f"login failed: {e}")
+                breaker.record(False)
+
+            metrics.inc("autocount_logins_total", result="failed")
+            return False
 
     def _get_headers(self):
-        """Returns headers with Auth Token. Re-logins if needed."""
-        if not self.auth_key:
-            self.login()
+        """Returns headers with a valid Auth Token, logging in or refreshing ahead of expiry as needed."""
+        state = _token_state(self.auth_key, self.expires_at)
+        if state in ("missing", "expired"):
+            self.login(stale_key=self.auth_key, reason=state)
+        elif state == "due" and time.time() >= self._refresh_not_before:
+            # Refresh in the background; this request still uses the valid token
+            self._refresh_not_before = time.time() + REFRESH_RETRY
+            threading.Thread(
+                target=self.login, args=(self.auth_key, "proactive"), daemon=True, name="autocount-token"
+            ).start()
         return {"Content-Type": "application/json", "Authorization": self.auth_key}
 
     def post(self, endpoint, json_payload=None):
         """
         Generic POST request wrapper.
         Handles full URL construction and Re-login on 401.
+        Concurrent identical reads from other threads share one upstream call.
         """
-        # Ensure endpoint format (bot_main.py uses full paths like /api/Debtor/...)
-        if not endpoint.startswith("api/"):
-             # Handle cases where user might pass short paths, though we prefer full paths
-             pass 
+        if not (Config.API_COALESCE_READS and _is_read(endpoint)):
+            return self._send(endpoint, json_payload)
+
+        key = _flight_key(endpoint, json_payload)
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            _count_coalesced(endpoint)
+            with tracer.span("autocount.coalesced", endpoint=_label(endpoint)):
+                flight.done.wait()
+            return flight.result
 
-        url = f"{self.base_url}/{endpoint.lstrip('/')}"
-        
         try:
-            headers = self._get_headers()
-            response = self.session.post(url, json=json_payload, headers=headers, timeout=15)
-            
-            # Auto-retry on 401 Unauthorized
-            if response.status_code == 401:
-                print("⚠️ Token expired. Re-logging in...")
-                if self.login():
-                    headers = self._get_headers()
-                    response = self.session.post(url, json=json_payload, headers=headers, timeout=15)
-
-            if response.status_code != 200:
-                logger.error(f"API Error ({endpoint}): {response.status_code} {response.text}")
-                return None
-            
-            return response.json()
-            
-        except requests.exceptions.RequestException as e:
-            logger.error(f"API Connection Error ({endpoint}): {e}")
-            return None
+            flight.result = self._send(endpoint, json_payload)
+            return flight.result
+        finally:
+            with self._flights_lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def _send(self, endpoint, json_payload, stream=False):
+        """Upstream POST behind the endpoint's circuit breaker; reads are retried (see RETRIES & BUDGET)."""
+        read = _is_read(endpoint)
+        breaker = breaker_for(endpoint)
+        for attempt in range(1 + Config.API_READ_RETRIES if read else 1):
+            if attempt:
+                delay = _retry_delay(endpoint, attempt)
+                if delay is None:
+                    break
+                time.sleep(delay)
+            timeout = _attempt_timeout(endpoint, read)
+            if timeout is None or not breaker.allow():
+                break
+            answered, data, _ = self._attempt(endpoint, json_payload, timeout, attempt, stream)
+            breaker.record(answered)
+            if answered:
+                return data
+        return None
+
+    def _attempt(self, endpoint, json_payload, timeout, attempt, stream=False):
+        """
+        One POST (with a single re-login on 401). Returns (answered, data, status):
+        answered is False for connection errors, timeouts and 5xx, which count
+        against the circuit and may be retried; status is the final HTTP status
+        (None if there was no response). With stream=True a 200 returns an open
+        RowStream instead of parsed JSON.
+        """
+        url = f"{self.base_url}/{endpoint.lstrip('/')}"
+        started = _begin(endpoint)
+        handed_off = False
+
+        with tracer.span("autocount.post", endpoint=_label(endpoint), attempt=attempt) as span:
+            try:
+                headers = self._get_headers()
+                response = self.session.post(url, json=json_payload, headers=headers, timeout=timeout, stream=stream)
+                _count_status(endpoint, response.status_code)
+
+                # Auto-retry on 401 Unauthorized
+                if response.status_code == 401:
+                    print("⚠️ Token expired. Re-logging in...")
+                    metrics.inc("autocount_relogins_total")
+                    if self.login(stale_key=headers.get("Authorization")):
+                        response.close()
+                        headers = self._get_headers()
+                        response = self.session.post(url, json=json_payload, headers=headers, timeout=timeout, stream=stream)
+                        _count_status(endpoint, response.status_code)
+                span["status"] = response.status_code
+
+                if response.status_code != 200:
+                    logger.error(f"API Error ({endpoint}): {response.status_code} {response.text}")
+                    return response.status_code < 500, None, response.status_code
+
+                if stream:
+                    handed_off = True  # the stream records the latency when it is closed
+                    return True, RowStream(endpoint, response, started), 200
+                return True, _decode(endpoint, response), 200
+
+            except requests.exceptions.RequestException as e:
+                _count_status(endpoint, "error", f"{_label(endpoint)}: {str(e) or type(e).__name__}")
+                span["status"] = "error"
+                logger.error(f"API Connection Error ({endpoint}): {e}")
+                return False, None, None
+            finally:
+                if not handed_off:
+                    _end(endpoint, started)
+
+    def stream_rows(self, endpoint, json_payload=None):
+        """
+        POST a list endpoint and return a RowStream over its rows (see
+        STREAMING), or None if AutoCount could not be reached. The caller must
+        consume or close() the stream; it is never shared with other callers.
+        """
+        return self._send(endpoint, json_payload, stream=True)
+
+class AsyncAutoCountClient:
+    """
+    asyncio-native twin of AutoCountClient for the Telegram handlers.
+    Uses one pooled httpx.AsyncClient (bounded by Config.API_POOL_SIZE) so
+    concurrent users are served in parallel instead of blocking the event loop.
+    """
+    def __init__(self):
+        self.base_url = Config.API_BASE_URL.rstrip('/')
+        self.auth_key = None
+        self.expires_at = 0.0
+        self._http = None
+        self._flights = {}  # flight key -> asyncio.Task
+        # One shared login: concurrent callers with a stale token wait on the same call
+        self._login_lock = asyncio.Lock()
+        self._refresh_not_before = 0.0
+
+    def _get_http(self):
+        """Creates the pooled HTTP client lazily, inside the running event loop."""
+        if self._http is None or self._http.is_closed:
+            limits = httpx.Limits(
+                max_connections=Config.API_POOL_SIZE,
+                max_keepalive_connections=Config.API_POOL_SIZE
+            )
+            self._http = httpx.AsyncClient(base_url=self.base_url, limits=limits, timeout=Config.API_TIMEOUT)
+        return self._http
+
+    async def login(self, stale_key=None, reason="401"):
+        """
+        Exchanges License Key for a Session JWT Token.
+        If another task already replaced `stale_key` while we waited, reuse its token.
+        """
+        async with self._login_lock:
+            if self.auth_key and self.auth_key != stale_key:
+                metrics.inc("autocount_login_waits_total")
+                return True
+            metrics.inc("autocount_token_refreshes_total", reason=reason)
+            breaker = breaker_for(LOGIN_ENDPOINT)
+            timeout = _attempt_timeout(LOGIN_ENDPOINT, read=True)
+            if timeout is None or not breaker.allow():
+                return False
+
+            try:
+                print(f"🔐 Attempting Async Login to {self.base_url}/{LOGIN_ENDPOINT}...")
+                with tracer.span("autocount.login"):
+                    response = await self._get_http().post(
+                        LOGIN_ENDPOINT, json=_login_payload(), timeout=timeout
+                    )
+                erp_status.record(response.status_code, f"login returned {response.status_code}")
+                breaker.record(response.status_code < 500)
+                if response.status_code == 200:
+                    self.auth_key = _extract_jwt(response.json())
+                    if self.auth_key:
+                        self.expires_at = _token_acquired("async", self.auth_key)
+                        self._refresh_not_before = 0.0
+                        print(f"✅ [AutoCount] Async Login Successful. Token acquired.")
+                        metrics.inc("autocount_logins_total", result="ok")
+                        return True
+                    print(f"❌ [AutoCount] Async Login Failed: Empty response.")
+                else:
+                    print(f"❌ [AutoCount] Async Login Failed: Status {response.status_code} - {response.text}")
+            except Exception as e:
+                print(f"❌ [AutoCount] Async Login Exception: {e}")
+                erp_status.record("error", f"login failed: {e}")
+                breaker.record(False)
+
+            metrics.inc("autocount_logins_total", result="failed")
+            return False
+
+    async def _get_headers(self):
+        """Returns headers with a valid Auth Token, logging in or refreshing ahead of expiry as needed."""
+        state = _token_state(self.auth_key, self.expires_at)
+        if state in ("missing", "expired"):
+            await self.login(stale_key=self.auth_key, reason=state)
+        elif state == "due" and time.time() >= self._refresh_not_before:
+            # Refresh in the background; this request still uses the valid token
+            self._refresh_not_before = time.time() + REFRESH_RETRY
+            detached(self.login(stale_key=self.auth_key, reason="proactive"))
+        headers = {"Content-Type": "application/json"}
+        if self.auth_key:
+            headers["Authorization"] = self.auth_key
+        return headers
+
+    async def post(self, endpoint, json_payload=None):
+        """
+        Async POST wrapper with the same contract as AutoCountClient.post:
+        returns parsed JSON, or None on any API/connection error.
+        Concurrent identical reads await one shared upstream call.
+        """
+        endpoint = endpoint.lstrip('/')
+        if not (Config.API_COALESCE_READS and _is_read(endpoint)):
+            return await self._send(endpoint, json_payload)
+
+        key = _flight_key(endpoint, json_payload)
+        flight = self._flights.get(key)
+        if flight is not None:
+            _count_coalesced(endpoint)
+            with tracer.span("autocount.coalesced", endpoint=_label(endpoint)):
+                return await wait_shared(flight)
+
+        # A detached task with its own budget: neither a cancelled caller nor the
+        # deadline of the update that started it cuts the call short for the others
+        flight = self._flights[key] = detached(self._send(endpoint, json_payload), Config.REQUEST_BUDGET)
+        flight.add_done_callback(lambda _: self._flights.pop(key, None))
+        return await wait_shared(flight)
+
+    async def _send(self, endpoint, json_payload, stream=False):
+        """Upstream POST behind the endpoint's circuit breaker; reads are retried (see RETRIES & BUDGET)."""
+        read = _is_read(endpoint)
+        breaker = breaker_for(endpoint)
+        for attempt in range(1 + Config.API_READ_RETRIES if read else 1):
+            if attempt:
+                delay = _retry_delay(endpoint, attempt)
+                if delay is None:
+                    break
+                await asyncio.sleep(delay)
+            timeout = _attempt_timeout(endpoint, read)
+            if timeout is None or not breaker.allow():
+                break
+            answered, data, _ = await self._attempt(endpoint, json_payload, timeout, attempt, stream)
+            breaker.record(answered)
+            if answered:
+                return data
+        return None
+
+    async def _attempt(self, endpoint, json_payload, timeout, attempt, stream=False):
+        """One POST (with a single shared re-login on 401). Returns (answered, data, status) like AutoCountClient._attempt."""
+        http = self._get_http()
+        started = _begin(endpoint)
+        handed_off = False
+
+        with tracer.span("autocount.post", endpoint=_label(endpoint), attempt=attempt) as span:
+            try:
+                headers = await self._get_headers()
+                response = await self._request(http, endpoint, json_payload, headers, timeout, stream)
+                _count_status(endpoint, response.status_code)
+
+                # Auto-retry on 401 Unauthorized (single shared re-login)
+                if response.status_code == 401:
+                    print("⚠️ Token expired. Re-logging in...")
+                    metrics.inc("autocount_relogins_total")
+                    if await self.login(stale_key=headers.get("Authorization")):
+                        await response.aclose()
+                        headers = await self._get_headers()
+                        response = await self._request(http, endpoint, json_payload, headers, timeout, stream)
+                        _count_status(endpoint, response.status_code)
+                span["status"] = response.status_code
+
+                if response.status_code != 200:
+                    await response.aread()
+                    await response.aclose()
+                    logger.error(f"API Error ({endpoint}): {response.status_code} {response.text}")
+                    return response.status_code < 500, None, response.status_code
+
+                if stream:
+                    handed_off = True  # the stream records the latency when it is closed
+                    return True, AsyncRowStream(endpoint, response, started), 200
+                return True, _decode(endpoint, response), 200
+
+            except (httpx.HTTPError, ValueError) as e:
+                _count_status(endpoint, "error", f"{_label(endpoint)}: {str(e) or type(e).__name__}")
+                span["status"] = "error"
+                logger.error(f"API Connection Error ({endpoint}): {e}")
+                return False, None, None
+            finally:
+                if not handed_off:
+                    _end(endpoint, started)
+
+    @staticmethod
+    async def _request(http, endpoint, json_payload, headers, timeout, stream):
+        if not stream:
+            return await http.post(endpoint, json=json_payload, headers=headers, timeout=timeout)
+        request = http.build_request("POST", endpoint, json=json_payload, headers=headers, timeout=timeout)
+        return await http.send(request, stream=True)
+
+    async def stream_rows(self, endpoint, json_payload=None):
+        """Async twin of AutoCountClient.stream_rows; returns an AsyncRowStream or None."""
+        return await self._send(endpoint.lstrip('/'), json_payload, stream=True)
+
+    async def post_write(self, endpoint, json_payload):
+        """
+        One write attempt for the outbox worker. Returns (outcome, data), where
+        outcome is "ok", "rejected" (AutoCount refused the document, e.g. a 4xx
+        validation error: nothing was saved), "unsent" (circuit open, or the
+        token was refused even after a re-login: nothing was saved, send it
+        again later) or "unknown" (timeout, connection error or 5xx: the write
+        may have been saved).
+        """
+        endpoint = endpoint.lstrip('/')
+        breaker = breaker_for(endpoint)
+        if not breaker.allow():
+            return "unsent", None
+        answered, data, status = await self._attempt(endpoint, json_payload, _timeout_for(endpoint), 0)
+        breaker.record(answered)
+        if not answered:
+            return "unknown", None
+        if data is not None:
+            return "ok", data
+        return ("unsent" if status in (401, 403) else "rejected"), None
+
+    async def refresh_token_if_due(self, context=None):
+        """JobQueue callback: keeps the token fresh while the bot is idle."""
+        if _token_state(self.auth_key, self.expires_at) in ("due", "expired"):
+            await self.login(stale_key=self.auth_key, reason="proactive")
+
+    async def aclose(self):
+        """Releases pooled connections (called on bot shutdown)."""
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
 
-# Singleton Instance
-api_client = AutoCountClient()
\ No newline at end of file
+# Singleton Instances
+api_client = AutoCountClient()
+async_api_client = AsyncAutoCountClient()
@@ -1,17 +1,18 @@
-from src.api.client import api_client
+from src.api.client import api_client, async_api_client
+from src.api.cache import SnapshotCache
+from src.api.search import SearchIndex
+from src.api.leaderboard import Leaderboard
+from src.api.records import Debtor
+from src.config import Config
+from src.tracing import tracer
+from src.api.resilience import detached
 
-# Add this function to the bottom of src/api/debtor.py
+DEBTOR_ENDPOINT = "api/Debtor/GetDebtor/"
+CREATE_DEBTOR_ENDPOINT = "api/Debtor/"
 
-from src.api.client import api_client
-
-from src.api.client import api_client
-
-def create_debtor(company_name, phone1="", address1="", register_no="", peppol_format="BIS"):
-    """
-    Creates a new Debtor in AutoCount.
-    """
+def _debtor_payload(company_name, phone1="", address1="", register_no="", peppol_format="BIS"):
     # Payload matching the API documentation requirements + fixing the TaxEntity error
-    payload = {
+    return {
         # Changed from "G01-A" to None (matches your existing data which has NULL)
         "DebtorType": None, 
         "CompanyName": company_name,
@@ -27,69 +28,206 @@ def create_debtor(company_name, phone1="", address1="", register_no="", peppol_f
         "AgingOn": "I",
         "SGEInvoicePeppolFormat": peppol_format  
     }
+
+def _parse_create_debtor(response):
+    if response and isinstance(response, list) and len(response) > 0:
+        result_item = response[0]
+        if "AccNo" in result_item:
+            return {"success": True, "acc_no": result_item["AccNo"]}
+            
+    return {"success": False, "error": str(response)}
+
+def create_debtor(company_name, phone1="", address1="", register_no="", peppol_format="BIS"):
+    """
+    Creates a new Debtor in AutoCount.
+    """
+    payload = _debtor_payload(company_name, phone1, address1, register_no, peppol_format)
     
     try:
-        response = api_client.post("api/Debtor/", json_payload=payload)
+        response = api_client.post(CREATE_DEBTOR_ENDPOINT, json_payload=payload)
+        result = _parse_create_debtor(response)
+        if result["success"]:
+            debtor_cache.invalidate()
+        return result
         
-        if response and isinstance(response, list) and len(response) > 0:
-            result_item = response[0]
-            if "AccNo" in result_item:
-                return {"success": True, "acc_no": result_item["AccNo"]}
-                
-        return {"success": False, "error": str(response)}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+async def create_debtor_async(company_name, phone1="", address1="", register_no="", peppol_format="BIS"):
+    """
+    Async: creates a new Debtor in AutoCount.
+    """
+    payload = _debtor_payload(company_name, phone1, address1, register_no, peppol_format)
+    
+    try:
+        response = await async_api_client.post(CREATE_DEBTOR_ENDPOINT, json_payload=payload)
+        result = _parse_create_debtor(response)
+        if result["success"]:
+            debtor_cache.invalidate()
+        return result
         
     except Exception as e:
         return {"success": False, "error": str(e)}
 
+async def post_debtor_async(company_name, phone1=""):
+    """Outbox worker: one api/Debtor request. Returns (outcome, acc_no) like invoice.post_invoices_async."""
+    outcome, response = await async_api_client.post_write(CREATE_DEBTOR_ENDPOINT, _debtor_payload(company_name, phone1))
+    if outcome != "ok":
+        return outcome, None
+    result = _parse_create_debtor(response)
+    if not result["success"]:
+        return "unknown", None
+    # Reload in the background: invalidate() would make every debtor read wait for the full table
+    detached(debtor_cache.refresh_async(force=True))
+    return "ok", result["acc_no"]
+
+async def find_debtors_async(company_name, phone1=""):
+    """
+    Outbox worker: AccNos of live debtors with exactly this name and phone, or
+    None if AutoCount could not be asked. GetDebtor only filters by AccNo, so
+    this is a forced refresh of the debtor cache: the download also serves
+    every handler, instead of a second full-table read per write.
+    """
+    if not await debtor_cache.refresh_async(force=True):
+        return None
+    return [
+        d.acc_no for d in debtor_cache.peek()
+        if d.acc_no and d.company_name == company_name and d.phone == (phone1 or "")
+    ]
+
+async def find_created_debtor_async(company_name, phone1="", existing=()):
+    """
+    Outbox worker: AccNo of a debtor with this exact name and phone that is
+    not one of `existing` (the matches found before the write was sent), ""
+    if there is none, or None if AutoCount could not be asked. Debtors carry
+    no reference field, so a name + phone match that did not exist before
+    the write is the best available evidence that it was saved.
+    """
+    found = await find_debtors_async(company_name, phone1)
+    if found is None:
+        return None
+    return next((acc_no for acc_no in found if acc_no not in set(existing)), "")
 
 
+@tracer.traced("filter.outstanding")
+def _outstanding(limit, min_balance=None):
+    # Slice of the maintained leaderboard (positive balances, highest first)
+    if min_balance:
+        return debtor_board.above(min_balance, limit)
+    return debtor_board.top(limit)
 
-def _get_balance(item):
-    """Calculates balance checking multiple potential keys."""
-    for key in ['Balance', 'Outstanding', 'CurBalance', 'NetTotal']:
-        if key in item and item[key] is not None: 
-            return float(item[key])
-    return 0.0
+@tracer.traced("filter.find_debtor")
+def _find_debtor(data, keyword):
+    if not data: return None
+    # Exact AccNo first, otherwise the best-ranked name/code match
+    return debtor_index.exact(keyword) or debtor_index.best(keyword)
 
 def get_debtor_list_raw():
     """Fetch all debtors."""
     # Matches bot_main.py: /api/Debtor/GetDebtor/ with AccNo=[]
-    return api_client.post("api/Debtor/GetDebtor/", json_payload={"AccNo": []})
+    return api_client.post(DEBTOR_ENDPOINT, json_payload={"AccNo": []})
 
-def get_debtor_outstanding(limit=5):
-    """Returns top N debtors with positive balance."""
-    data = get_debtor_list_raw()
-    if not data: return []
+async def get_debtor_list_raw_async():
+    """Async: fetch all debtors."""
+    return await async_api_client.post(DEBTOR_ENDPOINT, json_payload={"AccNo": []})
 
-    # Calculate show_bal for each
-    for d in data:
-        d['show_bal'] = _get_balance(d)
-    
-    # Filter > 0
-    debtors = [d for d in data if d['show_bal'] > 0]
-    
-    # Sort Descending
-    sorted_debtors = sorted(debtors, key=lambda x: x['show_bal'], reverse=True)
-    return sorted_debtors[:limit]
+# Streamed, stopping one row past the cap (the cache logs the truncation).
+# A failed or cut-off download returns None so the cache keeps its previous snapshot.
+_DEBTOR_LIMIT = Config.DEBTOR_CACHE_MAX_ROWS + 1 if Config.DEBTOR_CACHE_MAX_ROWS else None
+
+def _fetch_debtors():
+    stream = api_client.stream_rows(DEBTOR_ENDPOINT, json_payload={"AccNo": []})
+    return stream.take(_DEBTOR_LIMIT) if stream else None
+
+async def _fetch_debtors_async():
+    stream = await async_api_client.stream_rows(DEBTOR_ENDPOINT, json_payload={"AccNo": []})
+    return await stream.take(_DEBTOR_LIMIT) if stream else None
+
+# --- DEBTOR CACHE ---
+# Full-table snapshot of Debtor records shared by every handler; refreshed ahead of expiry.
+debtor_cache = SnapshotCache(
+    name="debtors",
+    fetch=_fetch_debtors,
+    fetch_async=_fetch_debtors_async,
+    ttl=Config.DEBTOR_CACHE_TTL,
+    key_field="acc_no",
+    max_rows=Config.DEBTOR_CACHE_MAX_ROWS,
+    refresh_ahead=Config.CACHE_REFRESH_AHEAD,
+    record=Debtor.from_row
+)
+
+# Rebuilt on every cache refresh
+debtor_index = SearchIndex("acc_no", ["company_name"])
+debtor_cache.listeners.append(debtor_index.build)
+debtor_board = Leaderboard("acc_no", "balance", resync=Config.DEBTOR_LEADERBOARD_RESYNC)
+debtor_cache.listeners.append(debtor_board.build)
+
+# --- BALANCE UPDATES ---
+# Between snapshots, balances that a new document changed are fetched for just
+# those debtors and re-ranked in place (see refresh_balances_async).
+
+def apply_balances(rows):
+    """Patches fresh GetDebtor rows into the cached records and the leaderboard."""
+    for fresh in rows or []:
+        cached = debtor_cache.lookup(fresh.get("AccNo"))
+        if cached is None:
+            continue
+        cached.update_balance(fresh)
+        debtor_board.update(cached)
+
+def refresh_balances(codes):
+    codes = [c for c in set(codes) if c]
+    if codes and debtor_cache.is_loaded():
+        apply_balances(api_client.post(DEBTOR_ENDPOINT, json_payload={"AccNo": codes}))
+
+async def refresh_balances_async(codes):
+    """Re-reads the balances of `codes` (e.g. debtors just invoiced) without a full reload."""
+    codes = [c for c in set(codes) if c]
+    if codes and debtor_cache.is_loaded():
+        apply_balances(await async_api_client.post(DEBTOR_ENDPOINT, json_payload={"AccNo": codes}))
+
+# --- READ PATHS ---
+
+def get_debtor_outstanding(limit=5, min_balance=None):
+    """Returns top N debtors with positive balance (only those owing over `min_balance`, if given)."""
+    debtor_cache.get()
+    return _outstanding(limit, min_balance)
 
 def get_all_debtors(limit=20):
     """Returns list of debtors."""
-    data = get_debtor_list_raw()
-    if not data: return []
-    
-    for d in data:
-        d['show_bal'] = _get_balance(d)
-        
-    return data[:limit]
+    return debtor_cache.get()[:limit]
 
 def get_debtor_profile(keyword):
     """Finds a specific debtor by Name or AccNo."""
-    data = get_debtor_list_raw()
-    if not data: return None
-    
-    keyword = keyword.lower()
-    for item in data:
-        if keyword in item.get("CompanyName", "").lower() or keyword in item.get("AccNo", "").lower():
-            item['show_bal'] = _get_balance(item)
-            return item
-    return None
\ No newline at end of file
+    return _find_debtor(debtor_cache.get(), keyword)
+
+# --- ASYNC VERSIONS (used by the Telegram handlers) ---
+
+async def get_debtor_outstanding_async(limit=5, min_balance=None):
+    """Async: returns top N debtors with positive balance (only those owing over `min_balance`, if given)."""
+    await debtor_cache.get_async()
+    return _outstanding(limit, min_balance)
+
+async def count_debtors_owing_async(min_balance=0.0):
+    """Async: how many debtors owe more than `min_balance`."""
+    await debtor_cache.get_async()
+    return debtor_board.count_above(min_balance)
+
+async def get_all_debtors_async(limit=20):
+    """Async: returns list of debtors."""
+    return (await debtor_cache.get_async())[:limit]
+
+async def get_debtor_profile_async(keyword):
+    """Async: finds a specific debtor by Name or AccNo."""
+    return _find_debtor(await debtor_cache.get_async(), keyword)
+
+async def suggest_debtors_async(keyword, k=5):
+    """
+    Wizard lookup: returns (exact_match, candidates).
+    exact_match is set only when the input is a known AccNo.
+    """
+    await debtor_cache.get_async()
+    exact = debtor_index.exact(keyword)
+    if exact:
+        return exact, [exact]
+    return None, debtor_index.search(keyword, k)
@@ -1,57 +1,313 @@
-﻿from src.api.client import api_client
+﻿import argparse
+import csv
+import logging
+from datetime import datetime
+from src.api.client import api_client, async_api_client
+from src.api.stock import mark_items_dirty
+from src.api.sales import mark_day_dirty
+from src.config import Config
+
+logger = logging.getLogger(__name__)
+
+CREATE_INVOICE_ENDPOINT = "api/Invoice"
+INVOICE_LIST_ENDPOINT = "api/Invoice/GetInvoice"
+
+# An invoice line is (item_code, qty, unit_price); a document is
+# (debtor_code, [lines]). api/Invoice takes a list of documents, so the bulk
+# path packs up to Config.INVOICE_BATCH_SIZE of them into one request.
+
+def _line(item_code, qty, unit_price):
+    return {
+        "ItemCode": item_code,
+        "Qty": qty,
+        "UnitPrice": unit_price,
+        # "TaxCode": "GST-0" # Uncomment if your system enforces tax codes
+    }
+
+def _document(debtor_code, lines, ref=None):
+    document = {
+        "DebtorCode": debtor_code,
+        "DocStatus": "A",             # A = Active
+        "SubmitEInvoice": "T",        # Enable E-Invoice features
+        "ConsolidatedEInvoice": "F",  # Not a consolidated invoice
+        # --- FIX BELOW ---
+        "SubmitInvoiceNow": "F",      # Required by your DB version. F = Draft/Do not submit to LHDN yet.
+        # -----------------
+        "IVDTL": [_line(*line) for line in lines]
+    }
+    if ref:
+        document["Ref"] = ref  # lets the outbox find a document whose confirmation was lost
+    return document
+
+def _invoice_payload(debtor_code, lines):
+    # Payload structure
+    return [_document(debtor_code, lines)]
+
+def _item_codes(lines):
+    return [line[0] for line in lines]
+
+def _parse_create_invoice(response):
+    # Check for success
+    # API returns a list containing the result object(s) or a dict with Status
+    if response:
+        # Handle list response (common in creating docs)
+        if isinstance(response, list) and len(response) > 0:
+            result_item = response[0]
+            # If we get a result item with DocNo, it succeeded
+            if "DocNo" in result_item:
+                return {"success": True, "doc_no": result_item["DocNo"]}
+
+        # Handle dict response
+        elif isinstance(response, dict):
+            status = response.get("Status", "")
+            result_table = response.get("ResultTable", [])
+
+            if status == "Success" or (result_table and len(result_table) > 0):
+                # Try to extract DocNo from ResultTable if available
+                doc_no = "New Invoice"
+                if result_table and isinstance(result_table, list):
+                    doc_no = result_table[0].get("DocNo", "New Invoice")
+                return {"success": True, "doc_no": doc_no}
+
+    # If we reach here, consider it a failure and return the raw response for debugging
+    return {"success": False, "error": str(response)}
 
 def create_invoice(debtor_code, item_code, qty, unit_price):
     """
     Creates a simple Invoice (IV) in AutoCount.
     """
-    # Payload structure
-    payload = [
-        {
-            "DebtorCode": debtor_code,
-            "DocStatus": "A",             # A = Active
-            "SubmitEInvoice": "T",        # Enable E-Invoice features
-            "ConsolidatedEInvoice": "F",  # Not a consolidated invoice
-            # --- FIX BELOW ---
-            "SubmitInvoiceNow": "F",      # Required by your DB version. F = Draft/Do not submit to LHDN yet.
-            # -----------------
-            "IVDTL": [
-                {
-                    "ItemCode": item_code,
-                    "Qty": qty,
-                    "UnitPrice": unit_price,
-                    # "TaxCode": "GST-0" # Uncomment if your system enforces tax codes
-                }
-            ]
-        }
-    ]
-    
+    return create_invoice_lines(debtor_code, [(item_code, qty, unit_price)])
+
+def create_invoice_lines(debtor_code, lines):
+    """
+    Creates one Invoice (IV) with several lines: [(item_code, qty, unit_price), ...].
+    """
+    payload = _invoice_payload(debtor_code, lines)
+
+    try:
+        response = api_client.post(CREATE_INVOICE_ENDPOINT, json_payload=payload)
+        result = _parse_create_invoice(response)
+        if result["success"]:
+            # Stock moved: next read of these items fetches their live balance
+            mark_items_dirty(_item_codes(lines))
+            mark_day_dirty()
+        return result
+
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+async def create_invoice_async(debtor_code, item_code, qty, unit_price):
+    """
+    Async: creates a simple Invoice (IV) in AutoCount.
+    """
+    return await create_invoice_lines_async(debtor_code, [(item_code, qty, unit_price)])
+
+async def create_invoice_lines_async(debtor_code, lines):
+    """
+    Async: creates one Invoice (IV) with several lines: [(item_code, qty, unit_price), ...].
+    """
+    payload = _invoice_payload(debtor_code, lines)
+
     try:
-        response = api_client.post("api/Invoice", json_payload=payload)
-        
-        # Check for success
-        # API returns a list containing the result object(s) or a dict with Status
-        if response:
-            # Handle list response (common in creating docs)
-            if isinstance(response, list) and len(response) > 0:
-                result_item = response[0]
-                # If we get a result item with DocNo, it succeeded
-                if "DocNo" in result_item:
-                    return {"success": True, "doc_no": result_item["DocNo"]}
-            
-            # Handle dict response
-            elif isinstance(response, dict):
-                status = response.get("Status", "")
-                result_table = response.get("ResultTable", [])
-                
-                if status == "Success" or (result_table and len(result_table) > 0):
-                    # Try to extract DocNo from ResultTable if available
-                    doc_no = "New Invoice"
-                    if result_table and isinstance(result_table, list):
-                        doc_no = result_table[0].get("DocNo", "New Invoice")
-                    return {"success": True, "doc_no": doc_no}
-        
-        # If we reach here, consider it a failure and return the raw response for debugging
-        return {"success": False, "error": str(response)}
-        
+        response = await async_api_client.post(CREATE_INVOICE_ENDPOINT, json_payload=payload)
+        result = _parse_create_invoice(response)
+        if result["success"]:
+            # Stock moved: next read of these items fetches their live balance
+            mark_items_dirty(_item_codes(lines))
+            mark_day_dirty()
+        return result
+
     except Exception as e:
-        return {"success": False, "error": str(e)}
\ No newline at end of file
+        return {"success": False, "error": str(e)}
+
+# --- BULK ---
+# Documents are checked locally first, so one malformed order cannot sink the
+# chunk it travels in. A chunk AutoCount does not confirm (rejected, timed out,
+# or answered with the wrong number of results) is reported per document and
+# never re-sent automatically: a write cut off client-side may still have been
+# saved.
+
+def _check_document(document):
+    """Error message for a document AutoCount would reject, or None."""
+    debtor_code, lines = document
+    if not debtor_code:
+        return "DebtorCode is required"
+    if not lines:
+        return "Invoice has no lines"
+    for item_code, qty, unit_price in lines:
+        if not item_code:
+            return "Line without ItemCode"
+        try:
+            if float(qty) <= 0:
+                return f"Qty for {item_code} must be positive"
+            float(unit_price)
+        except (TypeError, ValueError):
+            return f"Qty/UnitPrice for {item_code} is not a number"
+    return None
+
+def _doc_numbers(response):
+    """DocNo of every created document, in request order, or None if the response has none."""
+    if isinstance(response, dict):
+        response = response.get("ResultTable")
+    if not isinstance(response, list) or not all(isinstance(r, dict) and "DocNo" in r for r in response):
+        return None
+    return [r["DocNo"] for r in response]
+
+def _plan_bulk(documents, chunk_size):
+    """Returns (results, chunks): results pre-filled for invalid documents, chunks of valid indexes."""
+    results = [None] * len(documents)
+    valid = []
+    for idx, document in enumerate(documents):
+        error = _check_document(document)
+        if error:
+            results[idx] = {"success": False, "error": error}
+        else:
+            valid.append(idx)
+    chunk_size = max(1, chunk_size or Config.INVOICE_BATCH_SIZE)
+    return results, [valid[i:i + chunk_size] for i in range(0, len(valid), chunk_size)]
+
+def _bulk_payload(documents, chunk):
+    return [_document(*documents[idx]) for idx in chunk]
+
+def _apply_chunk(results, documents, chunk, response):
+    """Maps one chunk's response back onto its documents."""
+    doc_nos = _doc_numbers(response)
+    if doc_nos is None or len(doc_nos) != len(chunk):
+        got = "no confirmation" if doc_nos is None else f"{len(doc_nos)} results"
+        error = f"AutoCount sent {got} for a batch of {len(chunk)}; check before re-submitting"
+        logger.error(f"Bulk invoice chunk failed: {error} ({str(response)[:200]})")
+        for idx in chunk:
+            results[idx] = {"success": False, "error": error}
+        return
+
+    codes = []
+    for idx, doc_no in zip(chunk, doc_nos):
+        results[idx] = {"success": True, "doc_no": doc_no}
+        codes.extend(_item_codes(documents[idx][1]))
+    # Stock moved: next read of these items fetches their live balance
+    mark_items_dirty(set(codes))
+    mark_day_dirty()
+
+def create_invoices_bulk(documents, chunk_size=None):
+    """
+    Creates many invoices in ceil(N / chunk_size) api/Invoice requests.
+    `documents` is [(debtor_code, [(item_code, qty, unit_price), ...]), ...];
+    returns one result dict per document, in the same order.
+    """
+    results, chunks = _plan_bulk(documents, chunk_size)
+    for chunk in chunks:
+        try:
+            response = api_client.post(CREATE_INVOICE_ENDPOINT, json_payload=_bulk_payload(documents, chunk))
+        except Exception as e:
+            response = None
+            logger.error(f"Bulk invoice chunk error: {e}")
+        _apply_chunk(results, documents, chunk, response)
+    return results
+
+async def create_invoices_bulk_async(documents, chunk_size=None):
+    """Async version of create_invoices_bulk (chunks are sent one after another)."""
+    results, chunks = _plan_bulk(documents, chunk_size)
+    for chunk in chunks:
+        try:
+            response = await async_api_client.post(CREATE_INVOICE_ENDPOINT, json_payload=_bulk_payload(documents, chunk))
+        except Exception as e:
+            response = None
+            logger.error(f"Bulk invoice chunk error: {e}")
+        _apply_chunk(results, documents, chunk, response)
+    return results
+
+# --- OUTBOX ---
+# Used by the write outbox worker (src/bot/outbox.py), which needs to know
+# whether an unconfirmed request may have been saved, not just that it failed.
+
+async def post_invoices_async(documents):
+    """
+    One api/Invoice request for [(ref, debtor_code, lines), ...]. Returns
+    (outcome, doc_nos): outcome as in AsyncAutoCountClient.post_write, doc_nos
+    the DocNo of each document (in order) when the outcome is "ok".
+    """
+    payload = [_document(debtor_code, lines, ref) for ref, debtor_code, lines in documents]
+    outcome, response = await async_api_client.post_write(CREATE_INVOICE_ENDPOINT, payload)
+    if outcome != "ok":
+        return outcome, None
+    doc_nos = _doc_numbers(response)
+    if doc_nos is None or len(doc_nos) != len(documents):
+        logger.error(f"Outbox invoice batch of {len(documents)} not confirmed: {str(response)[:200]}")
+        return "unknown", None
+    # Stock moved: next read of these items fetches their live balance
+    mark_items_dirty({code for _, _, lines in documents for code in _item_codes(lines)})
+    mark_day_dirty()
+    return "ok", doc_nos
+
+async def find_invoices_by_ref_async(refs, day_from):
+    """{Ref: DocNo} for invoices dated day_from (YYYY/MM/DD) to today carrying one of `refs`; None if the lookup failed."""
+    refs = set(refs)
+    payload = {"DateFrom": day_from, "DateTo": datetime.now().strftime("%Y/%m/%d")}
+    stream = await async_api_client.stream_rows(INVOICE_LIST_ENDPOINT, json_payload=payload)
+    if stream is None:
+        return None
+    found = {}
+    async for batch in stream.batches():
+        for row in batch:
+            if row.get("Ref") in refs:
+                found[row["Ref"]] = row.get("DocNo")
+    return found if stream.complete else None
+
+# --- CLI ---
+# Back-office upload: one CSV row per invoice line, rows sharing a Ref form one
+# invoice. UnitPrice may be left empty to use the catalogue price.
+#
+#   python -m src.api.invoice orders.csv --chunk-size 50
+#
+#   Ref,DebtorCode,ItemCode,Qty,UnitPrice
+#   SO-1,300-A001,APP00001,5,12.50
+#   SO-1,300-A001,HEL00002,1,
+#   SO-2,300-B002,APP00001,10,12.50
+
+def _number(text):
+    try:
+        return float(text)
+    except ValueError:
+        return text  # reported by _check_document
+
+def read_orders(path):
+    """[(ref, (debtor_code, lines)), ...] from an order CSV, in file order."""
+    from src.api.stock import stock_cache
+    orders = {}
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        for row in csv.DictReader(f):
+            ref = (row.get("Ref") or "").strip() or f"row {len(orders) + 1}"
+            debtor_code = (row.get("DebtorCode") or "").strip()
+            item_code = (row.get("ItemCode") or "").strip()
+            price = (row.get("UnitPrice") or "").strip()
+            if not price:
+                stock_cache.get()
+                item = stock_cache.lookup(item_code)
+                price = item.price if item else "no catalogue price"
+            lines = orders.setdefault(ref, (debtor_code, []))[1]
+            lines.append((item_code, _number((row.get("Qty") or "").strip()), _number(price)))
+    return list(orders.items())
+
+def main():
+    parser = argparse.ArgumentParser(description="Create AutoCount invoices in bulk from a CSV of order lines")
+    parser.add_argument("csv_path")
+    parser.add_argument("--chunk-size", type=int, default=Config.INVOICE_BATCH_SIZE, help="documents per api/Invoice request")
+    parser.add_argument("--dry-run", action="store_true", help="only validate the file")
+    args = parser.parse_args()
+
+    orders = read_orders(args.csv_path)
+    refs = [ref for ref, _ in orders]
+    documents = [document for _, document in orders]
+    if args.dry_run:
+        for ref, document in zip(refs, documents):
+            error = _check_document(document)
+            print(f"❌ {ref}: {error}" if error else f"✅ {ref}: {len(document[1])} line(s)")
+        return
+
+    results = create_invoices_bulk(documents, args.chunk_size)
+    for ref, result in zip(refs, results):
+        print(f"✅ {ref} -> {result['doc_no']}" if result["success"] else f"❌ {ref}: {result['error']}")
+    print(f"\n🧾 {sum(1 for r in results if r['success'])}/{len(results)} invoices created")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import threading
+import time
+from bisect import bisect_left
+
+class Leaderboard:
+    """
+    Records with a positive value (e.g. Debtor.balance), kept in descending
+    order of that value.
+
+    Built once per snapshot (register `build` as a SnapshotCache listener) and
+    patched in place by `update` when one record's value changes, so top-N and
+    "over X" queries are a slice of a sorted index instead of a filter and
+    full sort of every record. `resync` seconds after the last build, the next
+    query rebuilds the index from the records it was built from (0 disables),
+    so a missed patch cannot leave it out of order for long.
+    """
+    def __init__(self, code_field, value_field, resync=0.0):
+        self.code_field = code_field
+        self.value_field = value_field
+        self.resync = resync
+        self.built_at = 0.0
+        self._source = []
+        self._keys = []     # (-value, code), ascending = highest value first
+        self._rows = []     # records, parallel to _keys
+        self._values = {}   # code -> -value of its entry in _keys
+        self._lock = threading.Lock()
+
+    def _entry(self, row):
+        value = getattr(row, self.value_field) or 0.0
+        return (-value, str(getattr(row, self.code_field))) if value > 0 else None
+
+    def build(self, rows):
+        entries = sorted((key, idx) for idx, key in enumerate(map(self._entry, rows)) if key)
+        keys = [key for key, _ in entries]
+        ranked = [rows[idx] for _, idx in entries]
+        values = {code: value for value, code in keys}
+        # Swap in one go so a concurrent query never sees a half-built index
+        with self._lock:
+            self._source, self._keys, self._rows, self._values = rows, keys, ranked, values
+            self.built_at = time.monotonic()
+
+    def update(self, row):
+        """Re-ranks one record after its value changed (O(log n) search + list shift)."""
+        code = str(getattr(row, self.code_field))
+        key = self._entry(row)
+        with self._lock:
+            old = self._values.pop(code, None)
+            if old is not None:
+                idx = bisect_left(self._keys, (old, code))
+                del self._keys[idx], self._rows[idx]
+            if key:
+                idx = bisect_left(self._keys, key)
+                self._keys.insert(idx, key)
+                self._rows.insert(idx, row)
+                self._values[code] = key[0]
+
+    def _check_resync(self):
+        if self.resync and self.built_at and time.monotonic() - self.built_at >= self.resync:
+            self.build(self._source)
+
+    def top(self, limit=None):
+        """The `limit` highest records (all of them if limit is None)."""
+        self._check_resync()
+        with self._lock:
+            return self._rows[:limit]
+
+    def above(self, threshold, limit=None):
+        """Records whose value is strictly over `threshold`, highest first."""
+        self._check_resync()
+        with self._lock:
+            end = bisect_left(self._keys, (-threshold,))
+            if limit is not None:
+                end = min(end, limit)
+            return self._rows[:end]
+
+    def count_above(self, threshold):
+        self._check_resync()
+        with self._lock:
+            return bisect_left(self._keys, (-threshold,))
+
+    def __len__(self):
+        return len(self._rows)
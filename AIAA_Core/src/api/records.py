@@ -0,0 +1,147 @@
+import sys
+
+# Compact in-memory records for the cached master data and invoice headers.
+# AutoCount rows carry dozens of fields the bot never reads; a record keeps only
+# the ones it does, in __slots__ (no per-row dict), with balances and quantities
+# converted to float once when the snapshot is built. Low-cardinality strings
+# (UOM, credit term, location) are interned so 50k items share a handful of them.
+
+def _float(value, default=0.0):
+    try:
+        return float(value) if value is not None else default
+    except (TypeError, ValueError):
+        return default
+
+def _text(value):
+    return str(value) if value is not None else ""
+
+def _shared(value):
+    return sys.intern(str(value)) if value is not None else ""
+
+# --- DEBTORS ---
+
+class Debtor:
+    __slots__ = ("acc_no", "company_name", "phone", "credit_limit", "credit_term", "balance")
+
+    def __init__(self, acc_no, company_name, phone="", credit_limit=0.0, credit_term="", balance=0.0):
+        self.acc_no = acc_no
+        self.company_name = company_name
+        self.phone = phone
+        self.credit_limit = credit_limit
+        self.credit_term = credit_term
+        self.balance = balance
+
+    @staticmethod
+    def _balance(row):
+        """The balance is taken from the first of these fields that is present."""
+        for key in ('Balance', 'Outstanding', 'CurBalance', 'NetTotal'):
+            if row.get(key) is not None:
+                return _float(row[key])
+        return 0.0
+
+    @classmethod
+    def from_row(cls, row):
+        """Builds a Debtor from a GetDebtor row."""
+        return cls(
+            acc_no=_text(row.get("AccNo")),
+            company_name=_text(row.get("CompanyName")),
+            phone=_text(row.get("Phone1")),
+            credit_limit=_float(row.get("CreditLimit")),
+            credit_term=_shared(row.get("CreditTerm")),
+            balance=cls._balance(row),
+        )
+
+    def update_balance(self, row):
+        """Takes the balance from a fresh GetDebtor row."""
+        self.balance = self._balance(row)
+
+    def __repr__(self):
+        return f"Debtor({self.acc_no!r}, {self.company_name!r}, balance={self.balance})"
+
+# --- ITEMS ---
+
+class BatchBalance:
+    """One ItemDTL entry (batch/location balance) of an item."""
+    __slots__ = ("location", "batch_no", "qty")
+
+    def __init__(self, location, batch_no, qty):
+        self.location = location
+        self.batch_no = batch_no
+        self.qty = qty
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(_shared(row.get("Location")), _text(row.get("BatchNo")), _float(row.get("BalQty", row.get("Qty", 0))))
+
+class Item:
+    __slots__ = ("item_code", "description", "desc2", "price", "uom", "base_qty", "batches", "qty")
+
+    def __init__(self, item_code, description, desc2="", price=0.0, uom="", base_qty=0.0, batches=()):
+        self.item_code = item_code
+        self.description = description
+        self.desc2 = desc2
+        self.price = price
+        self.uom = uom
+        self.base_qty = base_qty
+        self.batches = batches
+        self.qty = base_qty + sum(b.qty for b in batches)
+
+    @classmethod
+    def from_row(cls, row):
+        """Builds an Item from a GetItem row (falls back to RecPrice when Price is 0)."""
+        price = _float(row.get("Price"))
+        if price == 0.0:
+            price = _float(row.get("RecPrice"))
+        item = cls(
+            item_code=_text(row.get("ItemCode")),
+            description=_text(row.get("Description")),
+            desc2=_shared(row.get("Desc2")),
+            price=price,
+            uom=_shared(row.get("UOM")),
+        )
+        item.update_quantities(row)
+        return item
+
+    @property
+    def name(self):
+        return self.description or self.desc2 or self.item_code
+
+    def update_quantities(self, row):
+        """Takes BalQty/Qty and ItemDTL from a (possibly partial) GetItem row and recomputes qty."""
+        if 'BalQty' in row: self.base_qty = _float(row['BalQty'])
+        elif 'Qty' in row: self.base_qty = _float(row['Qty'])
+        if isinstance(row.get("ItemDTL"), list):
+            self.batches = tuple(BatchBalance.from_row(dtl) for dtl in row["ItemDTL"])
+        self.qty = self.base_qty + sum(b.qty for b in self.batches)
+
+    def __repr__(self):
+        return f"Item({self.item_code!r}, {self.description!r}, qty={self.qty})"
+
+# --- INVOICES ---
+
+class InvoiceHeader:
+    __slots__ = ("doc_no", "day", "debtor_code", "debtor_name", "total", "cancelled")
+
+    def __init__(self, doc_no, day, debtor_code, debtor_name, total, cancelled):
+        self.doc_no = doc_no
+        self.day = day
+        self.debtor_code = debtor_code
+        self.debtor_name = debtor_name
+        self.total = total
+        self.cancelled = cancelled
+
+    @classmethod
+    def from_row(cls, row):
+        """Builds a header from a GetInvoice row; `day` is YYYY/MM/DD like the rest of the API layer."""
+        return cls(
+            doc_no=row.get("DocNo"),
+            # "2026-01-29T00..." -> "2026/01/29"
+            day=(row.get("DocDate") or "")[:10].replace("-", "/"),
+            debtor_code=_text(row.get("DebtorCode")),
+            debtor_name=_text(row.get("DebtorName")),
+            total=_float(row.get("FinalTotal", row.get("NetTotal", 0.0))),
+            cancelled=row.get("Cancelled") == "T",
+        )
+
+    def __repr__(self):
+        return f"InvoiceHeader({self.doc_no!r}, {self.day!r}, total={self.total})"
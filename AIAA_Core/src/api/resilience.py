@@ -0,0 +1,188 @@
+import asyncio
+import contextlib
+import contextvars
+import logging
+import math
+import random
+import threading
+import time
+from contextvars import ContextVar
+from src.config import Config
+from src.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Failure handling shared by both AutoCount clients:
+#   * one CircuitBreaker per endpoint, so a dead GetInvoice does not take the
+#     debtor lookups down with it;
+#   * a per-update time budget (request_budget) that every call, retry and
+#     backoff inside it must fit into;
+#   * stale-data notes, so a handler can tell the user how old the cached
+#     answer it just served is, and a timed-out flag, so it can tell "AutoCount
+#     did not answer in time" apart from an empty answer.
+
+# --- CIRCUIT BREAKER ---
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+class CircuitBreaker:
+    """
+    closed -> open after `threshold` consecutive failures (connection errors,
+    timeouts, 5xx). After `reset_after` seconds one probe call is let through
+    (half-open); its result closes the circuit or opens it again.
+    """
+    def __init__(self, name, threshold, reset_after):
+        self.name = name
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_started = None
+        self._lock = threading.Lock()
+
+    def _set(self, state):
+        self.state = state
+        metrics.set("autocount_circuit_state", _STATE_VALUES[state], endpoint=self.name)
+
+    def allow(self):
+        """True if a call may go upstream now; counts a rejection otherwise."""
+        now = time.monotonic()
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and now - self.opened_at >= self.reset_after:
+                self._set(HALF_OPEN)
+            # A probe that never reported back (e.g. cancelled) does not block the circuit forever
+            if self.state == HALF_OPEN and (self._probe_started is None or now - self._probe_started >= self.reset_after):
+                self._probe_started = now
+                return True
+        metrics.inc("autocount_circuit_rejections_total", endpoint=self.name)
+        return False
+
+    def record(self, ok):
+        with self._lock:
+            self._probe_started = None
+            if ok:
+                self.failures = 0
+                if self.state != CLOSED:
+                    logger.info(f"🟢 Circuit {self.name} closed.")
+                    self._set(CLOSED)
+                return
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.threshold:
+                if self.state != OPEN:
+                    logger.warning(f"🔴 Circuit {self.name} open after {self.failures} failures; retrying in {self.reset_after:.0f}s.")
+                self.opened_at = time.monotonic()
+                self._set(OPEN)
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def breaker_for(endpoint):
+    name = endpoint.strip('/')
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name, Config.API_BREAKER_FAILURES, Config.API_BREAKER_RESET)
+        return _breakers[name]
+
+def open_circuits():
+    """Endpoints whose circuit is not closed (used by /stats)."""
+    return {name: b.state for name, b in list(_breakers.items()) if b.state != CLOSED}
+
+def backoff_delay(attempt):
+    """Full-jitter exponential backoff before retry number `attempt` (1-based)."""
+    return random.uniform(0, min(Config.API_RETRY_MAX_DELAY, Config.API_RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+
+# --- REQUEST BUDGET ---
+# The scope object is shared (not copied) with tasks and threads started inside
+# it, so stale notes from to_thread calls reach the handler. Work shared with
+# other updates (coalesced reads, snapshot refreshes, logins) is started with
+# detached() instead: it must not end at the deadline of whichever update
+# happened to start it.
+
+class _Scope:
+    __slots__ = ("deadline", "stale_age", "timed_out")
+
+    def __init__(self, deadline):
+        self.deadline = deadline
+        self.stale_age = None
+        self.timed_out = False
+
+_scope = ContextVar("autocount_scope", default=None)
+
+@contextlib.contextmanager
+def request_budget(seconds):
+    """AutoCount calls inside the block, retries included, must finish within `seconds`."""
+    outer = _scope.get()
+    deadline = time.monotonic() + seconds
+    scope = _Scope(min(deadline, outer.deadline) if outer else deadline)
+    token = _scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _scope.reset(token)
+        if outer and scope.stale_age:
+            note_stale(scope.stale_age, outer)
+        if outer and scope.timed_out:
+            outer.timed_out = True
+
+def remaining_budget():
+    """Seconds left in the current request budget (inf outside one)."""
+    scope = _scope.get()
+    return scope.deadline - time.monotonic() if scope else math.inf
+
+@contextlib.contextmanager
+def budget_paused():
+    """Time spent inside the block (e.g. waiting for the LLM) is not charged to the current budget."""
+    scope = _scope.get()
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        if scope is not None:
+            scope.deadline += time.monotonic() - started
+
+def detached(coro, budget=None):
+    """
+    Runs `coro` as a task outside the current request budget: in a fresh
+    context, under its own `budget` seconds if given (else only the per-call
+    timeouts apply). Its stale notes go nowhere.
+    """
+    async def run():
+        if budget is None:
+            return await coro
+        with request_budget(budget):
+            return await coro
+    return asyncio.get_running_loop().create_task(run(), context=contextvars.Context())
+
+async def wait_shared(task):
+    """
+    Awaits a detached task for at most the caller's remaining budget; returns
+    None if that runs out first. The task itself goes on for its other callers.
+    """
+    budget = remaining_budget()
+    if budget == math.inf:
+        return await asyncio.shield(task)
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), max(budget, 0.0))
+    except asyncio.TimeoutError:
+        note_deadline_exceeded()
+        return None
+
+def note_deadline_exceeded():
+    """Records that a call was skipped or cut short because the request budget ran out."""
+    scope = _scope.get()
+    if scope is not None:
+        scope.timed_out = True
+
+def deadline_exceeded():
+    """True if a call in the current request budget ran out of time."""
+    scope = _scope.get()
+    return scope is not None and scope.timed_out
+
+def note_stale(age_seconds, scope=None):
+    """Records that the answer being built uses cached data `age_seconds` old."""
+    scope = scope or _scope.get()
+    if scope is not None and age_seconds:
+        scope.stale_age = max(scope.stale_age or 0.0, age_seconds)
@@ -1,56 +1,243 @@
+import asyncio
+import logging
+import time
 from datetime import datetime, timedelta
-from src.api.client import api_client
+from src.api.client import api_client, async_api_client
+from src.store.rollup import SalesRollupStore
+from src.api.records import InvoiceHeader
+from src.config import Config
+from src.tracing import tracer
+from src.api.resilience import note_stale, detached, wait_shared
 
-def get_sales_dashboard(specific_date_str=None):
-    """
-    Returns sales stats for a specific date AND the previous day (for comparison).
-    Matches bot_main.py logic.
-    """
-    url = "api/Invoice/GetInvoice"
-    
-    # Date Logic
+logger = logging.getLogger(__name__)
+
+INVOICE_LIST_ENDPOINT = "api/Invoice/GetInvoice"
+
+def _parse_target_date(specific_date_str):
+    """Returns the target datetime, or None if the date string is unreadable."""
     if specific_date_str:
         try:
-            target_dt = datetime.strptime(specific_date_str, "%Y/%m/%d")
+            return datetime.strptime(specific_date_str, "%Y/%m/%d")
         except:
             # Try ISO format if passed from AI agent
             try:
-                target_dt = datetime.strptime(specific_date_str, "%Y-%m-%d")
+                return datetime.strptime(specific_date_str, "%Y-%m-%d")
             except:
                 return None
-    else:
-        target_dt = datetime.now()
+    return datetime.now()
+
+def _empty_totals(days):
+    return {day: {"sales": 0.0, "count": 0, "cancelled": 0, "last_doc_no": None} for day in days}
+
+def _add_invoice(totals, inv):
+    """Adds one InvoiceHeader to the running per-day totals."""
+    day = totals.get(inv.day)
+    if day is None: return
+
+    doc_no = inv.doc_no
+    if doc_no and (day["last_doc_no"] is None or doc_no > day["last_doc_no"]):
+        day["last_doc_no"] = doc_no
+
+    if inv.cancelled:
+        day["cancelled"] += 1
+        return
+
+    day["sales"] += inv.total
+    day["count"] += 1
+
+# GetInvoice ranges are the largest responses the bot reads, and only four
+# numbers per day are kept from them, so invoices are streamed into the running
+# totals (see client STREAMING) instead of parsing the whole range first.
+
+def _fetch_totals(run):
+    """Per-day totals for the days in `run`, or None if the call failed or broke off."""
+    stream = api_client.stream_rows(INVOICE_LIST_ENDPOINT, json_payload=_range_payload(run))
+    if stream is None:
+        return None
+    totals = _empty_totals(run)
+    with tracer.span("sales.aggregate", days=len(run)):
+        for batch in stream.batches():
+            for row in batch:
+                _add_invoice(totals, InvoiceHeader.from_row(row))
+    return totals if stream.complete else None
+
+_runs_in_flight = {}
+
+async def _fetch_totals_async(run):
+    """Async _fetch_totals; concurrent requests for the same run share one download."""
+    key = tuple(run)
+    if key in _runs_in_flight:
+        return await wait_shared(_runs_in_flight[key])
+    task = _runs_in_flight[key] = detached(_stream_totals_async(run), Config.REQUEST_BUDGET)
+    task.add_done_callback(lambda _: _runs_in_flight.pop(key, None))
+    return await wait_shared(task)
+
+async def _stream_totals_async(run):
+    stream = await async_api_client.stream_rows(INVOICE_LIST_ENDPOINT, json_payload=_range_payload(run))
+    if stream is None:
+        return None
+    totals = _empty_totals(run)
+    with tracer.span("sales.aggregate", days=len(run)):
+        async for batch in stream.batches():
+            for row in batch:
+                _add_invoice(totals, InvoiceHeader.from_row(row))
+    return totals if stream.complete else None
+
+# --- DAILY ROLLUP ---
+# GetInvoice can only filter by date, so an open day is always re-fetched in
+# full: today at most every SALES_TODAY_REFRESH seconds, the SALES_SETTLE_DAYS
+# before it at most every SALES_RECENT_REFRESH seconds, so back-dated and
+# cancelled invoices still reach them. Older days are closed: fetched once.
+# An invoice written by the bot reopens its day (mark_day_dirty).
+rollup_store = SalesRollupStore(Config.SALES_ROLLUP_PATH)
+
+def _settled_before(today):
+    """First day that is still open: days before it are closed once fetched."""
+    return (datetime.strptime(today, "%Y/%m/%d") - timedelta(days=Config.SALES_SETTLE_DAYS)).strftime("%Y/%m/%d")
+
+def _days_to_fetch(days, stored, today):
+    stale = []
+    for day in days:
+        row = stored.get(day)
+        if day > today or (row and row["closed"]):
+            continue
+        refresh = Config.SALES_TODAY_REFRESH if day == today else Config.SALES_RECENT_REFRESH
+        if row is None or time.time() - row["updated_at"] >= refresh:
+            stale.append(day)
+    return stale
+
+def _store_totals(totals, today):
+    settled_before = _settled_before(today)
+    days = [day for day in totals if day <= today]  # Never persist the future
+    stored = rollup_store.get(days)
+    for day in days:
+        t, previous = totals[day], stored.get(day)
+        if previous and (t["sales"], t["count"], t["cancelled"]) != (previous["sales"], previous["count"], previous["cancelled"]):
+            logger.info(f"Sales rollup {day}: now RM {t['sales']:,.2f} from {t['count']} invoices (latest {t['last_doc_no']})")
+    # One transaction for the whole run: a year-long first fetch is one commit, not hundreds
+    rollup_store.upsert_many(
+        (day, totals[day]["sales"], totals[day]["count"], totals[day]["cancelled"], totals[day]["last_doc_no"], day < settled_before)
+        for day in days
+    )
+
+def mark_day_dirty(day=None):
+    """Re-fetch `day` (default today, YYYY/MM/DD) on the next read, e.g. after the bot wrote an invoice."""
+    rollup_store.reopen(day or datetime.now().strftime("%Y/%m/%d"))
 
-    # Format for API: YYYY/MM/DD
+def _range_payload(days):
+    return {"DateFrom": min(days), "DateTo": max(days)}
+
+def _stats(stored, target_date, prev_date):
+    target = stored.get(target_date) or {}
+    prev = stored.get(prev_date) or {}
+    return {
+        "sales": target.get("sales", 0.0),
+        "prev_sales": prev.get("sales", 0.0),
+        "count": target.get("count", 0),
+        "cancelled": target.get("cancelled", 0),
+        "date": target_date
+    }
+
+def _dashboard_range(specific_date_str):
+    """Returns (target_date, prev_date) formatted for the API (YYYY/MM/DD), or None."""
+    target_dt = _parse_target_date(specific_date_str)
+    if target_dt is None:
+        return None
     target_date = target_dt.strftime("%Y/%m/%d")
     prev_date = (target_dt - timedelta(days=1)).strftime("%Y/%m/%d")
+    return target_date, prev_date
+
+def _runs(days):
+    """Groups sorted YYYY/MM/DD days into contiguous runs, one GetInvoice call each."""
+    runs = []
+    for day in sorted(days):
+        dt = datetime.strptime(day, "%Y/%m/%d")
+        if runs and dt - runs[-1][1] == timedelta(days=1):
+            runs[-1][1] = dt
+            runs[-1][2].append(day)
+        else:
+            runs.append([dt, dt, [day]])
+    return [run[2] for run in runs]
+
+def _rolled_up(run):
+    """
+    Fallback when fetching `run` failed: True if every day in it is already in the
+    rollup (e.g. today's figure from an earlier fetch), which is then served as stale.
+    """
+    stored = rollup_store.get(run)
+    if any(day not in stored for day in run):
+        return False
+    # updated_at is 0 for days reopened by hand; their age is unknown
+    note_stale(max((time.time() - row["updated_at"] for row in stored.values() if row["updated_at"]), default=0.0))
+    return True
+
+def get_daily_totals(days):
+    """Returns {day: totals} for YYYY/MM/DD days, fetching only days not yet rolled up."""
+    today = datetime.now().strftime("%Y/%m/%d")
+    for run in _runs(_days_to_fetch(days, rollup_store.get(days), today)):
+        totals = _fetch_totals(run)
+        if totals is None:
+            if _rolled_up(run): continue
+            return None
+        _store_totals(totals, today)
+    return rollup_store.get(days)
+
+async def get_daily_totals_async(days):
+    """Async version of get_daily_totals; separate runs are fetched concurrently."""
+    today = datetime.now().strftime("%Y/%m/%d")
+    runs = _runs(_days_to_fetch(days, rollup_store.get(days), today))
+    results = await asyncio.gather(*[_fetch_totals_async(run) for run in runs])
+    for run, totals in zip(runs, results):
+        if totals is None:
+            if _rolled_up(run): continue
+            return None
+        _store_totals(totals, today)
+    return rollup_store.get(days)
+
+def get_sales_dashboard(specific_date_str=None):
+    """
+    Returns sales stats for a specific date AND the previous day (for comparison).
+    Served from the daily rollup; only missing or open days hit the API.
+    """
+    dates = _dashboard_range(specific_date_str)
+    if dates is None:
+        return None
+    target_date, prev_date = dates
     
-    # Payload requests range from PrevDate to TargetDate
-    payload = {"DateFrom": prev_date, "DateTo": target_date}
+    try:
+        stored = get_daily_totals([prev_date, target_date])
+        return _stats(stored, target_date, prev_date) if stored is not None else None
+    except Exception as e:
+        print(f"Sales API Error: {e}")
+        return None
+
+async def get_sales_dashboard_async(specific_date_str=None):
+    """Async version of get_sales_dashboard (used by the Telegram handlers)."""
+    dates = _dashboard_range(specific_date_str)
+    if dates is None:
+        return None
+    target_date, prev_date = dates
     
     try:
-        response = api_client.post(url, json_payload=payload)
-        data = []
-        if response and isinstance(response, dict):
-            data = response.get("ResultTable", [])
-            
-        stats = {"sales": 0.0, "prev_sales": 0.0, "count": 0, "date": target_date}
-        
-        for inv in data:
-            if inv.get("Cancelled") == "T": continue
-            
-            # Clean date string "2026-01-29T00..." -> "2026/01/29"
-            doc_date_raw = inv.get("DocDate", "")[:10].replace("-", "/")
-            
-            amount = float(inv.get("FinalTotal", inv.get("NetTotal", 0.0)))
-            
-            if doc_date_raw == target_date:
-                stats["sales"] += amount
-                stats["count"] += 1
-            elif doc_date_raw == prev_date:
-                stats["prev_sales"] += amount
-                
-        return stats
+        stored = await get_daily_totals_async([prev_date, target_date])
+        return _stats(stored, target_date, prev_date) if stored is not None else None
+    except Exception as e:
+        print(f"Sales API Error: {e}")
+        return None
+
+async def compare_days_async(date1_str, date2_str):
+    """Sales for two days (no previous-day padding), or None if either date/fetch fails."""
+    days = []
+    for date_str in (date1_str, date2_str):
+        dt = _parse_target_date(date_str)
+        if dt is None:
+            return None
+        days.append(dt.strftime("%Y/%m/%d"))
+    try:
+        stored = await get_daily_totals_async(days)
     except Exception as e:
         print(f"Sales API Error: {e}")
-        return None
\ No newline at end of file
+        return None
+    if stored is None:
+        return None
+    return [{"sales": (stored.get(day) or {}).get("sales", 0.0), "date": day} for day in days]
@@ -0,0 +1,121 @@
+import heapq
+import re
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+MAX_PREFIX = 10
+
+def _tokens(text):
+    return _TOKEN_RE.findall(text.lower())
+
+def _trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class SearchIndex:
+    """
+    In-memory lookup over one master-data table (debtors or items).
+
+    Built once per cache refresh (register `build` as a SnapshotCache listener);
+    code_field and text_fields are record attributes (e.g. Item.item_code).
+    Candidates come from token prefixes; trigrams catch typos when no prefix
+    matches. Results are ranked so "Apple" prefers "Apple iPhone" over
+    "Pineapple Juice".
+    """
+    def __init__(self, code_field, text_fields):
+        self.code_field = code_field
+        self.text_fields = text_fields
+        self.rows = []
+        self._codes = {}
+        self._prefixes = {}
+        self._trigrams = {}
+        self._names = []
+        self._words = []
+        self._gram_counts = []
+
+    def build(self, rows):
+        codes, prefixes, trigrams, names, words_by_row, gram_counts = {}, {}, {}, [], [], []
+        for idx, row in enumerate(rows):
+            code = str(getattr(row, self.code_field) or "").lower()
+            text = " ".join(str(getattr(row, f) or "") for f in self.text_fields).lower()
+            names.append((code, text))
+            if code:
+                codes[code] = idx
+
+            words = frozenset(_tokens(code) + _tokens(text))
+            words_by_row.append(words)
+            for token in words:
+                for n in range(1, min(len(token), MAX_PREFIX) + 1):
+                    prefixes.setdefault(token[:n], set()).add(idx)
+
+            grams = _trigrams(f"{code} {text}")
+            gram_counts.append(len(grams))
+            for gram in grams:
+                trigrams.setdefault(gram, []).append(idx)
+
+        # Swap in one go so a concurrent search never sees a half-built index
+        (self.rows, self._codes, self._prefixes, self._trigrams,
+         self._names, self._words, self._gram_counts) = rows, codes, prefixes, trigrams, names, words_by_row, gram_counts
+
+    def exact(self, query):
+        """Row whose code matches the query exactly (case-insensitive), else None."""
+        idx = self._codes.get(query.strip().lower())
+        return self.rows[idx] if idx is not None else None
+
+    def _score(self, idx, query, q_tokens):
+        """Cheap ranking on exact code/name, whole tokens and token prefixes."""
+        code, text = self._names[idx]
+        score = 0.0
+        if code == query: score += 100
+        elif code.startswith(query): score += 50
+        if text == query: score += 80
+        elif text.startswith(query): score += 20
+
+        words = self._words[idx]
+        for token in q_tokens:
+            if token in words: score += 10
+            elif any(w.startswith(token) for w in words): score += 6
+        # Prefer tighter names on ties
+        return score - len(text) / 1000
+
+    def _similarity(self, idx, q_grams, common=None):
+        """Trigram Jaccard similarity; catches typos and partial words."""
+        if common is None:
+            code, text = self._names[idx]
+            common = len(q_grams & _trigrams(f"{code} {text}"))
+        return 10 * common / (len(q_grams) + self._gram_counts[idx] - common)
+
+    def search(self, query, k=5):
+        """Top-k rows for `query`, best first."""
+        query = (query or "").strip().lower()
+        if not query or not self.rows:
+            return []
+
+        q_tokens = _tokens(query)
+        q_grams = _trigrams(query)
+        postings = [self._prefixes.get(token[:MAX_PREFIX], set()) for token in q_tokens]
+
+        # Rows matching every token first; any token if none match them all
+        candidates = set.intersection(*postings) if postings else set()
+        if not candidates and postings:
+            candidates = set.union(*postings)
+
+        if candidates:
+            # Rank cheaply, then refine a shortlist with trigram similarity
+            shortlist = heapq.nlargest(max(k * 10, 50), candidates, key=lambda idx: self._score(idx, query, q_tokens))
+            best = heapq.nlargest(k, shortlist, key=lambda idx: self._score(idx, query, q_tokens) + self._similarity(idx, q_grams))
+        else:
+            # No prefix hit (typo): rows sharing at least a third of the trigrams
+            shared = {}
+            for gram in q_grams:
+                for idx in self._trigrams.get(gram, ()):
+                    shared[idx] = shared.get(idx, 0) + 1
+            need = max(1, len(q_grams) // 3)
+            candidates = [idx for idx, n in shared.items() if n >= need]
+            best = heapq.nlargest(k, candidates, key=lambda idx: self._score(idx, query, q_tokens) + self._similarity(idx, q_grams, shared[idx]))
+
+        return [self.rows[idx] for idx in best]
+
+    def best(self, query):
+        """Single best match, or None."""
+        hits = self.search(query, 1)
+        return hits[0] if hits else None
@@ -1,44 +1,215 @@
-from src.api.client import api_client
-
-def _get_qty(item):
-    """Calculates total quantity looking at BalQty, Qty, and ItemDTL."""
-    total_qty = 0.0
-    if 'BalQty' in item: total_qty = float(item['BalQty'])
-    elif 'Qty' in item: total_qty = float(item['Qty'])
-    
-    if "ItemDTL" in item and isinstance(item["ItemDTL"], list):
-        for dtl in item["ItemDTL"]: 
-            total_qty += float(dtl.get("BalQty", dtl.get("Qty", 0)))
-    return total_qty
+import threading
+import time
+from collections import OrderedDict
+from src.api.client import api_client, async_api_client
+from src.api.cache import SnapshotCache
+from src.api.search import SearchIndex
+from src.api.records import Item
+from src.config import Config
+from src.tracing import tracer
+from src.api.resilience import note_stale
 
-def get_stock_raw():
-    """Fetches all items with batch balance."""
+STOCK_ENDPOINT = "api/V2/Item/GetItem"
+
+def _stock_payload():
     # Matches bot_main.py: /api/V2/Item/GetItem
-    payload = {"ItemCode": [], "IncludeBatchBal": True}
-    response = api_client.post("api/V2/Item/GetItem", json_payload=payload)
-    
+    return {"ItemCode": [], "IncludeBatchBal": True}
+
+def _catalog_payload():
+    # Catalogue only: skipping batch balances keeps the full download small
+    return {"ItemCode": [], "IncludeBatchBal": False}
+
+def _qty_payload(codes):
+    return {"ItemCode": list(codes), "IncludeBatchBal": True}
+
+def _parse_stock(response):
     if response and isinstance(response, dict):
         return response.get("ResultTable", [])
     return []
 
+@tracer.traced("filter.find_stock")
+def _find_stock(data, keyword):
+    if not data: return None
+    # Exact ItemCode first, otherwise the best-ranked code/description match
+    return stock_index.exact(keyword) or stock_index.best(keyword)
+
+def get_stock_raw():
+    """Fetches all items with batch balance (full download, bypasses the snapshot)."""
+    return _parse_stock(api_client.post(STOCK_ENDPOINT, json_payload=_stock_payload()))
+
+async def get_stock_raw_async():
+    """Async: fetches all items with batch balance (full download, bypasses the snapshot)."""
+    return _parse_stock(await async_api_client.post(STOCK_ENDPOINT, json_payload=_stock_payload()))
+
+# --- INVENTORY SNAPSHOT ---
+# The catalogue (codes, descriptions, prices) rarely changes and is cached for
+# STOCK_CATALOG_TTL. Quantities are refreshed per item, only for items someone
+# is actually looking at, in small GetItem calls with IncludeBatchBal.
+
+# Streamed: reading stops one row past the cap, so an oversized catalogue is
+# neither downloaded nor parsed in full (the cache logs the truncation).
+_CATALOG_LIMIT = Config.STOCK_CACHE_MAX_ROWS + 1 if Config.STOCK_CACHE_MAX_ROWS else None
+
+def _fetch_catalog():
+    stream = api_client.stream_rows(STOCK_ENDPOINT, json_payload=_catalog_payload())
+    return stream.take(_CATALOG_LIMIT) if stream else None
+
+async def _fetch_catalog_async():
+    stream = await async_api_client.stream_rows(STOCK_ENDPOINT, json_payload=_catalog_payload())
+    return await stream.take(_CATALOG_LIMIT) if stream else None
+
+stock_cache = SnapshotCache(
+    name="stock",
+    fetch=_fetch_catalog,
+    fetch_async=_fetch_catalog_async,
+    ttl=Config.STOCK_CATALOG_TTL,
+    key_field="item_code",
+    max_rows=Config.STOCK_CACHE_MAX_ROWS,
+    refresh_ahead=Config.CACHE_REFRESH_AHEAD,
+    record=Item.from_row
+)
+
+# Rebuilt on every catalogue refresh
+stock_index = SearchIndex("item_code", ["description", "desc2"])
+stock_cache.listeners.append(stock_index.build)
+
+class QuantityTracker:
+    """
+    Remembers when each item's quantity was last refreshed and which items are hot.
+    Shared by the event loop, sync readers and the catalogue refresh (in a worker
+    thread), so the two dicts are only touched under the lock.
+    """
+    def __init__(self, ttl, hot_size):
+        self.ttl = ttl
+        self.hot_size = hot_size
+        self.refreshed_at = {}
+        self.hot = OrderedDict()
+        self._lock = threading.Lock()
+
+    def touch(self, codes):
+        with self._lock:
+            for code in codes:
+                self.hot[code] = True
+                self.hot.move_to_end(code)
+            while len(self.hot) > self.hot_size:
+                self.hot.popitem(last=False)
+
+    def hot_codes(self):
+        with self._lock:
+            return list(self.hot)
+
+    def mark_stale(self, codes):
+        with self._lock:
+            for code in codes:
+                self.refreshed_at.pop(code, None)
+
+    def reset(self, rows=None):
+        # A new catalogue snapshot carries no batch balances
+        with self._lock:
+            self.refreshed_at.clear()
+
+    def age(self, codes):
+        """Age of the oldest quantity among `codes` (the catalogue's age if never refreshed)."""
+        now = time.monotonic()
+        catalogue = stock_cache.age() or 0.0
+        with self._lock:
+            return max(now - self.refreshed_at[c] if c in self.refreshed_at else catalogue for c in codes)
+
+    def stale(self, codes):
+        """Codes whose quantity is older than the TTL, or was never refreshed."""
+        now = time.monotonic()
+        with self._lock:
+            return [c for c in codes if c not in self.refreshed_at or now - self.refreshed_at[c] >= self.ttl]
+
+    def apply(self, rows):
+        """Patches fresh quantities (BalQty/Qty, ItemDTL) into the cached Item records."""
+        now = time.monotonic()
+        refreshed = []
+        for fresh in rows:
+            code = fresh.get("ItemCode")
+            cached = stock_cache.lookup(code)
+            if cached is None:
+                continue
+            cached.update_quantities(fresh)
+            refreshed.append(cached.item_code)
+        with self._lock:
+            self.refreshed_at.update(dict.fromkeys(refreshed, now))
+
+qty_tracker = QuantityTracker(Config.STOCK_QTY_TTL, Config.STOCK_HOT_ITEMS)
+stock_cache.listeners.append(qty_tracker.reset)
+
+def refresh_quantities(codes):
+    """Refreshes quantities for the given item codes in one small request."""
+    codes = [c for c in codes if c]
+    if not codes: return
+    response = api_client.post(STOCK_ENDPOINT, json_payload=_qty_payload(codes))
+    if response is None:
+        note_stale(qty_tracker.age(codes))
+    qty_tracker.apply(_parse_stock(response))
+
+async def refresh_quantities_async(codes):
+    """Async: refreshes quantities for the given item codes in one small request."""
+    codes = [c for c in codes if c]
+    if not codes: return
+    response = await async_api_client.post(STOCK_ENDPOINT, json_payload=_qty_payload(codes))
+    if response is None:
+        note_stale(qty_tracker.age(codes))
+    qty_tracker.apply(_parse_stock(response))
+
+async def refresh_hot_quantities(context=None):
+    """Scheduled job: keeps quantities of recently viewed items warm."""
+    if not stock_cache.is_loaded(): return
+    await refresh_quantities_async(qty_tracker.stale(qty_tracker.hot_codes()))
+
+def mark_items_dirty(codes):
+    """Forces a quantity refresh for items touched by a new document."""
+    qty_tracker.mark_stale(codes)
+
+def _codes(rows):
+    return [r.item_code for r in rows]
+
+# --- READ PATHS ---
+
 def get_stock_list(limit=20):
-    """Returns list of items with show_qty."""
-    data = get_stock_raw()
-    if not data: return []
-    
-    for i in data:
-        i['show_qty'] = _get_qty(i)
-        
-    return data[:limit]
+    """Returns the first `limit` Item records with fresh quantities."""
+    items = stock_cache.get()[:limit]
+    qty_tracker.touch(_codes(items))
+    refresh_quantities(qty_tracker.stale(_codes(items)))
+    return items
 
 def get_stock_profile(keyword):
     """Finds exact item."""
-    data = get_stock_raw()
-    if not data: return None
-    
-    keyword = keyword.lower()
-    for item in data:
-        if keyword in item.get("ItemCode", "").lower() or keyword in item.get("Description", "").lower():
-            item['show_qty'] = _get_qty(item)
-            return item
-    return None
\ No newline at end of file
+    item = _find_stock(stock_cache.get(), keyword)
+    if item:
+        qty_tracker.touch([item.item_code])
+        refresh_quantities(qty_tracker.stale([item.item_code]))
+    return item
+
+# --- ASYNC VERSIONS (used by the Telegram handlers) ---
+
+async def get_stock_list_async(limit=20, with_qty=True):
+    """Async: returns the first `limit` Item records. Pass with_qty=False when only prices are shown."""
+    items = (await stock_cache.get_async())[:limit]
+    if with_qty:
+        qty_tracker.touch(_codes(items))
+        await refresh_quantities_async(qty_tracker.stale(_codes(items)))
+    return items
+
+async def get_stock_profile_async(keyword):
+    """Async: finds exact item."""
+    item = _find_stock(await stock_cache.get_async(), keyword)
+    if item:
+        qty_tracker.touch([item.item_code])
+        await refresh_quantities_async(qty_tracker.stale([item.item_code]))
+    return item
+
+async def suggest_items_async(keyword, k=5):
+    """
+    Wizard lookup: returns (exact_match, candidates).
+    exact_match is set only when the input is a known ItemCode.
+    """
+    await stock_cache.get_async()
+    exact = stock_index.exact(keyword)
+    if exact:
+        return exact, [exact]
+    return None, stock_index.search(keyword, k)
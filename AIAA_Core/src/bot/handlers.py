@@ -1,17 +1,108 @@
-﻿from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+﻿import asyncio
+import importlib
+import io
+import time
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile
 from telegram.ext import ContextTypes, ConversationHandler
-from datetime import datetime, timedelta
-from src.ai.agent import interpret_intent
+from datetime import datetime
+from src.config import Config
+from src.api.client import erp_status, async_api_client
+from src.metrics import endpoint_summary, counter_total
+from src.ai.agent import interpret_intent_async, TIER_STATS
+from src.ai.inference import QueueFull, Superseded, inference_queue
+from src.ai.intent_cache import intent_cache
+from src.tracing import tracer
+from src.bot.utils import within_budget
+from src.bot.outbox import outbox_worker, outbox_store, status_text
+from src.bot.reports import precomputed, subscriber_store, stamp, send_digest_to
+from src.api.resilience import open_circuits, deadline_exceeded
 import src.api.stock as stock_api
 import src.api.debtor as debtor_api
 import src.api.sales as sales_api
-import src.api.invoice as invoice_api
 
 # --- CONVERSATION STATES ---
 INVOICE_DEBTOR, INVOICE_ITEM, INVOICE_QTY, INVOICE_CONFIRM = range(4)
 DEBTOR_NAME, DEBTOR_PHONE, DEBTOR_CONFIRM = range(4, 7)
 
 # --- MENU BUILDER ---
+async def _analytics():
+    """
+    src.api.analytics pulls in pandas, so it is imported on first use (main.py
+    preloads it in the background); in a worker thread, so an update that
+    arrives before the preload has finished does not block the event loop.
+    """
+    return await asyncio.to_thread(importlib.import_module, "src.api.analytics")
+
+def _empty_reply(text):
+    """`text` for an empty result, unless AutoCount ran out of time or is unreachable - then say that instead."""
+    if deadline_exceeded():
+        return "⌛ AutoCount did not answer in time. Please try again in a moment."
+    if not erp_status.is_down():
+        return text
+    since = datetime.fromtimestamp(erp_status.down_since).strftime("%H:%M")
+    return f"⚠️ ERP unavailable: AutoCount has not been responding since {since}. Please try again in a few minutes."
+
+def _limit(args, default=5, most=20):
+    """The intent's "limit" argument, clamped to 1..`most` (`default` if missing or not a number)."""
+    try:
+        return max(1, min(int(args.get("limit", default)), most))
+    except (TypeError, ValueError):
+        return default
+
+def _lines_summary(lines):
+    """Invoice lines as shown in the confirmation messages, and the invoice total."""
+    text = "\n".join(
+        f"📦 {l['desc']} (`{l['item_code']}`)\n    {l['qty']:g} x RM {l['price']:,.2f} = RM {l['qty'] * l['price']:,.2f}"
+        for l in lines
+    )
+    return text, sum(l['qty'] * l['price'] for l in lines)
+
+def _invoice_lines(lines):
+    """Wizard/fast-track lines -> (item_code, qty, unit_price) for src.api.invoice."""
+    return [(l['item_code'], l['qty'], l['price']) for l in lines]
+
+# Pending fast-track invoices, per user: {draft id: {"debtor", "lines"}}. Kept
+# apart from the wizard's inv_debtor/inv_lines, and the id travels in the
+# button's callback data, so each Confirm queues exactly the draft it showed.
+FAST_DRAFTS_KEPT = 20
+
+def _save_fast_draft(context, draft_id, debtor, lines):
+    drafts = context.user_data.setdefault('fast_inv', {})
+    drafts[draft_id] = {"debtor": debtor, "lines": lines}
+    for old in sorted(drafts)[:-FAST_DRAFTS_KEPT]:
+        del drafts[old]
+
+def _pop_fast_draft(context, data):
+    """The draft named by a "fast_inv_yes:<id>" / "fast_inv_no:<id>" callback, removed from user_data (or None)."""
+    _, _, draft_id = data.partition(':')
+    if not draft_id.isdigit():
+        return None
+    return context.user_data.get('fast_inv', {}).pop(int(draft_id), None)
+
+def _write_key(kind, message):
+    """Idempotency key of a confirmation: taps on the same confirm message queue one write."""
+    return f"{kind}:{message.chat_id}:{message.message_id}"
+
+def _ageing_reply(r, built_at):
+    """Ageing / credit-exposure summary plus a button that downloads the full table."""
+    buckets = "\n".join([f"• {label} days: RM {value:,.2f} ({value / r['total'] * 100 if r['total'] else 0:.0f}%)" for label, value in r['buckets'].items()])
+    over = "\n".join([f"• {d['company_name']}: RM {d['balance']:,.2f} / {d['credit_limit']:,.0f} ({d['utilisation'] * 100:.0f}%)" for d in r['top_over_limit']])
+    msg = (
+        f"⏳ **Debtor Ageing** ({r['day']})\n"
+        f"💰 Outstanding: RM {r['total']:,.2f} across {r['debtors']} customers\n"
+        f"━━━━━━━━━━━━━━━━━━\n{buckets}\n━━━━━━━━━━━━━━━━━━\n"
+        f"🚨 Over credit limit: {r['over_limit']} (RM {r['over_limit_amount']:,.2f} above limit)"
+        + (f"\n{over}" if over else "")
+        + f"\n{stamp(built_at)}"
+    )
+    return msg, InlineKeyboardMarkup([[InlineKeyboardButton("📥 Download CSV", callback_data="dl_ageing")]])
+
+async def _queued(query, context, row, created):
+    """Answers a confirm tap from the outbox: queued now, or where the earlier tap got to."""
+    await query.message.edit_text(status_text(row), parse_mode='Markdown')
+    if created:
+        outbox_worker.kick(context.bot)
+
 def get_main_menu():
     keyboard = [
         [
@@ -26,6 +117,9 @@ def get_main_menu():
             InlineKeyboardButton("🏆 Top Debtors", callback_data="btn_debtors_top"),
             InlineKeyboardButton("👥 Customer List", callback_data="btn_debtors_all")
         ],
+        [
+            InlineKeyboardButton("⏳ Debtor Ageing", callback_data="btn_ageing")
+        ],
         [
             InlineKeyboardButton("📦 Stock Catalog", callback_data="btn_stock_list"),
             InlineKeyboardButton("🔍 Help / Tips", callback_data="btn_help")
@@ -34,6 +128,8 @@ def get_main_menu():
     return InlineKeyboardMarkup(keyboard)
 
 # --- COMMANDS ---
+@tracer.traced_handler
+@within_budget
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     welcome_text = (
         "🤖 **AutoCount AI Dashboard**\n"
@@ -42,20 +138,114 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     await update.message.reply_text(welcome_text, reply_markup=get_main_menu(), parse_mode='Markdown')
 
+@tracer.traced_handler
+@within_budget
+async def subscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/subscribe: the morning digest (the menu reports, open to every user) is pushed to this chat on report days."""
+    if subscriber_store.add(update.effective_chat.id):
+        msg = f"☀️ Subscribed! The morning digest arrives here at {Config.DIGEST_AT}. Send /unsubscribe to stop it."
+    else:
+        msg = "☀️ This chat already gets the morning digest. Send /unsubscribe to stop it."
+    await update.message.reply_text(msg)
+
+@tracer.traced_handler
+@within_budget
+async def unsubscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/unsubscribe: stops the morning digest for this chat."""
+    if subscriber_store.remove(update.effective_chat.id):
+        await update.message.reply_text("🔕 Unsubscribed from the morning digest.")
+    else:
+        await update.message.reply_text("🔕 This chat is not subscribed.")
+
+@tracer.traced_handler
+@within_budget
+async def digest_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/digest: today's digest now, from the precomputed reports."""
+    for name in ("sales_yesterday", "sales_today", "debtors_top"):
+        await precomputed.serve(name)
+    # The ageing report is only included once built (it is the slow one)
+    if not await send_digest_to(context.bot, [update.effective_chat.id]):
+        await update.message.reply_text(_empty_reply("❌ No reports available yet."))
+
+@tracer.traced_handler
+@within_budget
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin-only: AutoCount call metrics, intent tiers, queue and cache state."""
+    if update.effective_user.id not in Config.ADMIN_IDS:
+        await update.message.reply_text("⛔ This command is for administrators only.")
+        return
+
+    rows = endpoint_summary()
+    api_lines = "\n".join([
+        f"• `{r['endpoint'].removeprefix('api/')}` {r['calls']}x · {r['p50_ms']:.0f}/{r['p95_ms']:.0f} ms · "
+        f"{r['avg_kb']:,.0f} KB · decode {r['decode_ms']:.1f} ms · 401/5xx/err {r['401']}/{r['5xx']}/{r['errors']}"
+        + (f" · 🔗 {r['shared']:.0f} shared" if r['shared'] else "")
+        + (f" · ⏳ {r['in_flight']:.0f} in flight" if r['in_flight'] else "")
+        for r in rows
+    ]) or "• No calls yet."
+    erp = (
+        f"⚠️ unavailable since {datetime.fromtimestamp(erp_status.down_since):%H:%M:%S} `{erp_status.reason}`"
+        if erp_status.is_down() else "✅ reachable"
+    )
+    circuits = ", ".join(f"`{name.removeprefix('api/')}` {state.replace('_', '-')}" for name, state in open_circuits().items())
+    circuits = f"🔴 Circuits: {circuits}\n" if circuits else ""
+    remaining = async_api_client.expires_at - time.time()
+    token = f"expires in {remaining / 60:.0f} min" if async_api_client.auth_key and remaining > 0 else "none"
+    cache = intent_cache.stats()
+    queue = inference_queue.stats()
+    outbox = outbox_store.counts()
+    outbox = (
+        f"📨 Outbox: {outbox.get('pending', 0)} pending, {outbox.get('unknown', 0)} being checked, "
+        f"{outbox.get('sent', 0)} sent, {outbox.get('failed', 0)} failed\n"
+    )
+    ages = precomputed.ages()
+    reports = (
+        "🗂️ Reports: " + (", ".join(f"{name} {age / 60:.0f} min" for name, age in ages.items()) or "none built yet")
+        + f" · {len(subscriber_store)} digest subscriber(s)\n"
+    )
+    snapshots = "\n".join([
+        f"• {c.name}: {len(c.peek())} rows" + (f", age {c.age():.0f}s" if c.is_loaded() else ", not loaded")
+        for c in (debtor_api.debtor_cache, stock_api.stock_cache)
+    ])
+
+    msg = (
+        "📊 **Bot Stats**\n"
+        "━━━━━━━━━━━━━━━━━━\n"
+        f"🔌 ERP: {erp}\n"
+        "🌐 **AutoCount** (calls · p50/p95 · avg size)\n"
+        f"{api_lines}\n"
+        f"🔐 Logins: {counter_total('autocount_logins_total'):.0f} (re-logins after 401: {counter_total('autocount_relogins_total'):.0f}, "
+        f"waited on a shared login: {counter_total('autocount_login_waits_total'):.0f})\n"
+        f"🔑 Token: {token}\n"
+        f"{circuits}"
+        f"{outbox}"
+        f"{reports}"
+        "━━━━━━━━━━━━━━━━━━\n"
+        f"🧠 Intents: cache {TIER_STATS['cache']} · rules {TIER_STATS['rules']} · LLM {TIER_STATS['llm']}\n"
+        f"💾 Intent cache: {cache['entries']} entries, {cache['hit_rate']:.0%} hit rate\n"
+        f"🤖 LLM queue: {queue['running']}/{queue['workers']} running, {queue['waiting']} waiting\n"
+        "━━━━━━━━━━━━━━━━━━\n"
+        f"🗂 **Snapshots**\n{snapshots}"
+    )
+    await update.message.reply_text(msg, parse_mode='Markdown')
+
 # --- INVOICE WIZARD HANDLERS ---
 
+@tracer.traced_handler
+@within_budget
 async def start_invoice_flow(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Step 1: Init Wizard -> List Top 5 Debtors or Ask for Input"""
     query = update.callback_query
     await query.answer()
+    context.user_data['inv_lines'] = []
     
     # Fetch top debtors for quick selection
-    debtors = debtor_api.get_debtor_outstanding(5)
+    debtors = await debtor_api.get_debtor_outstanding_async(5)
     keyboard = []
     if debtors:
         for d in debtors:
-            code = d.get('AccNo', 'Unknown')
-            name = d.get('CompanyName', '')
+            code = d.acc_no
+            name = d.company_name
             keyboard.append([InlineKeyboardButton(f"🏢 {code} ({name})", callback_data=f"sel_debtor_{code}")])
     keyboard.append([InlineKeyboardButton("➕ Create Debtor", callback_data="btn_create_debtor")])
     keyboard.append([InlineKeyboardButton("❌ Cancel Wizard", callback_data="inv_cancel")])
@@ -67,6 +257,8 @@ async def start_invoice_flow(update: Update, context: ContextTypes.DEFAULT_TYPE)
     await query.message.reply_text(msg, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
     return INVOICE_DEBTOR
 
+@tracer.traced_handler
+@within_budget
 async def receive_debtor(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Step 2: Save Debtor -> List Top 5 Items or Ask for Input"""
     if update.callback_query:
@@ -78,29 +270,62 @@ async def receive_debtor(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         user_input = update.message.text.strip()
         message_obj = update.message
+
+        # Typed input: accept a known AccNo, otherwise offer ranked matches
+        exact, candidates = await debtor_api.suggest_debtors_async(user_input)
+        if exact:
+            user_input = exact.acc_no
+        elif candidates:
+            keyboard = [
+                [InlineKeyboardButton(f"🏢 {d.acc_no} ({d.company_name})", callback_data=f"sel_debtor_{d.acc_no}")]
+                for d in candidates
+            ]
+            keyboard.append([InlineKeyboardButton("❌ Cancel Wizard", callback_data="inv_cancel")])
+            await message_obj.reply_text(
+                f"🤔 No exact match for `{user_input}`. Did you mean:",
+                reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown'
+            )
+            return INVOICE_DEBTOR
+        elif debtor_api.debtor_cache.peek():
+            await message_obj.reply_text(f"❌ Customer `{user_input}` not found. Type another name/code, or /cancel.", parse_mode='Markdown')
+            return INVOICE_DEBTOR
         
     context.user_data['inv_debtor'] = user_input
-    
+    await _ask_for_item(message_obj, f"✅ Customer: `{user_input}`\n\n")
+    return INVOICE_ITEM
+
+async def _ask_for_item(message_obj, header):
+    """Item step of the wizard: popular items as buttons, or type to search."""
     # Fetch top items for quick selection
-    items = stock_api.get_stock_list(5)
+    # Buttons only show price, so skip the quantity refresh
+    items = await stock_api.get_stock_list_async(5, with_qty=False)
     keyboard = []
     if items:
         for i in items:
-            code = i.get('ItemCode', 'Unknown')
-            desc = i.get('Description', code)
-            price = float(i.get('Price', 0.0))
-            keyboard.append([InlineKeyboardButton(f"🛒 {desc} (RM {price:,.2f})", callback_data=f"sel_item_{code}")])
+            keyboard.append([InlineKeyboardButton(f"🛒 {i.name} (RM {i.price:,.2f})", callback_data=f"sel_item_{i.item_code}")])
 
     keyboard.append([InlineKeyboardButton("❌ Cancel Wizard", callback_data="inv_cancel")])
 
     msg = (
-        f"✅ Customer: `{user_input}`\n\n"
+        header +
         "📦 **Step 2/3: Select Item**\n"
         "Select a popular item below or **type a product name/code to search**."
     )
     await message_obj.reply_text(msg, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+
+@tracer.traced_handler
+@within_budget
+async def add_invoice_item(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Confirm step -> back to Step 2 for one more invoice line"""
+    query = update.callback_query
+    await query.answer()
+    count = len(context.user_data.get('inv_lines', []))
+    await query.message.edit_reply_markup(reply_markup=None)
+    await _ask_for_item(query.message, f"🧾 {count} item(s) on this invoice so far.\n\n")
     return INVOICE_ITEM
 
+@tracer.traced_handler
+@within_budget
 async def receive_item(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Step 3: Save Item & Price -> Ask Qty"""
     if update.callback_query:
@@ -112,18 +337,32 @@ async def receive_item(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         item_code = update.message.text.strip()
         message_obj = update.message
+
+        # Typed input: accept a known ItemCode, otherwise offer ranked matches
+        exact, candidates = await stock_api.suggest_items_async(item_code)
+        if exact:
+            item_code = exact.item_code
+        elif candidates:
+            keyboard = [
+                [InlineKeyboardButton(f"🛒 {i.item_code} ({i.description})", callback_data=f"sel_item_{i.item_code}")]
+                for i in candidates
+            ]
+            keyboard.append([InlineKeyboardButton("❌ Cancel Wizard", callback_data="inv_cancel")])
+            await message_obj.reply_text(
+                f"🤔 No exact match for `{item_code}`. Did you mean:",
+                reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown'
+            )
+            return INVOICE_ITEM
         
     await message_obj.reply_text("🔍 Checking item details...")
     
-    item_profile = stock_api.get_stock_profile(item_code)
+    item_profile = await stock_api.get_stock_profile_async(item_code)
     
     if item_profile:
-        desc = item_profile.get("Description") or item_profile.get("Desc2") or item_code
-        price = float(item_profile.get("Price", 0.0))
-        if price == 0.0 and "RecPrice" in item_profile:
-             price = float(item_profile["RecPrice"])
+        desc = item_profile.name
+        price = item_profile.price
         
-        context.user_data['inv_item'] = item_profile.get("ItemCode", item_code)
+        context.user_data['inv_item'] = item_profile.item_code
         context.user_data['inv_desc'] = desc
         context.user_data['inv_price'] = price
         
@@ -144,24 +383,30 @@ async def receive_item(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
     return INVOICE_QTY
 
+@tracer.traced_handler
+@within_budget
 async def receive_qty(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Step 4: Calc Total -> Ask Confirmation"""
+    """Step 4: Add Line & Calc Total -> Ask Confirmation (or another item)"""
     qty_text = update.message.text.strip()
     try:
         qty = float(qty_text)
-        context.user_data['inv_qty'] = qty
     except ValueError:
         await update.message.reply_text("❌ Invalid number. Please enter a number (e.g., 10).")
         return INVOICE_QTY
 
     debtor = context.user_data['inv_debtor']
-    item = context.user_data['inv_item']
-    desc = context.user_data['inv_desc']
-    price = context.user_data['inv_price']
-    total = qty * price
+    lines = context.user_data.setdefault('inv_lines', [])
+    lines.append({
+        "item_code": context.user_data['inv_item'],
+        "desc": context.user_data['inv_desc'],
+        "price": context.user_data['inv_price'],
+        "qty": qty,
+    })
+    summary, total = _lines_summary(lines)
 
     keyboard = [
         [InlineKeyboardButton("✅ Confirm Invoice", callback_data="inv_confirm_yes")],
+        [InlineKeyboardButton("➕ Add Another Item", callback_data="inv_add_item")],
         [InlineKeyboardButton("❌ Cancel", callback_data="inv_cancel")]
     ]
     
@@ -169,8 +414,7 @@ async def receive_qty(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "📝 **Confirm Invoice Details**\n"
         "━━━━━━━━━━━━━━━━━━\n"
         f"👤 Customer: `{debtor}`\n"
-        f"📦 Item: {desc}\n"
-        f"🔢 Qty: {qty} x RM {price:,.2f}\n"
+        f"{summary}\n"
         f"💵 **Total: RM {total:,.2f}**\n"
         "━━━━━━━━━━━━━━━━━━\n"
         "Create this invoice now?"
@@ -179,30 +423,30 @@ async def receive_qty(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(msg, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
     return INVOICE_CONFIRM
 
+@tracer.traced_handler
+@within_budget
 async def complete_invoice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Final Action: Call API"""
     query = update.callback_query
     await query.answer()
     
     if query.data == "inv_confirm_yes":
-        await query.message.edit_text("⏳ Sending data to AutoCount...")
-        res = invoice_api.create_invoice(
-            debtor_code=context.user_data['inv_debtor'],
-            item_code=context.user_data['inv_item'],
-            qty=context.user_data['inv_qty'],
-            unit_price=context.user_data['inv_price']
+        row, created = outbox_worker.enqueue_invoice(
+            _write_key("invoice", query.message), query.message.chat_id,
+            context.user_data['inv_debtor'], _invoice_lines(context.user_data['inv_lines'])
         )
-        if res['success']:
-            await query.message.edit_text(f"✅ **Success!**\nInvoice Created: `{res['doc_no']}`", parse_mode='Markdown')
-        else:
-            await query.message.edit_text(f"❌ **Failed**\nError: {res.get('error')}", parse_mode='Markdown')
+        await _queued(query, context, row, created)
             
     return ConversationHandler.END
 
+@tracer.traced_handler
+@within_budget
 async def cancel_invoice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("❌ Operation cancelled.", reply_markup=get_main_menu())
     return ConversationHandler.END
 
+@tracer.traced_handler
+@within_budget
 async def cancel_invoice_inline(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handles inline cancel buttons during Conversation states"""
     query = update.callback_query
@@ -211,18 +455,24 @@ async def cancel_invoice_inline(update: Update, context: ContextTypes.DEFAULT_TY
     return ConversationHandler.END
 
 # --- DEBTOR WIZARD HANDLERS ---
+@tracer.traced_handler
+@within_budget
 async def start_debtor_flow(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     await query.message.reply_text("🆕 **New Customer Wizard**\n\nStep 1/2: Please enter the **Company/Customer Name**.")
     return DEBTOR_NAME
 
+@tracer.traced_handler
+@within_budget
 async def receive_debtor_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_input = update.message.text.strip()
     context.user_data['new_debtor_name'] = user_input
     await update.message.reply_text(f"✅ Name set to: `{user_input}`\n\nStep 2/2: Please enter the **Contact Number**.\n*(Type 'skip' if not applicable)*")
     return DEBTOR_PHONE
 
+@tracer.traced_handler
+@within_budget
 async def receive_debtor_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
     phone = update.message.text.strip()
     context.user_data['new_debtor_phone'] = "" if phone.lower() == 'skip' else phone
@@ -238,20 +488,23 @@ async def receive_debtor_phone(update: Update, context: ContextTypes.DEFAULT_TYP
     await update.message.reply_text(msg, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
     return DEBTOR_CONFIRM
 
+@tracer.traced_handler
+@within_budget
 async def complete_debtor(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     if query.data == "debtor_confirm_yes":
-        await query.message.edit_text("⏳ Sending data to AutoCount...")
-        res = debtor_api.create_debtor(context.user_data['new_debtor_name'], context.user_data['new_debtor_phone'])
-        if res['success']:
-            await query.message.edit_text(f"✅ **Success!**\nCustomer Created! AutoCount Account No: `{res['acc_no']}`", parse_mode='Markdown')
-        else:
-            await query.message.edit_text(f"❌ **Failed**\nError: {res.get('error')}", parse_mode='Markdown')
+        row, created = outbox_worker.enqueue_debtor(
+            _write_key("debtor", query.message), query.message.chat_id,
+            context.user_data['new_debtor_name'], context.user_data['new_debtor_phone']
+        )
+        await _queued(query, context, row, created)
     return ConversationHandler.END
 
 
 # --- STANDARD HANDLERS ---
+@tracer.traced_handler
+@within_budget
 async def handle_button_click(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handles standard menu buttons (non-wizard) AND Fast-Track buttons"""
     query = update.callback_query
@@ -259,120 +512,154 @@ async def handle_button_click(update: Update, context: ContextTypes.DEFAULT_TYPE
     data = query.data
     
     # Fast-Track Handlers
-    if data == 'fast_inv_yes':
-        await query.message.edit_text("⏳ Sending data to AutoCount...")
-        res = invoice_api.create_invoice(
-            debtor_code=context.user_data.get('inv_debtor'),
-            item_code=context.user_data.get('inv_item'),
-            qty=context.user_data.get('inv_qty'),
-            unit_price=context.user_data.get('inv_price')
-        )
-        if res['success']:
-            await query.message.edit_text(f"✅ **Success!**\nInvoice Created: `{res['doc_no']}`", parse_mode='Markdown')
+    if data.startswith('fast_inv_yes'):
+        row = outbox_store.get(_write_key("invoice", query.message))
+        draft = _pop_fast_draft(context, data) if row is None else None
+        if row is not None:
+            await _queued(query, context, row, False)
+        elif draft is None:
+            await query.message.edit_text("⌛ This invoice has expired. Please type the request again.")
         else:
-            await query.message.edit_text(f"❌ **Failed**\nError: {res.get('error')}", parse_mode='Markdown')
+            row, created = outbox_worker.enqueue_invoice(
+                _write_key("invoice", query.message), query.message.chat_id,
+                draft['debtor'], _invoice_lines(draft['lines'])
+            )
+            await _queued(query, context, row, created)
+
+    elif data in ('inv_confirm_yes', 'debtor_confirm_yes'):
+        # Repeat tap after the wizard has ended: show what the first tap queued
+        row = outbox_store.get(_write_key("invoice" if data == 'inv_confirm_yes' else "debtor", query.message))
+        if row is not None:
+            await _queued(query, context, row, False)
 
-    elif data == 'fast_inv_no':
+    elif data.startswith('fast_inv_no'):
+        _pop_fast_draft(context, data)
         await query.message.edit_text("❌ Fast-Track invoice cancelled.")
 
     # Main Menu Read-Only Handlers
+    # Menu reports: served from the scheduled precompute (src/bot/reports.py) with its timestamp
     elif data == 'btn_sales_today':
-        target_date = datetime.now().strftime("%Y/%m/%d")
-        s = sales_api.get_sales_dashboard(target_date)
+        s, built_at = await precomputed.serve("sales_today")
         if s:
             icon = "📈" if s['sales'] >= s['prev_sales'] else "📉"
-            msg = f"📊 **Sales Dashboard: Today**\n💵 Revenue: RM {s['sales']:,.2f}\n🧾 Invoices: {s['count']}\n({icon} vs Prev Day: RM {s['prev_sales']:,.2f})"
+            msg = f"📊 **Sales Dashboard: Today**\n💵 Revenue: RM {s['sales']:,.2f}\n🧾 Invoices: {s['count']} (🚫 {s['cancelled']} cancelled)\n({icon} vs Prev Day: RM {s['prev_sales']:,.2f})\n{stamp(built_at)}"
             await query.message.reply_text(msg, parse_mode='Markdown')
         else:
-            await query.message.reply_text("❌ No data for today.")
+            await query.message.reply_text(_empty_reply("❌ No data for today."))
 
     elif data == 'btn_sales_yesterday':
-        target_date = (datetime.now() - timedelta(days=1)).strftime("%Y/%m/%d")
-        s = sales_api.get_sales_dashboard(target_date)
+        s, built_at = await precomputed.serve("sales_yesterday")
         if s:
-            msg = f"📉 **Sales: Yesterday ({s['date']})**\n💵 Revenue: RM {s['sales']:,.2f}\n🧾 Invoices: {s['count']}"
+            msg = f"📉 **Sales: Yesterday ({s['date']})**\n💵 Revenue: RM {s['sales']:,.2f}\n🧾 Invoices: {s['count']}\n{stamp(built_at)}"
             await query.message.reply_text(msg, parse_mode='Markdown')
+        else:
+            await query.message.reply_text(_empty_reply("❌ No data for yesterday."))
 
     elif data == 'btn_debtors_top':
-        data = debtor_api.get_debtor_outstanding(5)
-        msg = f"🏆 **Top 5 Debtors**\n" + "\n".join([f"• {d['CompanyName']}: RM {d['show_bal']:,.2f}" for d in data]) if data else "✅ No outstanding debt."
+        data, built_at = await precomputed.serve("debtors_top")
+        msg = f"🏆 **Top 5 Debtors**\n" + "\n".join([f"• {name}: RM {balance:,.2f}" for name, balance in data]) + f"\n{stamp(built_at)}" if data else _empty_reply("✅ No outstanding debt.")
         await query.message.reply_text(msg, parse_mode='Markdown')
 
     elif data == 'btn_debtors_all':
-        data = debtor_api.get_all_debtors(20)
-        msg = "👥 **Customer Directory**\n" + "\n".join([f"• `{d['AccNo']}` {d['CompanyName']}" for d in data]) if data else "❌ No customers found."
+        data = await debtor_api.get_all_debtors_async(20)
+        msg = "👥 **Customer Directory**\n" + "\n".join([f"• `{d.acc_no}` {d.company_name}" for d in data]) if data else _empty_reply("❌ No customers found.")
         await query.message.reply_text(msg, parse_mode='Markdown')
 
+    elif data in ('btn_ageing', 'dl_ageing'):
+        r, built_at = await precomputed.serve("ageing")
+        if not r:
+            await query.message.reply_text(_empty_reply("❌ Error fetching data."))
+        elif data == 'dl_ageing':
+            csv = (await _analytics()).ageing_csv(r)
+            await query.message.reply_document(InputFile(io.BytesIO(csv), filename=f"ageing_{r['day'].replace('/', '-')}.csv"))
+        else:
+            msg, markup = _ageing_reply(r, built_at)
+            await query.message.reply_text(msg, reply_markup=markup, parse_mode='Markdown')
+
     elif data == 'btn_stock_list':
-        data = stock_api.get_stock_list(20)
-        msg = "📦 **Stock Catalog**\n" + "\n".join([f"• `{i['ItemCode']}` {i['Description']}: **{i['show_qty']}**" for i in data]) if data else "❌ No items found."
+        data, built_at = await precomputed.serve("stock_list")
+        msg = "📦 **Stock Catalog**\n" + "\n".join([f"• `{i.item_code}` {i.description}: **{i.qty}**" for i in data]) + f"\n{stamp(built_at)}" if data else _empty_reply("❌ No items found.")
         await query.message.reply_text(msg, parse_mode='Markdown')
         
     elif data == 'btn_help':
-        msg = "💡 **How to use AutoCount AI**\n\n**1. Chat:** Type 'Invoice for TechCorp for 5 Apple' or 'Sales today'."
+        msg = "💡 **How to use AutoCount AI**\n\n**1. Chat:** Type 'Invoice for TechCorp for 5 Apple' or 'Sales today'.\n**2. Digest:** /subscribe for a morning summary, /digest for it now."
         await query.message.reply_text(msg, parse_mode='Markdown')
 
 
+@tracer.traced_handler
 async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Resolves the intent (cache, rules or the LLM queue), then answers it within the request budget."""
     user_text = update.message.text
     
     # AI Processing
     status_msg = await update.message.reply_text("🤔 Thinking...")
-    intent_data = interpret_intent(user_text)
+
+    async def on_status(state, value):
+        text = f"⏳ In queue (position {value})..." if state == "queued" else f"🤔 Still thinking... ({value}s)"
+        try:
+            await status_msg.edit_text(text)
+        except Exception:
+            pass  # Status updates are best-effort
+
+    try:
+        intent_data = await interpret_intent_async(update.effective_user.id, user_text, on_status=on_status)
+    except Superseded:
+        # A newer message from this user is being answered instead
+        await context.bot.delete_message(chat_id=status_msg.chat_id, message_id=status_msg.message_id)
+        return
+    except QueueFull:
+        await status_msg.edit_text("🚦 The assistant is busy right now. Please try again in a moment, or use the menu buttons.")
+        return
+
     intent = intent_data.get("intent")
     args = intent_data.get("args", {})
     
     await context.bot.delete_message(chat_id=status_msg.chat_id, message_id=status_msg.message_id)
+    await _answer_intent(update, context, intent, args)
 
+@within_budget
+async def _answer_intent(update: Update, context: ContextTypes.DEFAULT_TYPE, intent, args):
+    """The AutoCount part of a text message: its budget starts once the intent is known, not before the LLM queue."""
     # --- FAST TRACK INVOICE ---
     if intent == "create_invoice_fast":
         debtor = args.get("debtor")
-        item = args.get("item")
-        qty = args.get("qty", 1)
+        # One item ("item"/"qty") or several ("lines": [{"item", "qty"}, ...])
+        requested = args.get("lines") or [{"item": args.get("item"), "qty": args.get("qty", 1)}]
+        requested = [r for r in requested if isinstance(r, dict) and r.get("item")]
         
-        if not debtor or not item:
-            await update.message.reply_text("❌ Please specify debtor and item. (e.g. 'Invoice for Alpha for 5 Apple')")
+        if not debtor or not requested:
+            await update.message.reply_text("❌ Please specify debtor and item. (e.g. 'Invoice for Alpha for 5 Apple and 2 Helmet')")
             return
-            
-        try:
-            qty = float(qty)
-        except ValueError:
-            qty = 1.0
 
         await update.message.reply_text(f"⚡ Fast Track: Preparing invoice for `{debtor}`...")
         
-        i = stock_api.get_stock_profile(item)
-        if i:
-            desc = i.get("Description") or i.get("Desc2") or item
-            price = float(i.get("Price", 0.0))
-            if price == 0.0 and "RecPrice" in i:
-                 price = float(i.get("RecPrice", 0.0))
-            item_code = i.get("ItemCode", item)
-        else:
-            desc = "Unknown Item"
-            price = 0.0
-            item_code = item
-            
-        total = qty * price
+        profiles = await asyncio.gather(*[stock_api.get_stock_profile_async(r["item"]) for r in requested])
+        lines = []
+        for r, i in zip(requested, profiles):
+            try:
+                qty = float(r.get("qty", 1))
+            except (TypeError, ValueError):
+                qty = 1.0
+            if i:
+                lines.append({"item_code": i.item_code, "desc": i.name, "price": i.price, "qty": qty})
+            else:
+                lines.append({"item_code": r["item"], "desc": "Unknown Item", "price": 0.0, "qty": qty})
+        summary, total = _lines_summary(lines)
         
-        # Save to context for the global confirm handler to read
-        context.user_data['inv_debtor'] = debtor
-        context.user_data['inv_item'] = item_code
-        context.user_data['inv_desc'] = desc
-        context.user_data['inv_price'] = price
-        context.user_data['inv_qty'] = qty
+        # Saved under the request's message id for the global confirm handler to read
+        draft_id = update.message.message_id
+        _save_fast_draft(context, draft_id, debtor, lines)
         
         keyboard = [
-            [InlineKeyboardButton("✅ Confirm Invoice", callback_data="fast_inv_yes")],
-            [InlineKeyboardButton("❌ Cancel", callback_data="fast_inv_no")]
+            [InlineKeyboardButton("✅ Confirm Invoice", callback_data=f"fast_inv_yes:{draft_id}")],
+            [InlineKeyboardButton("❌ Cancel", callback_data=f"fast_inv_no:{draft_id}")]
         ]
         
         msg = (
             "⚡ **Fast-Track Invoice Details**\n"
             "━━━━━━━━━━━━━━━━━━\n"
             f"👤 Customer: `{debtor}`\n"
-            f"📦 Item: {desc} (`{item_code}`)\n"
-            f"🔢 Qty: {qty} x RM {price:,.2f}\n"
+            f"{summary}\n"
             f"💵 **Total: RM {total:,.2f}**\n"
             "━━━━━━━━━━━━━━━━━━\n"
             "Create this invoice now?"
@@ -383,59 +670,135 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
     elif intent == "compare_sales":
         date1 = args.get("date1")
         date2 = args.get("date2")
-        s1 = sales_api.get_sales_dashboard(date1)
-        s2 = sales_api.get_sales_dashboard(date2)
-        if s1 and s2:
+        # Only the two requested days, served from the daily rollup
+        pair = await sales_api.compare_days_async(date1, date2)
+        if pair:
+            s1, s2 = pair
             diff = s1['sales'] - s2['sales']
             icon = "🟢" if diff >= 0 else "🔴"
             msg = f"⚔️ **Comparison**\n{s1['date']}: RM {s1['sales']:,.2f}\n{s2['date']}: RM {s2['sales']:,.2f}\nDiff: {icon} RM {abs(diff):,.2f}"
             await update.message.reply_text(msg, parse_mode='Markdown')
         else:
-            await update.message.reply_text("❌ Error fetching data.")
+            await update.message.reply_text(_empty_reply("❌ Error fetching data."))
 
     elif intent == "get_sales":
         target_date = args.get("date")
-        s = sales_api.get_sales_dashboard(target_date)
+        s = await sales_api.get_sales_dashboard_async(target_date)
         if s:
             await update.message.reply_text(f"📅 **Sales {s['date']}**: RM {s['sales']:,.2f}", parse_mode='Markdown')
         else:
-            await update.message.reply_text("❌ No data.")
+            await update.message.reply_text(_empty_reply("❌ No data."))
+
+    elif intent == "sales_period":
+        analytics_api = await _analytics()
+        period = args.get("period") if args.get("period") in analytics_api.PERIODS else "month"
+        r = await analytics_api.sales_period_report_async(period)
+        if r:
+            change = r['change_pct']
+            trend = f"{'🟢' if change >= 0 else '🔴'} {change:+.1f}% vs previous" if change is not None else "No previous data"
+            lines = "\n".join([f"• {label}: RM {value:,.2f}" for label, value in r['breakdown']])
+            msg = (
+                f"📈 **{r['label']}** ({r['start']} - {r['end']})\n"
+                f"💰 Sales: RM {r['sales']:,.2f}\n"
+                f"🧾 Invoices: {r['count']} (avg RM {r['avg_invoice']:,.2f})\n"
+                f"{trend}"
+                + (f"\n━━━━━━━━━━━━━━━━━━\n{lines}" if lines else "")
+            )
+            await update.message.reply_text(msg, parse_mode='Markdown')
+        else:
+            await update.message.reply_text(_empty_reply("❌ Error fetching data."))
+
+    elif intent == "sales_by_debtor":
+        analytics_api = await _analytics()
+        period = args.get("period") if args.get("period") in analytics_api.PERIODS else "month"
+        r = await analytics_api.sales_by_debtor_async(period, _limit(args))
+        if r and r['rows']:
+            msg = f"🏅 **Top Customers - {r['label']}**\n" + "\n".join([f"• {d['name']}: RM {d['sales']:,.2f} ({d['share']:.1f}%)" for d in r['rows']])
+            await update.message.reply_text(msg, parse_mode='Markdown')
+        else:
+            await update.message.reply_text("❌ No sales in this period." if r else _empty_reply("❌ Error fetching data."))
+
+    elif intent == "sales_by_item":
+        analytics_api = await _analytics()
+        period = args.get("period") if args.get("period") in analytics_api.PERIODS else "month"
+        r = await analytics_api.sales_by_item_async(period, _limit(args))
+        if r and r['rows']:
+            msg = f"🔥 **Best Sellers - {r['label']}**\n" + "\n".join([f"• {i['name']}: {i['qty']:g} sold, RM {i['sales']:,.2f}" for i in r['rows']])
+            await update.message.reply_text(msg, parse_mode='Markdown')
+        elif r:
+            await update.message.reply_text("❌ No sales in this period." if r['has_lines'] else "❌ Item breakdown needs invoice detail lines, which the API did not return.")
+        else:
+            await update.message.reply_text(_empty_reply("❌ Error fetching data."))
 
     elif intent == "list_debtors_outstanding":
-        data = debtor_api.get_debtor_outstanding(args.get("limit", 5))
-        msg = "🏆 **Top Debtors**\n" + "\n".join([f"• {d['CompanyName']}: RM {d['show_bal']:,.2f}" for d in data]) if data else "✅ No debt."
+        try:
+            min_balance = float(args.get("min_balance") or 0)
+        except (TypeError, ValueError):
+            min_balance = 0.0
+        data = await debtor_api.get_debtor_outstanding_async(_limit(args), min_balance)
+        if min_balance:
+            total = await debtor_api.count_debtors_owing_async(min_balance)
+            more = f"\n…and {total - len(data)} more" if total > len(data) else ""
+            msg = (f"💰 **{total} Debtors Owing Over RM {min_balance:,.0f}**\n" + "\n".join([f"• {d.company_name}: RM {d.balance:,.2f}" for d in data]) + more
+                   if data else _empty_reply(f"✅ Nobody owes more than RM {min_balance:,.0f}."))
+        else:
+            msg = "🏆 **Top Debtors**\n" + "\n".join([f"• {d.company_name}: RM {d.balance:,.2f}" for d in data]) if data else _empty_reply("✅ No debt.")
+        await update.message.reply_text(msg, parse_mode='Markdown')
+
+    elif intent == "debtor_ageing":
+        r, built_at = await precomputed.serve("ageing")
+        if r:
+            msg, markup = _ageing_reply(r, built_at)
+            await update.message.reply_text(msg, reply_markup=markup, parse_mode='Markdown')
+        else:
+            await update.message.reply_text(_empty_reply("❌ Error fetching data."))
+
+    elif intent == "list_all_debtors":
+        data = await debtor_api.get_all_debtors_async(20)
+        msg = "👥 **Customer Directory**\n" + "\n".join([f"• `{d.acc_no}` {d.company_name}" for d in data]) if data else _empty_reply("❌ No customers found.")
+        await update.message.reply_text(msg, parse_mode='Markdown')
+
+    elif intent == "list_all_stock":
+        data = await stock_api.get_stock_list_async(20)
+        msg = "📦 **Stock Catalog**\n" + "\n".join([f"• `{i.item_code}` {i.description}: **{i.qty}**" for i in data]) if data else _empty_reply("❌ No items found.")
         await update.message.reply_text(msg, parse_mode='Markdown')
 
     elif intent == "profile_stock":
         kw = args.get("keyword")
-        i = stock_api.get_stock_profile(kw)
+        i = await stock_api.get_stock_profile_async(kw)
         if i:
-            msg = f"📦 **{i['Description']}**\nCode: `{i['ItemCode']}`\nQty: {i['show_qty']}\nPrice: RM {i.get('Price',0):,.2f}"
+            msg = f"📦 **{i.description}**\nCode: `{i.item_code}`\nQty: {i.qty}\nPrice: RM {i.price:,.2f}"
             await update.message.reply_text(msg, parse_mode='Markdown')
         else:
-            await update.message.reply_text("❌ Item not found.")
+            await update.message.reply_text(_empty_reply("❌ Item not found."))
 
     elif intent == "profile_debtor":
         kw = args.get("keyword")
-        d = debtor_api.get_debtor_profile(kw)
+        d = await debtor_api.get_debtor_profile_async(kw)
         if d:
             # Format the debtor details nicely
-            balance = d.get('show_bal', 0.0)
-            credit_limit = d.get('CreditLimit', 0.0)
-            phone = d.get('Phone1', 'N/A')
-            term = d.get('CreditTerm', 'N/A')
+            balance = d.balance
+            credit_limit = d.credit_limit
+            phone = d.phone or 'N/A'
+            term = d.credit_term or 'N/A'
             
             msg = (
-                f"🏢 **Customer Profile: {d['CompanyName']}**\n"
-                f"🆔 Code: `{d['AccNo']}`\n"
+                f"🏢 **Customer Profile: {d.company_name}**\n"
+                f"🆔 Code: `{d.acc_no}`\n"
                 f"📞 Phone: {phone}\n"
                 f"💰 Balance: RM {balance:,.2f}\n"
-                f"💳 Limit: RM {credit_limit:,.2f}\n"
-                f"📅 Term: {term}"
+                f"💳 Limit: RM {credit_limit:,.2f}"
+                + (f" ({balance / credit_limit * 100:.0f}% used{', ⚠️ over limit' if balance > credit_limit else ''})" if credit_limit > 0 else "")
+                + f"\n📅 Term: {term}"
             )
+            # Ageing only if today's report is already built; a profile never waits for it
+            analytics_api = await _analytics()
+            aged = analytics_api.debtor_ageing(d.acc_no)
+            if aged:
+                msg += "\n⏳ Ageing: " + " | ".join([f"{label}: {aged[label]:,.0f}" for label in analytics_api.AGEING_BUCKETS])
             await update.message.reply_text(msg, parse_mode='Markdown')
         else:
-            await update.message.reply_text(f"❌ Customer '{kw}' not found.")
+            await update.message.reply_text(_empty_reply(f"❌ Customer '{kw}' not found."))
 
     else:
         await start_command(update, context)
\ No newline at end of file
@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from telegram.error import BadRequest, Forbidden
+from src.config import Config
+from src.metrics import metrics
+from src.tracing import tracer
+from src.api.resilience import detached
+from src.store.outbox import OutboxStore, PENDING, UNKNOWN, SENT, FAILED
+import src.api.invoice as invoice_api
+import src.api.debtor as debtor_api
+
+logger = logging.getLogger(__name__)
+
+# Confirmed invoices and debtors are written to the outbox first and sent to
+# AutoCount afterwards, so a confirmation answers at once and the write
+# survives an ERP outage or a bot restart. One worker task drains it:
+#   * due invoices go out INVOICE_BATCH_SIZE per api/Invoice request; a batch
+#     AutoCount rejects is split up so one bad document cannot sink the rest;
+#   * a send with an unknown outcome is never repeated blind: the worker first
+#     looks for the document in AutoCount (invoice Ref; for a debtor, a name +
+#     phone match that was not there before the first send);
+#   * each result is reported to the chat that confirmed the write.
+
+outbox_store = OutboxStore(Config.OUTBOX_PATH)
+
+def _ref(row):
+    """Invoice Ref carried by the document, so a lost confirmation can be looked up."""
+    return f"BOT-{row['id']}"
+
+def _retry_delay(attempts):
+    return min(Config.OUTBOX_RETRY_MAX, Config.OUTBOX_RETRY_BASE * 2 ** attempts)
+
+def describe(row):
+    """One line naming the queued write, e.g. "Invoice for `300-A001` (2 items)"."""
+    p = row["payload"]
+    if row["kind"] == "invoice":
+        return f"Invoice for `{p['debtor_code']}` ({len(p['lines'])} item{'s' if len(p['lines']) != 1 else ''})"
+    return f"Customer `{p['company_name']}`"
+
+def status_text(row):
+    """Where a queued write stands, worded for the chat that confirmed it."""
+    if row["status"] == SENT:
+        if row["kind"] == "invoice":
+            return f"✅ **Success!**\nInvoice Created: `{row['result']}`"
+        return f"✅ **Success!**\nCustomer Created! AutoCount Account No: `{row['result']}`"
+    if row["status"] == FAILED:
+        return f"❌ **Failed**\n{describe(row)}\nError: {row['error']}"
+    return f"📨 **Queued for AutoCount**\n{describe(row)}\nYou will get a message here as soon as AutoCount confirms it."
+
+class OutboxWorker:
+    def __init__(self, store):
+        self.store = store
+        self.bot = None
+        self._task = None
+        self._wake = None
+
+    # --- ENQUEUE ---
+    def enqueue_invoice(self, key, chat_id, debtor_code, lines):
+        """Queues one invoice of (item_code, qty, unit_price) lines. Returns (row, created)."""
+        return self._add(key, "invoice", {"debtor_code": debtor_code, "lines": [list(line) for line in lines]}, chat_id)
+
+    def enqueue_debtor(self, key, chat_id, company_name, phone1=""):
+        """Queues one new debtor. Returns (row, created)."""
+        return self._add(key, "debtor", {"company_name": company_name, "phone1": phone1}, chat_id)
+
+    def _add(self, key, kind, payload, chat_id):
+        row, created = self.store.add(key, kind, payload, chat_id)
+        if created:
+            metrics.inc("outbox_enqueued_total", kind=kind)
+        return row, created
+
+    # --- LIFECYCLE ---
+    def kick(self, bot):
+        """Wakes the worker after a write was queued, starting it on the running loop if needed."""
+        self.bot = bot
+        if self._task is None or self._task.done():
+            self._wake = asyncio.Event()
+            # Started from a handler: the worker must not inherit that update's request budget
+            self._task = detached(self._run())
+        self._wake.set()
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            self._wake.clear()
+            try:
+                await self.drain()
+            except Exception as e:
+                logger.error(f"Outbox drain failed: {e}")
+            delay = self.store.next_due()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=Config.OUTBOX_RETRY_MAX if delay is None else max(delay, 1.0))
+            except asyncio.TimeoutError:
+                pass
+
+    # --- DRAIN ---
+    async def drain(self):
+        """Sends everything that is due and reports finished writes; returns once nothing is due."""
+        with tracer.span("outbox.drain"):
+            await self._reconcile(self.store.due(UNKNOWN))
+            while True:
+                invoices = self.store.due(PENDING, "invoice", Config.INVOICE_BATCH_SIZE)
+                debtors = self.store.due(PENDING, "debtor", Config.INVOICE_BATCH_SIZE)
+                if not invoices and not debtors:
+                    break
+                if invoices:
+                    await self._send_invoices(invoices)
+                for row in debtors:
+                    await self._send_debtor(row)
+                await self._notify()
+            await self._notify()
+        counts = self.store.counts()
+        metrics.set("outbox_backlog", counts.get(PENDING, 0) + counts.get(UNKNOWN, 0))
+
+    async def _send_invoices(self, rows):
+        documents = [(_ref(r), r["payload"]["debtor_code"], [tuple(line) for line in r["payload"]["lines"]]) for r in rows]
+        outcome, doc_nos = await invoice_api.post_invoices_async(documents)
+        if outcome == "ok":
+            for row, doc_no in zip(rows, doc_nos):
+                self._sent(row, doc_no)
+            # Their balances moved: re-rank just these debtors on the leaderboard
+            await debtor_api.refresh_balances_async([r["payload"]["debtor_code"] for r in rows])
+        elif outcome == "rejected" and len(rows) > 1:
+            # AutoCount rejects the whole request for one bad document: nothing
+            # was saved, so each one is sent on its own to find it
+            for row in rows:
+                await self._send_invoices([row])
+        elif outcome == "rejected":
+            self._failed(rows[0], "AutoCount rejected this invoice (check the customer and item codes).")
+        else:
+            for row in rows:
+                self._retry(row, outcome)
+
+    async def _send_debtor(self, row):
+        p = row["payload"]
+        if "existing" not in p:
+            # Debtors matching this name + phone before the first send, so a
+            # lost confirmation is never settled with an older debtor's AccNo
+            existing = await debtor_api.find_debtors_async(p["company_name"], p["phone1"])
+            if existing is None:
+                self._retry(row, "unsent")
+                return
+            p["existing"] = existing
+            self.store.set_payload(row["id"], p)
+        outcome, acc_no = await debtor_api.post_debtor_async(p["company_name"], p["phone1"])
+        if outcome == "ok":
+            self._sent(row, acc_no)
+        elif outcome == "rejected":
+            self._failed(row, "AutoCount rejected this customer.")
+        else:
+            self._retry(row, outcome)
+
+    async def _reconcile(self, rows):
+        """Unknown outcome: done if AutoCount has the document, otherwise safe to send again."""
+        invoices = [r for r in rows if r["kind"] == "invoice"]
+        if invoices:
+            since = datetime.fromtimestamp(min(r["created_at"] for r in invoices)).strftime("%Y/%m/%d")
+            found = await invoice_api.find_invoices_by_ref_async([_ref(r) for r in invoices], since)
+            for row in invoices:
+                self._settle(row, None if found is None else found.get(_ref(row), ""))
+        for row in rows:
+            if row["kind"] == "debtor":
+                p = row["payload"]
+                self._settle(row, await debtor_api.find_created_debtor_async(p["company_name"], p["phone1"], p.get("existing", ())))
+
+    def _settle(self, row, result):
+        """result: the DocNo/AccNo found, "" if AutoCount does not have it, None if it could not be asked."""
+        if result:
+            logger.info(f"📨 Outbox #{row['id']} had been saved as {result}; not sending it again.")
+            self._sent(row, result)
+        elif result == "":
+            self.store.reschedule(row["id"], PENDING, "not saved by AutoCount; sending again", 0)
+        else:
+            self._retry(row, UNKNOWN)
+
+    # --- RESULTS ---
+    def _sent(self, row, result):
+        self.store.mark_sent(row["id"], result)
+        metrics.inc("outbox_writes_total", kind=row["kind"], result="sent")
+        metrics.observe("outbox_delivery_seconds", time.time() - row["created_at"], kind=row["kind"])
+
+    def _failed(self, row, error):
+        self.store.mark_failed(row["id"], error)
+        metrics.inc("outbox_writes_total", kind=row["kind"], result="failed")
+        logger.error(f"📨 Outbox #{row['id']} failed: {error}")
+
+    def _retry(self, row, outcome):
+        """AutoCount unreachable ("unsent") or silent ("unknown"): try again later, up to OUTBOX_MAX_ATTEMPTS."""
+        if row["attempts"] + 1 >= Config.OUTBOX_MAX_ATTEMPTS:
+            maybe = " It may still have been created - please check AutoCount before entering it again." if outcome == UNKNOWN else ""
+            self._failed(row, f"AutoCount did not confirm it after {row['attempts'] + 1} attempts.{maybe}")
+            return
+        metrics.inc("outbox_writes_total", kind=row["kind"], result="retry")
+        status = UNKNOWN if outcome == UNKNOWN else PENDING
+        self.store.reschedule(row["id"], status, f"AutoCount {outcome}", _retry_delay(row["attempts"]))
+
+    async def _notify(self):
+        if self.bot is None:
+            return
+        for row in self.store.unnotified():
+            if row["chat_id"] is not None:
+                try:
+                    await self.bot.send_message(chat_id=row["chat_id"], text=status_text(row), parse_mode='Markdown')
+                except (BadRequest, Forbidden) as e:
+                    logger.warning(f"Outbox #{row['id']}: chat {row['chat_id']} cannot be notified: {e}")
+                except Exception as e:
+                    # Telegram unreachable: report it on the next drain
+                    logger.warning(f"Outbox #{row['id']}: notification deferred: {e}")
+                    return
+            self.store.mark_notified(row["id"])
+
+outbox_worker = OutboxWorker(outbox_store)
@@ -0,0 +1,203 @@
+import asyncio
+import importlib
+import logging
+import time
+from datetime import datetime, timedelta
+from telegram.error import BadRequest, Forbidden
+from src.config import Config
+from src.metrics import metrics
+from src.tracing import tracer
+from src.api.client import erp_status
+from src.api.resilience import detached, wait_shared
+from src.bot.utils import clock_time
+from src.store.subscribers import SubscriberStore
+import src.api.sales as sales_api
+import src.api.debtor as debtor_api
+import src.api.stock as stock_api
+
+logger = logging.getLogger(__name__)
+
+# The main-menu reports are the same for every user and are pressed by
+# everyone at once when the office opens. They are built by JobQueue jobs
+# instead (see main.py BACKGROUND JOBS):
+#   * precompute_reports before opening time builds all of them, one after
+#     another, so the ERP sees a handful of sequential reads off-peak;
+#   * keep_reports_warm rebuilds the intraday ones (WARM_REPORTS) on an
+#     interval, but only on report days between REPORTS_PRECOMPUTE_AT and
+#     REPORTS_WARM_UNTIL, so the ERP is left alone at night and at weekends;
+#   * send_digest pushes a summary to the chats that used /subscribe.
+# A button press is answered from the stored result with its timestamp, and
+# only builds the report itself when the stored one is missing or too old.
+
+subscriber_store = SubscriberStore(Config.SUBSCRIBERS_PATH)
+
+def _day(offset=0):
+    return (datetime.now() - timedelta(days=offset)).strftime("%Y/%m/%d")
+
+async def _sales_today():
+    return await sales_api.get_sales_dashboard_async(_day())
+
+async def _sales_yesterday():
+    return await sales_api.get_sales_dashboard_async(_day(1))
+
+async def _debtors_top():
+    # A snapshot: the cached Debtor records are re-ranked in place as balances move
+    return [(d.company_name, d.balance) for d in await debtor_api.get_debtor_outstanding_async(5)]
+
+async def _stock_list():
+    return await stock_api.get_stock_list_async(20)
+
+async def _ageing():
+    # pandas: imported on first use, off the event loop (see handlers._analytics)
+    analytics_api = await asyncio.to_thread(importlib.import_module, "src.api.analytics")
+    return await analytics_api.ageing_report_async(refresh=True)
+
+# name -> (builder, max age in seconds; None = valid for the rest of the day)
+REPORTS = {
+    "sales_yesterday": (_sales_yesterday, None),
+    "sales_today": (_sales_today, Config.REPORTS_MAX_AGE),
+    "debtors_top": (_debtors_top, Config.REPORTS_MAX_AGE),
+    "stock_list": (_stock_list, Config.REPORTS_MAX_AGE),
+    "ageing": (_ageing, None),
+}
+WARM_REPORTS = ("sales_today", "debtors_top", "stock_list")
+
+class PrecomputedReports:
+    """Latest result of each report in REPORTS, with the time it was built."""
+    def __init__(self, reports):
+        self.reports = reports
+        self._results = {}   # name -> (value, built_at, day)
+        self._building = {}  # name -> task, so concurrent presses share one build
+
+    def get(self, name):
+        """(value, built_at) if today's result is still fresh, else None."""
+        entry = self._results.get(name)
+        if entry is None or entry[2] != _day():
+            return None
+        max_age = self.reports[name][1]
+        if max_age is not None and time.time() - entry[1] > max_age:
+            return None
+        return entry[0], entry[1]
+
+    async def serve(self, name):
+        """The stored result if fresh, otherwise a new build. Returns (value, built_at)."""
+        return self.get(name) or await self.refresh(name)
+
+    async def refresh(self, name):
+        """Rebuilds one report. Returns (value, built_at); value is falsy if AutoCount gave nothing."""
+        task = self._building.get(name)
+        if task is None:
+            # Shared by every press: built under its own budget, not the first presser's
+            task = self._building[name] = detached(self._build(name), Config.REQUEST_BUDGET)
+            task.add_done_callback(lambda _: self._building.pop(name, None))
+        result = await wait_shared(task)
+        # The caller's budget ran out first: the build goes on and is stored for the next press
+        return result if result is not None else (None, time.time())
+
+    async def refresh_all(self, names=None):
+        """Rebuilds `names` (default: all) one after another, never as a burst of parallel ERP reads."""
+        for name in names or self.reports:
+            await self.refresh(name)
+
+    async def _build(self, name):
+        started = time.perf_counter()
+        try:
+            with tracer.span("reports.build", report=name):
+                value = await self.reports[name][0]()
+        except Exception as e:
+            logger.error(f"Report {name} failed: {e}")
+            value = None
+        metrics.observe("report_build_seconds", time.perf_counter() - started, report=name)
+        built_at = time.time()
+        # An empty answer from an unreachable ERP is not a result worth keeping
+        if value is not None and (value or not erp_status.is_down()):
+            self._results[name] = (value, built_at, _day())
+        return value, built_at
+
+    def ages(self):
+        """{name: seconds since built} for today's stored results."""
+        now = time.time()
+        return {name: now - at for name, (_, at, day) in self._results.items() if day == _day()}
+
+precomputed = PrecomputedReports(REPORTS)
+
+def stamp(built_at):
+    return f"🕒 As of {datetime.fromtimestamp(built_at).strftime('%H:%M')}"
+
+# --- DIGEST ---
+
+def digest_text():
+    """Morning summary from the stored reports (missing ones are left out)."""
+    lines = [f"☀️ **Morning Digest** ({datetime.now():%a %d %b})"]
+    built = []
+    entry = precomputed.get("sales_yesterday")
+    if entry and entry[0]:
+        s = entry[0]
+        lines.append(f"📉 Yesterday: RM {s['sales']:,.2f} from {s['count']} invoices")
+        built.append(entry[1])
+    entry = precomputed.get("sales_today")
+    if entry and entry[0]:
+        lines.append(f"📊 Today so far: RM {entry[0]['sales']:,.2f} ({entry[0]['count']} invoices)")
+        built.append(entry[1])
+    entry = precomputed.get("debtors_top")
+    if entry and entry[0]:
+        lines.append("🏆 Top debtors:\n" + "\n".join([f"• {name}: RM {balance:,.2f}" for name, balance in entry[0][:3]]))
+        built.append(entry[1])
+    entry = precomputed.get("ageing")
+    if entry and entry[0]:
+        r = entry[0]
+        lines.append(
+            f"⏳ Outstanding RM {r['total']:,.2f} · 90+ days RM {r['buckets']['90+']:,.2f}\n"
+            f"🚨 {r['over_limit']} customers over their credit limit"
+        )
+        built.append(entry[1])
+    if not built:
+        return None
+    return "\n".join(lines) + f"\n{stamp(min(built))}"
+
+async def send_digest_to(bot, chat_ids):
+    """Sends the digest to `chat_ids`; chats that blocked the bot are unsubscribed. Returns the number sent."""
+    text = digest_text()
+    if text is None:
+        logger.warning("☀️ Digest skipped: no report could be built.")
+        return 0
+    sent = 0
+    for chat_id in chat_ids:
+        try:
+            await bot.send_message(chat_id=chat_id, text=text, parse_mode='Markdown')
+            sent += 1
+        except Forbidden:
+            subscriber_store.remove(chat_id)
+            logger.info(f"☀️ Chat {chat_id} blocked the bot; unsubscribed.")
+        except BadRequest as e:
+            logger.warning(f"☀️ Digest to chat {chat_id} failed: {e}")
+    metrics.inc("digests_sent_total", sent)
+    return sent
+
+# --- JOBS ---
+
+async def precompute_reports(context=None):
+    """JobQueue callback: rebuilds the reports named in job.data (default: all)."""
+    names = context.job.data if context is not None and context.job is not None else None
+    started = time.perf_counter()
+    await precomputed.refresh_all(names)
+    logger.info(f"🗂️ Reports precomputed in {time.perf_counter() - started:.1f}s: {', '.join(names or REPORTS)}")
+
+def office_hours(now=None):
+    """True on a REPORT_DAYS day (0 = Sunday, as in JobQueue.run_daily) between REPORTS_PRECOMPUTE_AT and REPORTS_WARM_UNTIL."""
+    now = now or datetime.now()
+    if (now.weekday() + 1) % 7 not in Config.REPORT_DAYS:
+        return False
+    return clock_time(Config.REPORTS_PRECOMPUTE_AT) <= now.time() < clock_time(Config.REPORTS_WARM_UNTIL)
+
+async def keep_reports_warm(context=None):
+    """JobQueue callback (repeating): rebuilds WARM_REPORTS during office hours only."""
+    if office_hours():
+        await precomputed.refresh_all(WARM_REPORTS)
+
+async def send_digest(context):
+    """JobQueue callback: the morning digest for every subscriber (builds what the precompute missed)."""
+    for name in REPORTS:
+        await precomputed.serve(name)
+    sent = await send_digest_to(context.bot, subscriber_store.all())
+    logger.info(f"☀️ Digest sent to {sent} chat(s).")
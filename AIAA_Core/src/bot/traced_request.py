@@ -0,0 +1,14 @@
+from telegram.request import HTTPXRequest
+from src.tracing import tracer
+
+class TracedHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest that records every Bot API call (sendMessage, editMessageText...) as a span."""
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        with tracer.span("telegram", method=url.rsplit("/", 1)[-1]) as span:
+            code, payload = await super().do_request(
+                url, method, request_data=request_data, read_timeout=read_timeout,
+                write_timeout=write_timeout, connect_timeout=connect_timeout, pool_timeout=pool_timeout
+            )
+            span["status"] = code
+            return code, payload
@@ -1 +1,36 @@
+import functools
+from datetime import time
+from src.config import Config
+from src.api.resilience import request_budget
 
+def format_age(seconds):
+    """"45s", "12 min", "3.5 h" - for labelling cached answers."""
+    if seconds < 60:
+        return f"{seconds:.0f}s"
+    if seconds < 3600:
+        return f"{seconds / 60:.0f} min"
+    return f"{seconds / 3600:.1f} h"
+
+def clock_time(text):
+    """"08:30" or "8:30" -> datetime.time(8, 30), for the HH:MM settings in Config."""
+    hour, minute = (int(part) for part in text.split(":"))
+    return time(hour, minute)
+
+def within_budget(fn):
+    """
+    Telegram handler decorator: every AutoCount call of the update shares one
+    Config.REQUEST_BUDGET, and an answer built from stale cached data (ERP down
+    or circuit open) is followed by a note saying how old that data is.
+    The budget starts when `fn` is called, so text messages apply it to the
+    part after the intent is known (see handlers._answer_intent).
+    """
+    @functools.wraps(fn)
+    async def wrapper(update, context, *args):
+        with request_budget(Config.REQUEST_BUDGET) as scope:
+            result = await fn(update, context, *args)
+        if scope.stale_age and update.effective_message:
+            await update.effective_message.reply_text(
+                f"🕒 AutoCount is not responding, so this answer uses cached data from {format_age(scope.stale_age)} ago."
+            )
+        return result
+    return wrapper
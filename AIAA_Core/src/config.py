@@ -12,7 +12,90 @@ class Config:
     API_USER = os.getenv("API_USER", "ADMIN")
     API_PASSWORD = os.getenv("API_PASSWORD", "ADMIN")
     
+    # HTTP Tuning (seconds). Heavy list endpoints get a longer budget than the default.
+    API_TIMEOUT = float(os.getenv("API_TIMEOUT", "15"))
+    API_POOL_SIZE = int(os.getenv("API_POOL_SIZE", "20"))
+    API_ENDPOINT_TIMEOUTS = {
+        "api/v3/Login": float(os.getenv("API_LOGIN_TIMEOUT", "10")),
+        "api/V2/Item/GetItem": float(os.getenv("API_STOCK_TIMEOUT", "30")),
+        "api/Debtor/GetDebtor/": float(os.getenv("API_DEBTOR_TIMEOUT", "30")),
+        "api/Invoice/GetInvoice": float(os.getenv("API_INVOICE_TIMEOUT", "30")),
+        "api/Invoice": float(os.getenv("API_INVOICE_CREATE_TIMEOUT", "30")),
+    }
+    # Failure handling: per-endpoint circuit breaker, retries for reads only
+    # (full-jitter exponential backoff) and the AutoCount time budget of one update
+    API_BREAKER_FAILURES = int(os.getenv("API_BREAKER_FAILURES", "5"))  # consecutive failures that open it
+    API_BREAKER_RESET = float(os.getenv("API_BREAKER_RESET", "30"))  # seconds open before a probe
+    API_READ_RETRIES = int(os.getenv("API_READ_RETRIES", "2"))
+    API_RETRY_BASE_DELAY = float(os.getenv("API_RETRY_BASE_DELAY", "0.5"))
+    API_RETRY_MAX_DELAY = float(os.getenv("API_RETRY_MAX_DELAY", "4"))
+    REQUEST_BUDGET = float(os.getenv("REQUEST_BUDGET", "20"))
+    # JWT lifecycle: lifetime assumed when the token has no `exp` claim, and how
+    # long before expiry a background refresh starts (seconds)
+    API_TOKEN_TTL = float(os.getenv("API_TOKEN_TTL", "1800"))
+    API_TOKEN_REFRESH_AHEAD = float(os.getenv("API_TOKEN_REFRESH_AHEAD", "120"))
+    # Concurrent identical reads (same endpoint + payload) share one upstream call
+    API_COALESCE_READS = os.getenv("API_COALESCE_READS", "true").lower() == "true"
+    # Bulk invoice creation: documents packed into one api/Invoice request
+    INVOICE_BATCH_SIZE = int(os.getenv("INVOICE_BATCH_SIZE", "25"))
+
+    # Master-data cache (seconds / row caps)
+    DEBTOR_CACHE_TTL = float(os.getenv("DEBTOR_CACHE_TTL", "300"))
+    DEBTOR_CACHE_MAX_ROWS = int(os.getenv("DEBTOR_CACHE_MAX_ROWS", "50000"))
+    # Outstanding leaderboard: rebuilt from the cached records this often, on top of each snapshot (0 = never)
+    DEBTOR_LEADERBOARD_RESYNC = float(os.getenv("DEBTOR_LEADERBOARD_RESYNC", "900"))
+    CACHE_REFRESH_AHEAD = float(os.getenv("CACHE_REFRESH_AHEAD", "0.8"))  # fraction of TTL
+    STOCK_CATALOG_TTL = float(os.getenv("STOCK_CATALOG_TTL", "3600"))
+    STOCK_CACHE_MAX_ROWS = int(os.getenv("STOCK_CACHE_MAX_ROWS", "100000"))
+    STOCK_QTY_TTL = float(os.getenv("STOCK_QTY_TTL", "60"))
+    STOCK_HOT_ITEMS = int(os.getenv("STOCK_HOT_ITEMS", "200"))
+
     OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "deepseek-r1:8b")
+    OLLAMA_NUM_PREDICT = int(os.getenv("OLLAMA_NUM_PREDICT", "128"))  # intent JSON is short
+    OLLAMA_THINK = os.getenv("OLLAMA_THINK", "false").lower() == "true"
+    OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "24h")  # keep the model resident between calls
+    # Rule-based intent matches at or above this confidence skip the LLM
+    INTENT_RULE_CONFIDENCE = float(os.getenv("INTENT_RULE_CONFIDENCE", "0.8"))
+    # LLM worker pool: concurrent inferences (default ~1 per 4 cores) and queued requests
+    INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", str(max(1, (os.cpu_count() or 1) // 4))))
+    INFERENCE_QUEUE_SIZE = int(os.getenv("INFERENCE_QUEUE_SIZE", "20"))
+    INFERENCE_STATUS_INTERVAL = float(os.getenv("INFERENCE_STATUS_INTERVAL", "5"))
+
+    # Local state (intent cache, rollups, outbox, digest subscribers) lives here
+    DATA_DIR = os.getenv("DATA_DIR", "data")
+    INTENT_CACHE_PATH = os.getenv("INTENT_CACHE_PATH", os.path.join(DATA_DIR, "intent_cache.json"))
+    INTENT_CACHE_SIZE = int(os.getenv("INTENT_CACHE_SIZE", "2000"))
+    INTENT_CACHE_TTL = float(os.getenv("INTENT_CACHE_TTL", "86400"))
+    SALES_ROLLUP_PATH = os.getenv("SALES_ROLLUP_PATH", os.path.join(DATA_DIR, "sales_rollup.sqlite3"))
+    SALES_TODAY_REFRESH = float(os.getenv("SALES_TODAY_REFRESH", "60"))  # seconds between "today" re-fetches
+    SALES_SETTLE_DAYS = int(os.getenv("SALES_SETTLE_DAYS", "7"))  # past days still re-checked for back-dated/cancelled invoices
+    SALES_RECENT_REFRESH = float(os.getenv("SALES_RECENT_REFRESH", "3600"))  # seconds between re-checks of those days
+    ANALYTICS_MAX_AGE = float(os.getenv("ANALYTICS_MAX_AGE", "600"))  # top customers/items per period are reused this long
+    # Write outbox: confirmed invoices/debtors are queued here and sent by a background worker
+    OUTBOX_PATH = os.getenv("OUTBOX_PATH", os.path.join(DATA_DIR, "outbox.sqlite3"))
+    OUTBOX_RETRY_BASE = float(os.getenv("OUTBOX_RETRY_BASE", "5"))    # first retry delay, doubled per attempt
+    OUTBOX_RETRY_MAX = float(os.getenv("OUTBOX_RETRY_MAX", "300"))
+    OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "30"))
+    # Precomputed menu reports and the morning digest (times are local, days 0 = Sunday as in JobQueue.run_daily)
+    SUBSCRIBERS_PATH = os.getenv("SUBSCRIBERS_PATH", os.path.join(DATA_DIR, "subscribers.sqlite3"))
+    REPORTS_PRECOMPUTE_AT = os.getenv("REPORTS_PRECOMPUTE_AT", "08:30")
+    DIGEST_AT = os.getenv("DIGEST_AT", "08:45")
+    REPORT_DAYS = tuple(int(x) for x in os.getenv("REPORT_DAYS", "1,2,3,4,5").replace(" ", "").split(",") if x)
+    REPORTS_REFRESH_INTERVAL = float(os.getenv("REPORTS_REFRESH_INTERVAL", "900"))  # keep-warm rebuilds during the day
+    REPORTS_WARM_UNTIL = os.getenv("REPORTS_WARM_UNTIL", "18:00")  # keep-warm runs from REPORTS_PRECOMPUTE_AT to this time
+    REPORTS_MAX_AGE = float(os.getenv("REPORTS_MAX_AGE", "1800"))  # older results are rebuilt on the next press
+
+    # Observability: Prometheus text on METRICS_HOST:METRICS_PORT/metrics (port 0 disables)
+    METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+    METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+    # Per-update tracing: JSON lines, rotated. Slow or failed updates are always kept.
+    TRACE_PATH = os.getenv("TRACE_PATH", os.path.join(DATA_DIR, "traces.jsonl"))  # empty disables tracing
+    TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))
+    TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "5000"))
+    TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(10 * 1024 * 1024)))
+    TRACE_BACKUPS = int(os.getenv("TRACE_BACKUPS", "5"))
+    # Telegram user IDs allowed to run admin commands such as /stats (comma-separated)
+    ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",") if x}
 
     @classmethod
     def validate(cls):
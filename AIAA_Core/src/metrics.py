@@ -0,0 +1,208 @@
+import logging
+import threading
+from bisect import bisect_left
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+logger = logging.getLogger(__name__)
+
+# In-process metrics with a Prometheus text exporter (no external dependency).
+# Metrics are declared once below; label values are passed as keyword arguments.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BYTES_BUCKETS = (1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000)
+
+class Histogram:
+    """Cumulative-bucket histogram (Prometheus semantics) with an approximate quantile."""
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Linear interpolation inside the bucket holding the q-th observation."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta = {}    # name -> (kind, help, buckets)
+        self._values = {}  # name -> {label tuple: number or Histogram}
+
+    def declare(self, kind, name, help_text, buckets=None):
+        self._meta[name] = (kind, help_text, buckets)
+        self._values.setdefault(name, {})
+
+    @staticmethod
+    def _key(labels):
+        return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        """Counter increment, or gauge add (use a negative value to decrement)."""
+        key = self._key(labels)
+        with self._lock:
+            series = self._values[name]
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._values[name][self._key(labels)] = value
+
+    def observe(self, name, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._values[name]
+            if key not in series:
+                series[key] = Histogram(self._meta[name][2])
+            series[key].observe(value)
+
+    def series(self, name):
+        """{labels_dict_as_tuple: value} snapshot for one metric."""
+        with self._lock:
+            return dict(self._values.get(name, {}))
+
+    def reset(self):
+        with self._lock:
+            for series in self._values.values():
+                series.clear()
+
+    # --- EXPORT ---
+    @staticmethod
+    def _labels(key, extra=()):
+        pairs = list(key) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        with self._lock:
+            for name, (kind, help_text, buckets) in self._meta.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for key, value in self._values[name].items():
+                    if kind != "histogram":
+                        lines.append(f"{name}{self._labels(key)} {value}")
+                        continue
+                    cumulative = 0
+                    for bound, n in zip(list(buckets) + ["+Inf"], value.counts):
+                        cumulative += n
+                        lines.append(f"{name}_bucket{self._labels(key, [('le', bound)])} {cumulative}")
+                    lines.append(f"{name}_sum{self._labels(key)} {value.sum}")
+                    lines.append(f"{name}_count{self._labels(key)} {value.count}")
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+
+# --- AUTOCOUNT CLIENT ---
+metrics.declare("histogram", "autocount_request_seconds", "AutoCount call latency including retries and JSON decode.", LATENCY_BUCKETS)
+metrics.declare("histogram", "autocount_response_bytes", "AutoCount response body size.", BYTES_BUCKETS)
+metrics.declare("histogram", "autocount_json_decode_seconds", "Time spent decoding AutoCount JSON responses.", LATENCY_BUCKETS)
+metrics.declare("counter", "autocount_responses_total", "AutoCount HTTP responses by status (status=\"error\" for connection failures).")
+metrics.declare("counter", "autocount_logins_total", "Login calls by result.")
+metrics.declare("counter", "autocount_relogins_total", "Re-logins triggered by a 401 response.")
+metrics.declare("counter", "autocount_token_refreshes_total", "Login calls by trigger (missing, expired, proactive, 401).")
+metrics.declare("counter", "autocount_login_waits_total", "Callers that waited on a shared login instead of sending their own.")
+metrics.declare("gauge", "autocount_token_expiry_timestamp_seconds", "Expiry (unix time) of the current JWT.")
+metrics.declare("gauge", "autocount_up", "1 while AutoCount answers, 0 after a connection failure or 5xx.")
+metrics.declare("gauge", "autocount_in_flight", "AutoCount requests currently in flight.")
+metrics.declare("counter", "autocount_retries_total", "Read retries after a connection error, timeout or 5xx.")
+metrics.declare("counter", "autocount_deadline_exceeded_total", "Calls or retries skipped because the request budget was spent.")
+metrics.declare("gauge", "autocount_circuit_state", "Circuit breaker state per endpoint (0 closed, 1 half-open, 2 open).")
+metrics.declare("counter", "autocount_circuit_rejections_total", "Calls failed fast because the endpoint's circuit was open.")
+metrics.declare("counter", "autocount_coalesced_total", "Reads served by joining an identical in-flight request.")
+metrics.declare("counter", "autocount_streamed_rows_total", "Rows handed out by streamed list responses.")
+
+# --- LOCAL WORK ---
+metrics.declare("histogram", "cache_build_seconds", "Time to prepare and index a new master-data snapshot.", LATENCY_BUCKETS)
+
+# --- WRITE OUTBOX ---
+metrics.declare("counter", "outbox_enqueued_total", "Confirmed writes queued for AutoCount.")
+metrics.declare("counter", "outbox_writes_total", "Outbox send results (sent, failed, retry).")
+metrics.declare("histogram", "outbox_delivery_seconds", "Time from confirmation to AutoCount's DocNo/AccNo.", LATENCY_BUCKETS)
+metrics.declare("gauge", "outbox_backlog", "Writes waiting to be sent or checked.")
+
+# --- PRECOMPUTED REPORTS ---
+metrics.declare("histogram", "report_build_seconds", "Time to build one menu report (scheduled or on a stale press).", LATENCY_BUCKETS)
+metrics.declare("counter", "digests_sent_total", "Morning digests delivered to subscribed chats.")
+
+def endpoint_summary():
+    """Per-endpoint digest of the client metrics (used by the /stats command)."""
+    latency = metrics.series("autocount_request_seconds")
+    size = metrics.series("autocount_response_bytes")
+    decode = metrics.series("autocount_json_decode_seconds")
+    responses = metrics.series("autocount_responses_total")
+    in_flight = metrics.series("autocount_in_flight")
+    coalesced = metrics.series("autocount_coalesced_total")
+
+    rows = {}
+    for key, hist in latency.items():
+        endpoint = dict(key)["endpoint"]
+        rows[endpoint] = {
+            "endpoint": endpoint, "calls": hist.count,
+            "p50_ms": hist.quantile(0.5) * 1000, "p95_ms": hist.quantile(0.95) * 1000,
+            "avg_kb": 0.0, "decode_ms": 0.0, "401": 0, "5xx": 0, "errors": 0,
+            "in_flight": in_flight.get(key, 0), "shared": coalesced.get(key, 0),
+        }
+    for key, hist in size.items():
+        row = rows.get(dict(key)["endpoint"])
+        if row and hist.count: row["avg_kb"] = hist.sum / hist.count / 1024
+    for key, hist in decode.items():
+        row = rows.get(dict(key)["endpoint"])
+        if row and hist.count: row["decode_ms"] = hist.sum / hist.count * 1000
+    for key, count in responses.items():
+        labels = dict(key)
+        row = rows.get(labels["endpoint"])
+        if row is None: continue
+        if labels["status"] == "401": row["401"] += count
+        elif labels["status"].startswith("5"): row["5xx"] += count
+        elif labels["status"] == "error": row["errors"] += count
+    return sorted(rows.values(), key=lambda r: -r["calls"])
+
+def counter_total(name):
+    return sum(metrics.series(name).values())
+
+# --- HTTP EXPORTER ---
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = metrics.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def start_metrics_server(host, port):
+    """Serves /metrics from a daemon thread; returns the server (call .shutdown() to stop) or None."""
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        logger.warning(f"Metrics endpoint not started on {host}:{port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics").start()
+    logger.info(f"📈 Prometheus metrics on http://{host}:{port}/metrics")
+    return server
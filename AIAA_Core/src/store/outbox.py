@@ -0,0 +1,116 @@
+import json
+import time
+from src.store.sqlite import SqliteStore
+
+# Row lifecycle: pending -> sent | failed. A send whose outcome is unknown
+# (timeout, dropped connection, 5xx) parks the row as `unknown` until the
+# worker has checked AutoCount for it; only then is it pending again.
+PENDING, UNKNOWN, SENT, FAILED = "pending", "unknown", "sent", "failed"
+
+class OutboxStore(SqliteStore):
+    """
+    Confirmed ERP writes (invoices, debtors) waiting to be sent, in a local
+    SQLite file. `key` is the idempotency key of the confirmation that queued
+    the write: adding the same key twice returns the first row.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            key TEXT NOT NULL UNIQUE,
+            kind TEXT NOT NULL,            -- invoice | debtor
+            payload TEXT NOT NULL,         -- JSON arguments of the write
+            chat_id INTEGER,               -- where to report the result
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_at REAL NOT NULL,
+            result TEXT,                   -- DocNo / AccNo
+            error TEXT,
+            notified INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, kind, next_at);
+    """
+
+    @staticmethod
+    def _row(row):
+        if row is None:
+            return None
+        row = dict(row)
+        row["payload"] = json.loads(row["payload"])
+        return row
+
+    def add(self, key, kind, payload, chat_id=None):
+        """Queues a write; returns (row, created). An existing key is returned untouched."""
+        now = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute("""
+                INSERT OR IGNORE INTO outbox (key, kind, payload, chat_id, status, next_at, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (key, kind, json.dumps(payload), chat_id, PENDING, now, now, now))
+            row = self._conn.execute("SELECT * FROM outbox WHERE key = ?", (key,)).fetchone()
+        return self._row(row), cursor.rowcount == 1
+
+    def get(self, key):
+        with self._lock:
+            return self._row(self._conn.execute("SELECT * FROM outbox WHERE key = ?", (key,)).fetchone())
+
+    def due(self, status, kind=None, limit=100):
+        """Rows in `status` (of `kind`, if given) whose next attempt is due, oldest first."""
+        sql, args = "SELECT * FROM outbox WHERE status = ? AND next_at <= ?", [status, time.time()]
+        if kind:
+            sql += " AND kind = ?"
+            args.append(kind)
+        with self._lock:
+            rows = self._conn.execute(sql + " ORDER BY id LIMIT ?", args + [limit]).fetchall()
+        return [self._row(r) for r in rows]
+
+    def next_due(self):
+        """Seconds until the earliest pending/unknown row is due (None if there is none)."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MIN(next_at) FROM outbox WHERE status IN (?, ?)", (PENDING, UNKNOWN)
+            ).fetchone()
+        return None if row[0] is None else max(0.0, row[0] - time.time())
+
+    def _update(self, ids, **fields):
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        marks = ",".join("?" * len(ids))
+        with self._lock, self._conn:
+            self._conn.execute(f"UPDATE outbox SET {assignments} WHERE id IN ({marks})", list(fields.values()) + list(ids))
+
+    def set_payload(self, row_id, payload):
+        self._update([row_id], payload=json.dumps(payload))
+
+    def mark_sent(self, row_id, result):
+        self._update([row_id], status=SENT, result=result, error=None)
+
+    def mark_failed(self, row_id, error):
+        self._update([row_id], status=FAILED, error=error)
+
+    def reschedule(self, row_id, status, error, delay):
+        """Counts one more attempt and parks the row in `status` for `delay` seconds."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE outbox SET status = ?, error = ?, attempts = attempts + 1, next_at = ?, updated_at = ? WHERE id = ?",
+                (status, error, now + delay, now, row_id),
+            )
+
+    def unnotified(self, limit=100):
+        """Finished rows whose result has not been reported to the user yet."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM outbox WHERE status IN (?, ?) AND notified = 0 ORDER BY id LIMIT ?", (SENT, FAILED, limit)
+            ).fetchall()
+        return [self._row(r) for r in rows]
+
+    def mark_notified(self, row_id):
+        self._update([row_id], notified=1)
+
+    def counts(self):
+        """{status: rows} over the whole outbox."""
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall()
+        return {status: n for status, n in rows}
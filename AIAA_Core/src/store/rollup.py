@@ -0,0 +1,55 @@
+import time
+from src.store.sqlite import SqliteStore
+
+class SalesRollupStore(SqliteStore):
+    """
+    Per-day sales totals in a local SQLite file.
+
+    A day is `closed` once it has been fetched after it settled (see
+    src/api/sales.py DAILY ROLLUP); closed days are never re-fetched. Open
+    days keep the time of their last refresh, and the highest DocNo seen
+    (for logging only: GetInvoice cannot filter by DocNo).
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS daily_sales (
+            day TEXT PRIMARY KEY,          -- YYYY/MM/DD
+            sales REAL NOT NULL,
+            count INTEGER NOT NULL,
+            cancelled INTEGER NOT NULL,
+            last_doc_no TEXT,              -- highest DocNo seen (diagnostics)
+            closed INTEGER NOT NULL,
+            updated_at REAL NOT NULL
+        );
+    """
+
+    def get(self, days):
+        """Returns {day: row_dict} for the days that are stored."""
+        if not days:
+            return {}
+        marks = ",".join("?" * len(days))
+        with self._lock:
+            rows = self._conn.execute(f"SELECT * FROM daily_sales WHERE day IN ({marks})", list(days)).fetchall()
+        return {row["day"]: dict(row) for row in rows}
+
+    def upsert(self, day, sales, count, cancelled, last_doc_no, closed):
+        self.upsert_many([(day, sales, count, cancelled, last_doc_no, closed)])
+
+    def upsert_many(self, rows):
+        """Stores (day, sales, count, cancelled, last_doc_no, closed) tuples in one transaction."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany("""
+                INSERT INTO daily_sales (day, sales, count, cancelled, last_doc_no, closed, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(day) DO UPDATE SET
+                    sales = excluded.sales, count = excluded.count, cancelled = excluded.cancelled,
+                    last_doc_no = excluded.last_doc_no, closed = excluded.closed, updated_at = excluded.updated_at
+            """, [(day, sales, count, cancelled, last_doc_no, int(closed), now) for day, sales, count, cancelled, last_doc_no, closed in rows])
+
+    def reopen(self, *days):
+        """Forces days to be re-fetched on their next read (e.g. after an invoice was written)."""
+        if not days:
+            return
+        marks = ",".join("?" * len(days))
+        with self._lock, self._conn:
+            self._conn.execute(f"UPDATE daily_sales SET closed = 0, updated_at = 0 WHERE day IN ({marks})", list(days))
@@ -0,0 +1,30 @@
+import os
+import sqlite3
+import threading
+
+class SqliteStore:
+    """
+    Base for the local SQLite stores. The file (and DATA_DIR) is created and
+    SCHEMA applied on first use, not when the module defining the store's
+    singleton is imported.
+    """
+    SCHEMA = ""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()  # serialises statements on the shared connection
+        self._open_lock = threading.Lock()
+        self._connection = None
+
+    @property
+    def _conn(self):
+        if self._connection is None:
+            with self._open_lock:
+                if self._connection is None:
+                    os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                    conn = sqlite3.connect(self.path, check_same_thread=False)
+                    conn.row_factory = sqlite3.Row
+                    with conn:
+                        conn.executescript(self.SCHEMA)
+                    self._connection = conn
+        return self._connection
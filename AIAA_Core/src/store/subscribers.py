@@ -0,0 +1,33 @@
+import time
+from src.store.sqlite import SqliteStore
+
+class SubscriberStore(SqliteStore):
+    """Chats that asked for the morning digest (/subscribe), in a local SQLite file."""
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS subscribers (
+            chat_id INTEGER PRIMARY KEY,
+            created_at REAL NOT NULL
+        );
+    """
+
+    def add(self, chat_id):
+        """Subscribes a chat; returns False if it already was."""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO subscribers (chat_id, created_at) VALUES (?, ?)", (chat_id, time.time())
+            )
+        return cursor.rowcount == 1
+
+    def remove(self, chat_id):
+        """Unsubscribes a chat; returns False if it was not subscribed."""
+        with self._lock, self._conn:
+            cursor = self._conn.execute("DELETE FROM subscribers WHERE chat_id = ?", (chat_id,))
+        return cursor.rowcount == 1
+
+    def all(self):
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT chat_id FROM subscribers ORDER BY created_at")]
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM subscribers").fetchone()[0]
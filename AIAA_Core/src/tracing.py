@@ -0,0 +1,255 @@
+import argparse
+import contextlib
+import functools
+import glob
+import json
+import logging
+import logging.handlers
+import os
+import random
+import time
+import uuid
+from contextvars import ContextVar
+from src.config import Config
+
+logger = logging.getLogger(__name__)
+
+# Lightweight per-update tracing. A trace is opened per Telegram update (see
+# traced_handler) and every span opened underneath it - intent parsing, AutoCount
+# calls, local filtering, Bot API replies - is attached to it via contextvars,
+# so concurrent updates never mix. Spans outside a trace cost one lookup.
+#
+# Sampling is decided when the trace ends: a trace is written if it is sampled
+# (TRACE_SAMPLE_RATE), slower than TRACE_SLOW_MS, or raised an error, so the
+# "it took 40 seconds" update is always on disk.
+#
+#   python -m src.tracing --slowest 10            # slowest traces with their spans
+#   python -m src.tracing --name handle_text_message --since 2h
+
+_trace = ContextVar("trace", default=None)
+_parent = ContextVar("span_parent", default=None)
+
+class _Trace:
+    __slots__ = ("trace_id", "name", "attrs", "started_at", "t0", "spans", "next_id")
+
+    def __init__(self, name, attrs):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attrs = attrs
+        self.started_at = time.time()
+        self.t0 = time.perf_counter()
+        self.spans = []
+        self.next_id = 0
+
+class Tracer:
+    def __init__(self, path, sample_rate, slow_ms, max_bytes, backups):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._writer = None
+
+    def _get_writer(self):
+        if self._writer is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(
+                self.path, maxBytes=self.max_bytes, backupCount=self.backups, encoding="utf-8"
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._writer = logging.getLogger("aiaa.traces")
+            self._writer.propagate = False
+            self._writer.setLevel(logging.INFO)
+            self._writer.addHandler(handler)
+        return self._writer
+
+    @contextlib.contextmanager
+    def trace(self, name, **attrs):
+        """Root of one trace. Nested calls join the trace that is already open."""
+        if not self.path or _trace.get() is not None:
+            with self.span(name, **attrs) as span_attrs:
+                yield span_attrs
+            return
+
+        current = _Trace(name, attrs)
+        trace_token, parent_token = _trace.set(current), _parent.set(None)
+        error = None
+        try:
+            yield attrs
+        except BaseException as e:
+            error = repr(e)
+            raise
+        finally:
+            _trace.reset(trace_token)
+            _parent.reset(parent_token)
+            self._finish(current, (time.perf_counter() - current.t0) * 1000, error)
+
+    @contextlib.contextmanager
+    def span(self, name, **attrs):
+        """One stage of the current trace; yields a dict the caller may add attributes to."""
+        current = _trace.get()
+        if current is None:
+            yield attrs
+            return
+
+        current.next_id += 1
+        span_id = current.next_id
+        parent = _parent.get()
+        token = _parent.set(span_id)
+        started = time.perf_counter()
+        error = None
+        try:
+            yield attrs
+        except BaseException as e:
+            error = repr(e)
+            raise
+        finally:
+            _parent.reset(token)
+            record = {
+                "id": span_id, "parent": parent, "name": name,
+                "start_ms": round((started - current.t0) * 1000, 3),
+                "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+            }
+            if attrs: record["attrs"] = attrs
+            if error: record["error"] = error
+            current.spans.append(record)
+
+    def annotate(self, **attrs):
+        """Adds attributes to the trace root (e.g. the resolved intent)."""
+        current = _trace.get()
+        if current is not None:
+            current.attrs.update(attrs)
+
+    def current_trace_id(self):
+        current = _trace.get()
+        return current.trace_id if current else None
+
+    def _finish(self, current, duration_ms, error):
+        if not (error or duration_ms >= self.slow_ms or random.random() < self.sample_rate):
+            return
+        record = {
+            "trace_id": current.trace_id, "name": current.name,
+            "ts": round(current.started_at, 3), "duration_ms": round(duration_ms, 3),
+            "attrs": current.attrs, "spans": sorted(current.spans, key=lambda s: s["start_ms"]),
+        }
+        if error: record["error"] = error
+        try:
+            self._get_writer().info(json.dumps(record, default=str))
+        except Exception as e:
+            logger.error(f"Trace write failed ({self.path}): {e}")
+
+    # --- DECORATORS ---
+    def traced(self, name):
+        """Sync-function decorator: runs the function inside a span."""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def traced_handler(self, fn):
+        """Telegram handler decorator: one trace per update, tagged with user and button data."""
+        @functools.wraps(fn)
+        async def wrapper(update, context):
+            attrs = {"update_id": update.update_id}
+            if update.effective_user:
+                attrs["user_id"] = update.effective_user.id
+            if update.callback_query:
+                attrs["data"] = update.callback_query.data
+            with self.trace(fn.__name__, **attrs):
+                return await fn(update, context)
+        return wrapper
+
+# Singleton Instance
+tracer = Tracer(
+    path=Config.TRACE_PATH,
+    sample_rate=Config.TRACE_SAMPLE_RATE,
+    slow_ms=Config.TRACE_SLOW_MS,
+    max_bytes=Config.TRACE_MAX_BYTES,
+    backups=Config.TRACE_BACKUPS
+)
+
+# --- CLI ---
+
+def load_traces(path, since=None, name=None):
+    """All traces in the current file and its rotated backups."""
+    traces = []
+    for file_path in sorted(glob.glob(f"{glob.escape(path)}*")):
+        if not (file_path == path or file_path[len(path) + 1:].isdigit()):
+            continue
+        with open(file_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if since and record["ts"] < since: continue
+                if name and record["name"] != name: continue
+                traces.append(record)
+    return traces
+
+def _span_label(span):
+    attrs = span.get("attrs") or {}
+    detail = attrs.get("endpoint") or attrs.get("method") or attrs.get("cache") or ""
+    return f"{span['name']} {detail}".strip()
+
+def print_trace(record):
+    stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record["ts"]))
+    attrs = " ".join(f"{k}={v}" for k, v in record["attrs"].items())
+    print(f"\n{stamp}  {record['name']}  {record['duration_ms']:,.0f} ms  trace={record['trace_id']}  {attrs}")
+    if record.get("error"):
+        print(f"   ❌ {record['error']}")
+    depth = {None: 0}
+    for span in record["spans"]:
+        depth[span["id"]] = depth.get(span["parent"], 0) + 1
+        indent = "   " * depth[span["id"]]
+        error = f"  ❌ {span['error']}" if span.get("error") else ""
+        print(f"{indent}+{span['start_ms']:>8,.0f} ms  {_span_label(span):<44}{span['duration_ms']:>10,.1f} ms{error}")
+
+def stage_breakdown(traces):
+    """{stage: [durations]} plus the untraced remainder of each trace."""
+    stages = {}
+    for record in traces:
+        top_level = 0.0
+        for span in record["spans"]:
+            stages.setdefault(_span_label(span), []).append(span["duration_ms"])
+            if span["parent"] is None:
+                top_level += span["duration_ms"]
+        stages.setdefault("(untraced handler code)", []).append(max(0.0, record["duration_ms"] - top_level))
+    return stages
+
+def main():
+    parser = argparse.ArgumentParser(description="Slowest traces and stage-time breakdown")
+    parser.add_argument("--path", default=Config.TRACE_PATH)
+    parser.add_argument("--slowest", type=int, default=10)
+    parser.add_argument("--name", help="only traces of this handler (e.g. handle_text_message)")
+    parser.add_argument("--since", help="only recent traces, e.g. 30m, 2h, 1d")
+    args = parser.parse_args()
+
+    since = None
+    if args.since:
+        unit = {"m": 60, "h": 3600, "d": 86400}[args.since[-1]]
+        since = time.time() - float(args.since[:-1]) * unit
+    traces = load_traces(args.path, since, args.name)
+    if not traces:
+        print(f"No traces in {args.path}*")
+        return
+
+    print(f"🐢 Slowest {min(args.slowest, len(traces))} of {len(traces)} traces ({args.path}*)")
+    for record in sorted(traces, key=lambda r: -r["duration_ms"])[:args.slowest]:
+        print_trace(record)
+
+    total = sum(r["duration_ms"] for r in traces)
+    print(f"\n📊 Stage breakdown over {len(traces)} traces")
+    print(f"{'stage':<52}{'count':>7}{'avg ms':>10}{'p95 ms':>10}{'total %':>9}")
+    stages = stage_breakdown(traces)
+    for stage, durations in sorted(stages.items(), key=lambda kv: -sum(kv[1])):
+        ordered = sorted(durations)
+        p95 = ordered[min(len(ordered) - 1, int(0.95 * (len(ordered) - 1) + 0.5))]
+        share = sum(durations) / total * 100 if total else 0.0
+        print(f"{stage[:51]:<52}{len(durations):>7}{sum(durations) / len(durations):>10,.1f}{p95:>10,.1f}{share:>8.1f}%")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from tests.simulator import add_dataset_args, simulator_from_args, start
+
+# Repeatable latency/throughput benchmark for every src/api function,
+# run against the local AutoCount simulator (tests/simulator.py).
+#
+#   python -m tests.benchmark --latency 20 --jitter 10 --json bench.json
+#   python -m tests.benchmark --baseline bench.json   # exit 1 on a p50 regression
+#
+# "cold" rows invalidate the caches before each call; "warm" rows measure the
+# cached path. Async rows also report throughput at --concurrency callers.
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def _summary(name, samples, elapsed, throughput=None):
+    return {
+        "name": name,
+        "calls": len(samples),
+        "p50_ms": _percentile(samples, 50) * 1000,
+        "p95_ms": _percentile(samples, 95) * 1000,
+        "max_ms": max(samples) * 1000,
+        "mean_ms": statistics.fmean(samples) * 1000,
+        "ops_per_s": len(samples) / elapsed if elapsed else 0.0,
+        "concurrent_ops_per_s": throughput,
+    }
+
+def _bench_sync(name, fn, iterations, setup=None):
+    samples = []
+    started = time.perf_counter()
+    for i in range(iterations):
+        if setup: setup(i)
+        t = time.perf_counter()
+        fn(i)
+        samples.append(time.perf_counter() - t)
+    return _summary(name, samples, time.perf_counter() - started)
+
+async def _bench_async(name, fn, iterations, concurrency, setup=None):
+    samples = []
+    started = time.perf_counter()
+    for i in range(iterations):
+        if setup: setup(i)
+        t = time.perf_counter()
+        await fn(i)
+        samples.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - started
+
+    # Throughput: `concurrency` callers at once, cache state as in the sequential run
+    if setup: setup(iterations)
+    t = time.perf_counter()
+    await asyncio.gather(*[fn(iterations + i) for i in range(concurrency)])
+    throughput = concurrency / (time.perf_counter() - t)
+    return _summary(name, samples, elapsed, throughput)
+
+def build_cases(sim):
+    """(name, fn(i), setup(i) or None) for every public src/api function."""
+    import src.api.analytics as analytics_api
+    import src.api.debtor as debtor_api
+    import src.api.invoice as invoice_api
+    import src.api.sales as sales_api
+    import src.api.stock as stock_api
+    from src.api.client import api_client, async_api_client
+
+    debtors = [d["AccNo"] for d in sim.debtors]
+    names = [d["CompanyName"].split()[0] + " " + d["CompanyName"].split()[1] for d in sim.debtors[:50]]
+    items = [i["ItemCode"] for i in sim.items]
+    descriptions = [i["Description"].split()[0] for i in sim.items[:50]]
+
+    def cold_debtors(i): debtor_api.debtor_cache.invalidate()
+    def cold_stock(i): stock_api.stock_cache.invalidate()
+    def stale_qty(i): stock_api.mark_items_dirty(items[:20])
+
+    today = datetime.now()
+    def past_day(i):
+        # A different, never-seen day per call: the rollup cannot answer it
+        return (today - timedelta(days=2 + i * 2)).strftime("%Y/%m/%d")
+
+    def today_stale(i):
+        sales_api.rollup_store.reopen(today.strftime("%Y/%m/%d"))
+
+    return [
+        # --- client ---
+        ("client.login", lambda i: api_client.login(stale_key=api_client.auth_key), None),
+        ("client.post GetItem (1 code)", lambda i: api_client.post(stock_api.STOCK_ENDPOINT, json_payload={"ItemCode": [items[i % len(items)]], "IncludeBatchBal": True}), None),
+        ("async client.post GetItem (1 code)", lambda i: async_api_client.post(stock_api.STOCK_ENDPOINT, json_payload={"ItemCode": [items[i % len(items)]], "IncludeBatchBal": True}), None),
+        ("async client.post GetDebtor (coalesced)", lambda i: debtor_api.get_debtor_list_raw_async(), None),
+        # --- debtor ---
+        ("debtor.get_debtor_list_raw", lambda i: debtor_api.get_debtor_list_raw(), None),
+        ("debtor.get_debtor_outstanding (cold)", lambda i: debtor_api.get_debtor_outstanding(10), cold_debtors),
+        ("debtor.get_debtor_outstanding (warm)", lambda i: debtor_api.get_debtor_outstanding(10), None),
+        ("debtor.get_debtor_outstanding over 10k (warm)", lambda i: debtor_api.get_debtor_outstanding(20, 10000), None),
+        ("debtor.refresh_balances (10 codes)", lambda i: debtor_api.refresh_balances(debtors[i * 10 % len(debtors):][:10]), None),
+        ("debtor.get_all_debtors (warm)", lambda i: debtor_api.get_all_debtors(20), None),
+        ("debtor.get_debtor_profile code (warm)", lambda i: debtor_api.get_debtor_profile(debtors[i % len(debtors)]), None),
+        ("debtor.get_debtor_profile name (warm)", lambda i: debtor_api.get_debtor_profile(names[i % len(names)]), None),
+        ("async debtor.get_debtor_outstanding (cold)", lambda i: debtor_api.get_debtor_outstanding_async(10), cold_debtors),
+        ("async debtor.get_debtor_profile (warm)", lambda i: debtor_api.get_debtor_profile_async(names[i % len(names)]), None),
+        ("async debtor.suggest_debtors (warm)", lambda i: debtor_api.suggest_debtors_async(names[i % len(names)][:5]), None),
+        ("debtor.create_debtor", lambda i: debtor_api.create_debtor(f"Benchmark Co {i}", phone1="012-3456789"), None),
+        # --- stock ---
+        ("stock.get_stock_raw", lambda i: stock_api.get_stock_raw(), None),
+        ("stock.get_stock_list (cold)", lambda i: stock_api.get_stock_list(20), cold_stock),
+        ("stock.get_stock_list (warm, stale qty)", lambda i: stock_api.get_stock_list(20), stale_qty),
+        ("stock.get_stock_profile (warm)", lambda i: stock_api.get_stock_profile(descriptions[i % len(descriptions)]), None),
+        ("stock.refresh_quantities (20 codes)", lambda i: stock_api.refresh_quantities(items[i * 20 % len(items):][:20]), None),
+        ("async stock.get_stock_list (cold)", lambda i: stock_api.get_stock_list_async(20), cold_stock),
+        ("async stock.get_stock_profile (warm)", lambda i: stock_api.get_stock_profile_async(items[i % len(items)]), None),
+        ("async stock.suggest_items (warm)", lambda i: stock_api.suggest_items_async(descriptions[i % len(descriptions)]), None),
+        # --- invoice ---
+        ("invoice.create_invoice", lambda i: invoice_api.create_invoice(debtors[i % len(debtors)], items[i % len(items)], 1, 10.0), None),
+        ("async invoice.create_invoice", lambda i: invoice_api.create_invoice_async(debtors[i % len(debtors)], items[i % len(items)], 1, 10.0), None),
+        ("invoice.create_invoice_lines (3 lines)", lambda i: invoice_api.create_invoice_lines(debtors[i % len(debtors)], [(items[(i + k) % len(items)], 1, 10.0) for k in range(3)]), None),
+        ("invoice.create_invoices_bulk (50 docs)", lambda i: invoice_api.create_invoices_bulk([(debtors[(i + k) % len(debtors)], [(items[k % len(items)], 1, 10.0)]) for k in range(50)]), None),
+        # --- sales ---
+        ("sales.get_sales_dashboard (cold day)", lambda i: sales_api.get_sales_dashboard(past_day(i)), None),
+        ("sales.get_sales_dashboard (today, stale)", lambda i: sales_api.get_sales_dashboard(), today_stale),
+        ("sales.get_sales_dashboard (rolled up)", lambda i: sales_api.get_sales_dashboard(past_day(0)), None),
+        ("async sales.get_sales_dashboard (cold day)", lambda i: sales_api.get_sales_dashboard_async(past_day(100 + i)), None),
+        ("async sales.compare_days (cold)", lambda i: sales_api.compare_days_async(past_day(200 + i), past_day(260 + i)), None),
+        # --- analytics ---
+        ("analytics.sales_period_report week", lambda i: analytics_api.sales_period_report("week"), None),
+        ("async analytics.sales_period_report month", lambda i: analytics_api.sales_period_report_async("month"), None),
+        ("async analytics.sales_by_debtor month", lambda i: analytics_api.sales_by_debtor_async("month"), None),
+        ("async analytics.sales_by_item month", lambda i: analytics_api.sales_by_item_async("month"), None),
+        ("analytics.ageing_report (rebuilt)", lambda i: analytics_api.ageing_report(refresh=True), None),
+        ("async analytics.ageing_report (cached)", lambda i: analytics_api.ageing_report_async(), None),
+    ]
+
+def print_table(results):
+    print(f"\n{'benchmark':<46}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'ops/s':>10}{'conc ops/s':>12}")
+    print("-" * 98)
+    for r in results:
+        conc = f"{r['concurrent_ops_per_s']:.1f}" if r["concurrent_ops_per_s"] else "-"
+        print(f"{r['name']:<46}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['max_ms']:>10.2f}{r['ops_per_s']:>10.1f}{conc:>12}")
+
+def compare(results, baseline_path, tolerance):
+    """Returns the benchmarks whose p50 regressed by more than `tolerance` (fraction)."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {r["name"]: r for r in json.load(f)["results"]}
+    regressions = []
+    for r in results:
+        old = baseline.get(r["name"])
+        # Sub-millisecond rows are noise-dominated; compare against a 1 ms floor
+        if old and r["p50_ms"] > max(old["p50_ms"], 1.0) * (1 + tolerance):
+            regressions.append((r["name"], old["p50_ms"], r["p50_ms"]))
+    return regressions
+
+async def run_async_cases(cases, iterations, concurrency):
+    return [await _bench_async(name, fn, iterations, concurrency, setup) for name, fn, setup in cases]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark src/api against the AutoCount simulator")
+    add_dataset_args(parser)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--only", default="", help="run benchmarks whose name contains this text")
+    parser.add_argument("--json", dest="json_path", help="write results to this file")
+    parser.add_argument("--baseline", help="compare p50 against a previous --json file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p50 regression (fraction)")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    sim = simulator_from_args(args)
+    server, url = start(sim)
+    print(f"🧪 Simulator on {url}: {len(sim.debtors)} debtors, {len(sim.items)} items, "
+          f"{sim.per_day * sim.days} invoices ({time.perf_counter() - started:.1f}s)")
+
+    # Config reads the environment at import time, so point it at the simulator first
+    os.environ["API_BASE_URL"] = url
+    os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="aiaa-bench-")
+    cases = [c for c in build_cases(sim) if args.only in c[0]]
+    sync_cases = [c for c in cases if not c[0].startswith("async ")]
+    async_cases = [c for c in cases if c[0].startswith("async ")]
+
+    results = [_bench_sync(name, fn, args.iterations, setup) for name, fn, setup in sync_cases]
+    results += asyncio.run(run_async_cases(async_cases, args.iterations, args.concurrency))
+    print_table(results)
+    server.shutdown()
+
+    if args.json_path:
+        meta = {k: v for k, v in vars(args).items() if k not in ("json_path", "baseline")}
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({"created": datetime.now().isoformat(), "args": meta, "results": results}, f, indent=2)
+        print(f"\n💾 Results written to {args.json_path}")
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        for name, old, new in regressions:
+            print(f"❌ REGRESSION {name}: p50 {old:.2f} ms -> {new:.2f} ms")
+        if regressions:
+            sys.exit(1)
+        print("✅ No p50 regressions against baseline.")
+
+if __name__ == "__main__":
+    main()
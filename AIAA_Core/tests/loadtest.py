@@ -0,0 +1,394 @@
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+import warnings
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from tests.simulator import add_dataset_args, simulator_from_args, start
+
+# Concurrent-user load generator for the Telegram handlers.
+# Drives the real handler wiring from main.register_handlers with fake
+# Update/CallbackQuery payloads, against a stubbed Telegram Bot API, the local
+# AutoCount simulator and a fake Ollama server.
+#
+#   python -m tests.loadtest --users 20 --duration 30
+#   python -m tests.loadtest --ramp 1,2,4,8,16,32,64 --duration 15 --slo 2000
+#
+# The in-process simulator shares the GIL with the bot and serialises each
+# GetInvoice range in one json.dumps, which stalls the bot's loop for seconds;
+# for capacity numbers run it in its own process with the same dataset args:
+#
+#   python -m tests.simulator --port 8015 &
+#   python -m tests.loadtest --ramp 2,4,8 --erp-url http://127.0.0.1:8015
+#
+# Reports p50/p95/p99 per handler step, the event-loop lag (how late a 10 ms
+# timer fires: GIL-bound or blocking work on the loop shows up here) and, with
+# --ramp, the saturation point: the user count after which throughput stops
+# growing or p95 breaks --slo.
+#
+# Measured on one CPU (default dataset, --llm-latency 300 --precompute, --erp-url):
+# 64 users at 86 updates/s, p95 ~330 ms, event-loop lag p99 ~70 ms / max ~160 ms,
+# and still scaling; with one fake GPU slot, LLM phrases queue to p95 ~2.5 s.
+# The first "sales this month" / "top customers" of a period takes 3-15 s (one
+# streamed GetInvoice, shared by concurrent callers); repeats come from the
+# rollup and the cached sums. With the in-process simulator the same run reads
+# as "saturated at 2 users" - that is the simulator's json.dumps, not the bot.
+
+BOT_USER = {"id": 999000, "is_bot": True, "first_name": "AIAA", "username": "aiaa_loadtest_bot"}
+
+RULE_PHRASES = [
+    "sales today", "sales yesterday", "who owes money", "top 10 debtors", "customer list", "stock list",
+    "sales this month", "best selling items this week", "top customers last month",
+    "compare sales yesterday vs last monday", "stock {item}", "customer {debtor}",
+]
+# Phrases the rule classifier cannot answer; a per-request suffix defeats the intent cache
+LLM_PHRASES = ["how is business looking #{n}", "anything i should chase up today #{n}", "give me the numbers please #{n}"]
+BUTTONS = ["btn_sales_today", "btn_sales_yesterday", "btn_debtors_top", "btn_debtors_all", "btn_stock_list", "btn_ageing", "btn_help"]
+DEFAULT_MIX = "text=45,llm=10,button=25,invoice=15,debtor=5"
+
+# --- FAKE OLLAMA ---
+
+class FakeOllama:
+    """/api/chat and /api/generate with a fixed think time and a limited number of GPU slots."""
+    def __init__(self, latency_ms, parallel):
+        self.latency_ms = latency_ms
+        self.slots = threading.Semaphore(parallel)
+        self.calls = 0
+
+    def answer(self, user_text):
+        from src.ai.rules import classify
+        intent_data, _ = classify(user_text)
+        if intent_data["intent"] == "unknown":
+            intent_data = {"intent": "get_sales", "args": {"date": datetime.now().strftime("%Y/%m/%d")}}
+        return json.dumps(intent_data)
+
+    def handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                with fake.slots:
+                    fake.calls += 1
+                    time.sleep(fake.latency_ms / 1000)
+                messages = body.get("messages") or [{"content": body.get("prompt", "")}]
+                content = fake.answer(messages[-1]["content"]) if self.path.endswith("/chat") else ""
+                result = {"model": body.get("model"), "created_at": datetime.now().isoformat() + "Z", "done": True, "done_reason": "stop"}
+                result["message" if self.path.endswith("/chat") else "response"] = (
+                    {"role": "assistant", "content": content} if self.path.endswith("/chat") else content
+                )
+                payload = json.dumps(result).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
+
+    def start(self):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler())
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True, name="fake-ollama").start()
+        return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+# --- STUB TELEGRAM BOT API ---
+
+def make_stub_request(latency_ms, counters):
+    from telegram.request import BaseRequest
+
+    class StubRequest(BaseRequest):
+        """Answers Bot API calls locally: no network, optional fixed round-trip time."""
+        _message_ids = itertools.count(1_000_000)
+
+        @property
+        def read_timeout(self):
+            return None
+
+        async def initialize(self):
+            pass
+
+        async def shutdown(self):
+            pass
+
+        async def do_request(self, url, method, request_data=None, read_timeout=None,
+                             write_timeout=None, connect_timeout=None, pool_timeout=None):
+            api_method = url.rsplit("/", 1)[-1]
+            counters[api_method] = counters.get(api_method, 0) + 1
+            if latency_ms:
+                await asyncio.sleep(latency_ms / 1000)
+            params = request_data.parameters if request_data else {}
+            if api_method == "getMe":
+                result = BOT_USER
+            elif api_method in ("sendMessage", "editMessageText"):
+                chat_id = params.get("chat_id") or 0
+                result = {
+                    "message_id": params.get("message_id") or next(self._message_ids),
+                    "date": int(time.time()), "chat": {"id": chat_id, "type": "private"},
+                    "from": BOT_USER, "text": params.get("text", ""),
+                }
+            else:
+                result = True  # deleteMessage, answerCallbackQuery, ...
+            return 200, json.dumps({"ok": True, "result": result}).encode()
+
+    return StubRequest
+
+# --- SIMULATED USERS ---
+
+class LoadRecorder:
+    def __init__(self):
+        self.samples = {}
+        self.errors = 0
+        self.loop_lag = []
+
+    def record(self, label, seconds):
+        self.samples.setdefault(label, []).append(seconds)
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+class SimulatedUser:
+    _update_ids = itertools.count(1)
+
+    def __init__(self, user_id, app, sim, recorder, rng, think_ms):
+        self.user = {"id": user_id, "is_bot": False, "first_name": f"Load{user_id}"}
+        self.chat = {"id": user_id, "type": "private"}
+        self.app = app
+        self.sim = sim
+        self.recorder = recorder
+        self.rng = rng
+        self.think_ms = think_ms
+
+    def _message(self, text):
+        message = {"message_id": next(self._update_ids), "date": int(time.time()), "chat": self.chat, "from": self.user, "text": text}
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": next(self._update_ids), "message": message}
+
+    def _callback(self, data):
+        menu = {"message_id": next(self._update_ids), "date": int(time.time()), "chat": self.chat, "from": BOT_USER, "text": "menu"}
+        return {"update_id": next(self._update_ids), "callback_query": {
+            "id": str(next(self._update_ids)), "from": self.user, "chat_instance": str(self.user["id"]), "data": data, "message": menu,
+        }}
+
+    async def step(self, label, payload):
+        from telegram import Update
+        update = Update.de_json(payload, self.app.bot)
+        started = time.perf_counter()
+        await self.app.process_update(update)
+        self.recorder.record(label, time.perf_counter() - started)
+        if self.think_ms:
+            await asyncio.sleep(self.rng.expovariate(1000 / self.think_ms))
+
+    async def text(self):
+        phrase = self.rng.choice(RULE_PHRASES).format(
+            item=self.rng.choice(self.sim.items)["ItemCode"],
+            debtor=self.rng.choice(self.sim.debtors)["AccNo"],
+        )
+        await self.step("text (rules)", self._message(phrase))
+
+    async def llm(self):
+        await self.step("text (llm)", self._message(self.rng.choice(LLM_PHRASES).format(n=self.rng.randrange(10**9))))
+
+    async def button(self):
+        data = self.rng.choice(BUTTONS)
+        await self.step(f"button {data}", self._callback(data))
+
+    async def invoice(self):
+        debtor = self.rng.choice(self.sim.debtors)["AccNo"]
+        item = self.rng.choice(self.sim.items)["ItemCode"]
+        await self.step("invoice: start", self._callback("btn_create_invoice"))
+        await self.step("invoice: type debtor", self._message(debtor))
+        await self.step("invoice: pick item", self._callback(f"sel_item_{item}"))
+        await self.step("invoice: qty", self._message(str(self.rng.randint(1, 10))))
+        if self.rng.random() < 0.3:
+            item = self.rng.choice(self.sim.items)["ItemCode"]
+            await self.step("invoice: add item", self._callback("inv_add_item"))
+            await self.step("invoice: pick item", self._callback(f"sel_item_{item}"))
+            await self.step("invoice: qty", self._message(str(self.rng.randint(1, 10))))
+        await self.step("invoice: confirm", self._callback("inv_confirm_yes"))
+
+    async def debtor(self):
+        await self.step("debtor: start", self._callback("btn_create_debtor"))
+        await self.step("debtor: name", self._message(f"Load Test Co {self.rng.randrange(10**6)}"))
+        await self.step("debtor: phone", self._message("skip"))
+        await self.step("debtor: confirm", self._callback("debtor_confirm_yes"))
+
+    async def run(self, mix, deadline):
+        names, weights = zip(*mix.items())
+        while time.perf_counter() < deadline:
+            await getattr(self, self.rng.choices(names, weights)[0])()
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in ("text", "llm", "button", "invoice", "debtor"):
+            raise SystemExit(f"Unknown scenario in --mix: {name}")
+        mix[name.strip()] = float(weight)
+    return mix
+
+async def probe_loop_lag(recorder, deadline, interval=0.01):
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        recorder.loop_lag.append(time.perf_counter() - started - interval)
+
+async def run_stage(app, sim, recorder, users, duration, mix, think_ms, seed):
+    deadline = time.perf_counter() + duration
+    started = time.perf_counter()
+    sessions = [SimulatedUser(100000 + n, app, sim, recorder, random.Random(seed + n), think_ms) for n in range(users)]
+    await asyncio.gather(probe_loop_lag(recorder, deadline), *[s.run(mix, deadline) for s in sessions])
+    return time.perf_counter() - started
+
+def summarise(recorder, elapsed):
+    rows = []
+    for label, samples in sorted(recorder.samples.items()):
+        rows.append({
+            "handler": label, "calls": len(samples),
+            "p50_ms": _percentile(samples, 50) * 1000,
+            "p95_ms": _percentile(samples, 95) * 1000,
+            "p99_ms": _percentile(samples, 99) * 1000,
+        })
+    everything = [s for samples in recorder.samples.values() for s in samples]
+    overall = {
+        "calls": len(everything), "errors": recorder.errors,
+        "ops_per_s": len(everything) / elapsed if elapsed else 0.0,
+        "p50_ms": _percentile(everything, 50) * 1000 if everything else 0.0,
+        "p95_ms": _percentile(everything, 95) * 1000 if everything else 0.0,
+        "p99_ms": _percentile(everything, 99) * 1000 if everything else 0.0,
+        "loop_lag_p99_ms": _percentile(recorder.loop_lag, 99) * 1000 if recorder.loop_lag else 0.0,
+        "loop_lag_max_ms": max(recorder.loop_lag) * 1000 if recorder.loop_lag else 0.0,
+    }
+    return rows, overall
+
+def print_stage(users, rows, overall):
+    print(f"\n👥 {users} users: {overall['calls']} updates, {overall['ops_per_s']:.1f}/s, {overall['errors']} errors, "
+          f"p50 {overall['p50_ms']:.0f} ms, p95 {overall['p95_ms']:.0f} ms, p99 {overall['p99_ms']:.0f} ms")
+    print(f"⏱️ Event loop lag: p99 {overall['loop_lag_p99_ms']:.0f} ms, max {overall['loop_lag_max_ms']:.0f} ms")
+    print(f"{'handler':<36}{'calls':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for r in rows:
+        print(f"{r['handler']:<36}{r['calls']:>8}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}")
+
+def saturation_point(stages, slo_ms, min_gain=0.1):
+    """Last user count that still raised throughput by `min_gain` and kept p95 within the SLO."""
+    best = None
+    for users, overall in stages:
+        if slo_ms and overall["p95_ms"] > slo_ms:
+            break
+        if best and overall["ops_per_s"] < best[1]["ops_per_s"] * (1 + min_gain):
+            break
+        best = (users, overall)
+    return best
+
+async def main_async(args, sim):
+    from telegram.ext import ApplicationBuilder
+    from telegram.warnings import PTBUserWarning
+    warnings.filterwarnings("ignore", category=PTBUserWarning)  # per_message hint from the wizards
+    from main import register_handlers
+    logging.getLogger().setLevel(logging.WARNING)
+
+    counters = {}
+    stub = make_stub_request(args.telegram_latency, counters)
+    app = (
+        ApplicationBuilder().token("123456:LOADTEST")
+        .request(stub()).get_updates_request(stub())
+        .concurrent_updates(True)
+        .build()
+    )
+    register_handlers(app)
+
+    current = {"recorder": LoadRecorder()}
+    async def count_error(update, context):
+        current["recorder"].errors += 1
+        logging.getLogger(__name__).debug(f"Handler error: {context.error}")
+    app.add_error_handler(count_error)
+
+    await app.initialize()
+    if args.precompute:
+        # What the scheduled job has done by opening time (main.py BACKGROUND JOBS)
+        from src.bot.reports import precompute_reports
+        started = time.perf_counter()
+        await precompute_reports()
+        print(f"🗂️ Menu reports precomputed in {time.perf_counter() - started:.1f}s")
+    stages = []
+    try:
+        for users in args.ramp:
+            recorder = current["recorder"] = LoadRecorder()
+            elapsed = await run_stage(app, sim, recorder, users, args.duration, args.mix, args.think, args.seed)
+            rows, overall = summarise(recorder, elapsed)
+            print_stage(users, rows, overall)
+            stages.append((users, overall, rows))
+    finally:
+        from src.bot.outbox import outbox_worker
+        await outbox_worker.stop()
+        await app.shutdown()
+    return stages, counters
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive the Telegram handlers with N simulated users")
+    add_dataset_args(parser)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--ramp", help="comma-separated user counts, e.g. 1,2,4,8,16 (overrides --users)")
+    parser.add_argument("--duration", type=float, default=20, help="seconds per stage")
+    parser.add_argument("--think", type=float, default=500, help="mean think time between steps (ms)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"scenario weights (default {DEFAULT_MIX})")
+    parser.add_argument("--llm-latency", type=float, default=1500, help="fake Ollama time per inference (ms)")
+    parser.add_argument("--llm-parallel", type=int, default=1, help="inferences the fake Ollama runs at once")
+    parser.add_argument("--telegram-latency", type=float, default=0, help="stub Bot API round trip (ms)")
+    parser.add_argument("--slo", type=float, default=3000, help="p95 target (ms) for the saturation point")
+    parser.add_argument("--precompute", action="store_true", help="build the menu reports before the first stage, as the morning job does")
+    parser.add_argument("--json", dest="json_path", help="write the stage results to this file")
+    parser.add_argument("--erp-url", help="use a simulator already running in another process (same dataset args)")
+    args = parser.parse_args()
+    args.ramp = [int(n) for n in args.ramp.split(",")] if args.ramp else [args.users]
+    args.mix = parse_mix(args.mix)
+
+    started = time.perf_counter()
+    sim = simulator_from_args(args)
+    erp, erp_url = (None, args.erp_url) if args.erp_url else start(sim)
+    ollama_server, ollama_url = FakeOllama(args.llm_latency, args.llm_parallel).start()
+    print(f"🧪 Simulator on {erp_url} ({time.perf_counter() - started:.1f}s), fake Ollama on {ollama_url}")
+
+    # Config and the ollama client read the environment at import time
+    os.environ["API_BASE_URL"] = erp_url
+    os.environ["OLLAMA_HOST"] = ollama_url
+    os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="aiaa-load-")
+    os.environ.setdefault("INFERENCE_WORKERS", str(args.llm_parallel))
+
+    stages, counters = asyncio.run(main_async(args, sim))
+    ollama_server.shutdown()
+
+    print(f"\n📨 Bot API calls: {dict(sorted(counters.items()))}")
+    if erp:
+        erp.shutdown()
+        print(f"🏭 AutoCount calls: {dict(sorted(sim.stats.items()))}")
+    if len(stages) > 1:
+        best = saturation_point([(users, overall) for users, overall, _ in stages], args.slo)
+        if best:
+            print(f"\n📈 Saturation point: ~{best[0]} users ({best[1]['ops_per_s']:.1f} updates/s, p95 {best[1]['p95_ms']:.0f} ms)")
+        else:
+            print(f"\n📉 Already saturated at {stages[0][0]} users (p95 over {args.slo:.0f} ms)")
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump([{"users": u, "overall": o, "handlers": r} for u, o, r in stages], f, indent=2)
+        print(f"💾 Results written to {args.json_path}")
+
+if __name__ == "__main__":
+    main()
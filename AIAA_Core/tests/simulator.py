@@ -0,0 +1,342 @@
+import argparse
+import base64
+import functools
+import json
+import random
+import threading
+import time
+from datetime import date, datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Local stand-in for the Freely WebAPI (AutoCount) on port 8015.
+# Serves synthetic debtors, items and invoices so the client, the API modules
+# and the bot can be benchmarked without a production ERP.
+#
+#   python -m tests.simulator --debtors 10000 --items 50000 --invoices 1000000 --latency 30
+#
+# Invoices are generated per day from a seeded RNG on request, so 1M invoices
+# cost no memory until a date range is actually asked for.
+
+WORDS = [
+    "Green", "Golden", "Sunrise", "Pacific", "Eastern", "Royal", "Prime", "Metro", "Union", "Global",
+    "Lucky", "Star", "Ocean", "Summit", "United", "Bright", "Silver", "Evergreen", "Harbour", "Crystal"
+]
+TRADES = ["Trading", "Hardware", "Enterprise", "Supplies", "Foods", "Motors", "Electrical", "Logistics", "Mart", "Industries"]
+SUFFIXES = ["Sdn Bhd", "Enterprise", "Trading Co", "Bhd", "PLT"]
+PRODUCTS = ["Apple", "Helmet", "Cable", "Bolt", "Paint", "Glove", "Rice", "Oil", "Battery", "Lamp", "Pipe", "Tape"]
+VARIANTS = ["Red", "Blue", "Black", "Large", "Small", "Premium", "Economy", "Pro", "Mini", "Max"]
+UOMS = ["UNIT", "PCS", "BOX", "KG", "CTN"]
+
+def _b64(data):
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).rstrip(b"=").decode()
+
+class AutoCountSimulator:
+    """Synthetic AutoCount dataset plus the request handling for each endpoint."""
+    def __init__(self, debtors=10000, items=50000, invoices=1000000, days=365, seed=42,
+                 latency_ms=0.0, jitter_ms=0.0, row_cost_us=0.0, error_rate=0.0,
+                 token_ttl=3600, include_lines=True):
+        self.days = days
+        self.seed = seed
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.row_cost_us = row_cost_us
+        self.error_rate = error_rate
+        self.token_ttl = token_ttl
+        self.include_lines = include_lines
+        self.per_day = max(1, invoices // days)
+        self.today = date.today()
+        self.first_day = self.today - timedelta(days=days - 1)
+
+        rng = random.Random(seed)
+        self.debtors = [self._make_debtor(rng, i) for i in range(debtors)]
+        self.items = [self._make_item(rng, i) for i in range(items)]
+        self.items_by_code = {item["ItemCode"]: item for item in self.items}
+        self.debtors_by_code = {debtor["AccNo"]: debtor for debtor in self.debtors}
+        self.created = {}  # day -> invoices posted through api/Invoice
+        self.stats = {}
+        self._tokens = {}
+        self._lock = threading.Lock()
+        self._doc_seq = 0
+
+        # The full master-data lists never change shape, so encode them once
+        self._debtor_body = json.dumps(self.debtors).encode()
+        self._catalog_body = json.dumps({"ResultTable": [self._item_row(i, False) for i in self.items]}).encode()
+
+    # --- DATASET ---
+    @staticmethod
+    def _make_debtor(rng, i):
+        name = f"{rng.choice(WORDS)} {rng.choice(TRADES)} {rng.choice(SUFFIXES)}"
+        return {
+            "AccNo": f"300-{i:05d}",
+            "CompanyName": f"{name} {i}" if i % 3 else name,
+            "Phone1": f"01{rng.randint(0, 9)}-{rng.randint(1000000, 9999999)}",
+            "Balance": round(rng.uniform(0, 50000), 2) if rng.random() < 0.6 else 0.0,
+            "CreditLimit": float(rng.choice([5000, 10000, 20000, 50000])),
+            "CreditTerm": rng.choice(["C.O.D.", "30 Days", "60 Days"]),
+            "IsActive": "T",
+        }
+
+    @staticmethod
+    def _make_item(rng, i):
+        product = rng.choice(PRODUCTS)
+        return {
+            "ItemCode": f"{product[:3].upper()}{i:05d}",
+            "Description": f"{product} {rng.choice(VARIANTS)} {rng.randint(1, 500)}",
+            "Desc2": rng.choice(VARIANTS),
+            "Price": round(rng.uniform(1, 500), 2),
+            "BalQty": float(rng.randint(0, 1000)),
+            "UOM": rng.choice(UOMS),
+        }
+
+    @staticmethod
+    def _item_row(item, with_batches):
+        row = dict(item)
+        if with_batches:
+            qty = row.pop("BalQty")
+            row["ItemDTL"] = [{"Location": "HQ", "BalQty": qty}]
+        return row
+
+    @functools.lru_cache(maxsize=64)
+    def _day_invoices(self, ordinal):
+        """The generated invoices of one day (deterministic per seed and day)."""
+        day = date.fromordinal(ordinal)
+        if not self.first_day <= day <= self.today:
+            return ()
+        rng = random.Random(self.seed * 1000003 + ordinal)
+        base = (day - self.first_day).days * self.per_day
+        rows = []
+        for k in range(self.per_day):
+            debtor = self.debtors[rng.randrange(len(self.debtors))] if self.debtors else {"AccNo": "", "CompanyName": ""}
+            lines = []
+            for _ in range(rng.randint(1, 4)):
+                item = self.items[rng.randrange(len(self.items))] if self.items else {"ItemCode": "", "Description": "", "Price": 0}
+                qty = rng.randint(1, 20)
+                lines.append({"ItemCode": item["ItemCode"], "Description": item["Description"], "Qty": qty,
+                              "UnitPrice": item["Price"], "SubTotal": round(qty * item["Price"], 2)})
+            invoice = {
+                "DocNo": f"IV-{base + k + 1:07d}",
+                "DocDate": day.strftime("%Y-%m-%dT00:00:00"),
+                "DebtorCode": debtor["AccNo"],
+                "DebtorName": debtor["CompanyName"],
+                "FinalTotal": round(sum(line["SubTotal"] for line in lines), 2),
+                "Cancelled": "T" if rng.random() < 0.02 else "F",
+            }
+            if self.include_lines:
+                invoice["IVDTL"] = lines
+            rows.append(invoice)
+        return tuple(rows)
+
+    def invoices_between(self, start, end):
+        rows = []
+        day = max(start, self.first_day)
+        while day <= min(end, self.today):
+            rows.extend(self._day_invoices(day.toordinal()))
+            rows.extend(self.created.get(day, []))
+            day += timedelta(days=1)
+        return rows
+
+    # --- AUTH ---
+    def issue_token(self):
+        exp = int(time.time() + self.token_ttl)
+        token = ".".join([_b64({"alg": "HS256", "typ": "JWT"}), _b64({"sub": "ADMIN", "exp": exp}), _b64(random.random())])
+        with self._lock:
+            self._tokens[token] = exp
+        return token
+
+    def authorized(self, token):
+        exp = self._tokens.get(token)
+        return exp is not None and exp > time.time()
+
+    def expire_tokens(self):
+        """Invalidates every issued token (the next call of each client gets a 401)."""
+        with self._lock:
+            self._tokens.clear()
+
+    # --- ENDPOINTS ---
+    def login(self, body):
+        return [{"JWTToken": self.issue_token()}]
+
+    def get_debtor(self, body):
+        codes = set((body or {}).get("AccNo") or [])
+        if not codes:
+            with self._lock:
+                if self._debtor_body is None:
+                    self._debtor_body = json.dumps(self.debtors).encode()
+                return self._debtor_body
+        return [self.debtors_by_code[c] for c in codes if c in self.debtors_by_code]
+
+    def get_item(self, body):
+        body = body or {}
+        batches = bool(body.get("IncludeBatchBal"))
+        codes = body.get("ItemCode") or []
+        if not codes:
+            if not batches:
+                return self._catalog_body
+            return {"ResultTable": [self._item_row(i, True) for i in self.items]}
+        return {"ResultTable": [self._item_row(self.items_by_code[c], batches) for c in codes if c in self.items_by_code]}
+
+    def get_invoice(self, body):
+        body = body or {}
+        if "DateFrom" in body or "DateTo" in body:
+            start = datetime.strptime(body.get("DateFrom") or body.get("DateTo"), "%Y/%m/%d").date()
+            end = datetime.strptime(body.get("DateTo") or body.get("DateFrom"), "%Y/%m/%d").date()
+            return {"ResultTable": self.invoices_between(start, end)}
+        # RecordCount: the latest N documents (tests/module1.py)
+        count = int(body.get("RecordCount", 100))
+        rows, day = [], self.today
+        while len(rows) < count and day >= self.first_day:
+            rows = list(self._day_invoices(day.toordinal())) + self.created.get(day, []) + rows
+            day -= timedelta(days=1)
+        return {"ResultTable": rows[-count:][::-1]}
+
+    def create_invoice(self, body):
+        docs = body if isinstance(body, list) else [body]
+        # The whole request is one transaction: any invalid document rejects all of them
+        for doc in docs:
+            lines = doc.get("IVDTL") or []
+            unknown = [l.get("ItemCode") for l in lines if l.get("ItemCode") not in self.items_by_code]
+            if not doc.get("DebtorCode") or unknown:
+                return 400, {"Message": f"Invalid document: unknown item(s) {unknown}" if unknown else "DebtorCode is required"}
+        results = []
+        for doc in docs:
+            lines = doc.get("IVDTL") or []
+            with self._lock:
+                self._doc_seq += 1
+                doc_no = f"IV-N{self._doc_seq:06d}"
+                for line in lines:
+                    self.items_by_code[line["ItemCode"]]["BalQty"] -= float(line.get("Qty", 0))
+                total = round(sum(float(l.get("Qty", 0)) * float(l.get("UnitPrice", 0)) for l in lines), 2)
+                debtor = self.debtors_by_code.get(doc["DebtorCode"])
+                if debtor is not None:
+                    debtor["Balance"] = round(debtor["Balance"] + total, 2)
+                    self._debtor_body = None  # re-encoded on the next full list
+                self.created.setdefault(self.today, []).append({
+                    "DocNo": doc_no, "DocDate": self.today.strftime("%Y-%m-%dT00:00:00"),
+                    "DebtorCode": doc["DebtorCode"], "FinalTotal": total, "Cancelled": "F", "IVDTL": lines,
+                    "Ref": doc.get("Ref"),
+                })
+            results.append({"DocNo": doc_no})
+        return results
+
+    def create_debtor(self, body):
+        if not (body or {}).get("CompanyName"):
+            return 400, {"Message": "CompanyName is required"}
+        with self._lock:
+            debtor = {"AccNo": f"300-N{len(self.debtors):05d}", "CompanyName": body["CompanyName"],
+                      "Phone1": body.get("Phone1", ""), "Balance": 0.0, "IsActive": "T"}
+            self.debtors.append(debtor)
+            self.debtors_by_code[debtor["AccNo"]] = debtor
+            self._debtor_body = None
+        return [{"AccNo": debtor["AccNo"]}]
+
+    ROUTES = {
+        "api/v3/Login": "login",
+        "api/Debtor/GetDebtor": "get_debtor",
+        "api/V2/Item/GetItem": "get_item",
+        "api/Invoice/GetInvoice": "get_invoice",
+        "api/Invoice": "create_invoice",
+        "api/Debtor": "create_debtor",
+    }
+
+    def handle(self, path, token, body):
+        """Returns (status, encoded_body, row_count) for one POST."""
+        status, result = self._dispatch(path, token, body)
+        if isinstance(result, bytes):
+            rows = len(self.debtors) if "Debtor" in path else len(self.items)
+            return status, result, rows
+        return status, json.dumps(result).encode(), _row_count(result)
+
+    def _dispatch(self, path, token, body):
+        endpoint = path.strip("/")
+        name = self.ROUTES.get(endpoint)
+        with self._lock:
+            self.stats[endpoint] = self.stats.get(endpoint, 0) + 1
+        if name is None:
+            return 404, {"Message": f"No route for {path}"}
+        if name != "login" and not self.authorized(token):
+            return 401, {"Message": "Authorization has been denied for this request."}
+        if self.error_rate and random.random() < self.error_rate:
+            return 500, {"Message": "Simulated server error"}
+        result = getattr(self, name)(body)
+        return result if isinstance(result, tuple) else (200, result)
+
+    def delay(self, rows):
+        seconds = (self.latency_ms + random.uniform(0, self.jitter_ms)) / 1000 + rows * self.row_cost_us / 1e6
+        if seconds > 0:
+            time.sleep(seconds)
+
+def _row_count(result):
+    if isinstance(result, dict):
+        return len(result.get("ResultTable", []))
+    return len(result) if isinstance(result, list) else 0
+
+def make_handler(sim):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, like IIS
+        disable_nagle_algorithm = True  # headers and body are separate writes
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            raw = self.rfile.read(length) if length else b""
+            try:
+                body = json.loads(raw) if raw else None
+            except ValueError:
+                body = None
+            status, payload, rows = sim.handle(self.path, self.headers.get("Authorization"), body)
+            sim.delay(rows)
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    return Handler
+
+def start(sim, host="127.0.0.1", port=0):
+    """Runs the simulator in a daemon thread; returns (server, base_url). Port 0 picks a free port."""
+    server = ThreadingHTTPServer((host, port), make_handler(sim))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="autocount-sim").start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+def add_dataset_args(parser):
+    parser.add_argument("--debtors", type=int, default=10000)
+    parser.add_argument("--items", type=int, default=50000)
+    parser.add_argument("--invoices", type=int, default=1000000, help="spread evenly over --days")
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--latency", type=float, default=0.0, help="base latency per request (ms)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra latency (ms)")
+    parser.add_argument("--row-cost", type=float, default=0.0, help="extra latency per returned row (us)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered with HTTP 500")
+    parser.add_argument("--token-ttl", type=int, default=3600, help="JWT lifetime (s)")
+    parser.add_argument("--no-lines", action="store_true", help="omit IVDTL lines from GetInvoice")
+
+def simulator_from_args(args):
+    return AutoCountSimulator(
+        debtors=args.debtors, items=args.items, invoices=args.invoices, days=args.days, seed=args.seed,
+        latency_ms=args.latency, jitter_ms=args.jitter, row_cost_us=args.row_cost, error_rate=args.error_rate,
+        token_ttl=args.token_ttl, include_lines=not args.no_lines
+    )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local AutoCount WebAPI simulator")
+    add_dataset_args(parser)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8015)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    sim = simulator_from_args(args)
+    print(f"🧪 Generated {len(sim.debtors)} debtors, {len(sim.items)} items, "
+          f"{sim.per_day * sim.days} invoices in {time.perf_counter() - started:.1f}s")
+    server, url = start(sim, args.host, args.port)
+    print(f"🚀 AutoCount simulator listening on {url} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,123 @@
+import asyncio
+import math
+from types import SimpleNamespace
+from src.config import Config
+from src.api.resilience import remaining_budget, detached, wait_shared, request_budget, budget_paused
+import src.bot.handlers as handlers
+from src.bot.outbox import OutboxWorker
+from src.bot.reports import PrecomputedReports
+
+class _Message:
+    def __init__(self, text):
+        self.text = text
+        self.chat_id = 1
+        self.message_id = 1
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+        return self
+
+    async def edit_text(self, text, **kwargs):
+        pass
+
+def _update(text):
+    message = _Message(text)
+    return SimpleNamespace(update_id=1, effective_user=SimpleNamespace(id=1), callback_query=None, message=message, effective_message=message)
+
+async def _delete_message(**kwargs):
+    pass
+
+def _context():
+    return SimpleNamespace(bot=SimpleNamespace(delete_message=_delete_message), user_data={})
+
+def _answer(monkeypatch, intent, text):
+    async def known_intent(user_id, text, on_status=None):
+        return intent
+    monkeypatch.setattr(handlers, "interpret_intent_async", known_intent)
+    update = _update(text)
+    asyncio.run(handlers.handle_text_message(update, _context()))
+    return update.message.replies
+
+def test_slow_intent_does_not_spend_the_request_budget(monkeypatch):
+    monkeypatch.setattr(Config, "REQUEST_BUDGET", 0.2)
+    budgets = []
+
+    async def slow_intent(user_id, text, on_status=None):
+        await asyncio.sleep(0.3)  # the LLM queue taking longer than the whole budget
+        return {"intent": "profile_stock", "args": {"keyword": "HLMINK"}}
+
+    async def stock_profile(keyword):
+        budgets.append(remaining_budget())
+        return SimpleNamespace(description="Helmet", item_code=keyword, qty=3, price=10.0)
+
+    monkeypatch.setattr(handlers, "interpret_intent_async", slow_intent)
+    monkeypatch.setattr(handlers.stock_api, "get_stock_profile_async", stock_profile)
+    update = _update("check stock HLMINK")
+    asyncio.run(handlers.handle_text_message(update, _context()))
+
+    assert budgets and 0 < budgets[0] <= 0.2
+    assert "Helmet" in update.message.replies[-1]
+
+def test_paused_time_is_not_charged():
+    async def wait_for_llm():
+        with request_budget(0.2):
+            with budget_paused():
+                await asyncio.sleep(0.3)
+            return remaining_budget()
+    assert asyncio.run(wait_for_llm()) > 0.1
+
+def test_timeout_has_its_own_reply(monkeypatch):
+    monkeypatch.setattr(Config, "REQUEST_BUDGET", 0.1)
+
+    async def stock_profile(keyword):
+        # A shared read that AutoCount answers after this update's budget
+        return await wait_shared(detached(asyncio.sleep(1)))
+
+    monkeypatch.setattr(handlers.stock_api, "get_stock_profile_async", stock_profile)
+    replies = _answer(monkeypatch, {"intent": "profile_stock", "args": {"keyword": "HLMINK"}}, "check stock HLMINK")
+    assert "did not answer in time" in replies[-1]
+
+def test_empty_answer_is_not_a_timeout(monkeypatch):
+    async def stock_profile(keyword):
+        return None
+
+    monkeypatch.setattr(handlers.stock_api, "get_stock_profile_async", stock_profile)
+    replies = _answer(monkeypatch, {"intent": "profile_stock", "args": {"keyword": "NOPE"}}, "check stock NOPE")
+    assert replies[-1] == "❌ Item not found."
+
+def test_outbox_worker_runs_outside_the_request_budget():
+    budgets = []
+
+    class _Store:
+        def next_due(self):
+            return None
+
+    async def confirm_and_drain():
+        worker = OutboxWorker(_Store())
+        async def drain():
+            budgets.append(remaining_budget())
+        worker.drain = drain
+        with request_budget(0.2):
+            worker.kick(bot=None)
+        await asyncio.sleep(0.05)
+        await worker.stop()
+
+    asyncio.run(confirm_and_drain())
+    assert budgets == [math.inf]
+
+def test_report_build_outlives_the_first_press():
+    async def slow_report():
+        await asyncio.sleep(0.3)
+        return ["built"]
+
+    async def press_then_wait():
+        reports = PrecomputedReports({"slow": (slow_report, None)})
+        with request_budget(0.1):
+            first = await reports.serve("slow")
+        await asyncio.sleep(0.4)
+        return first, reports.get("slow")
+
+    first, stored = asyncio.run(press_then_wait())
+    assert first[0] is None
+    assert stored[0] == ["built"]
@@ -0,0 +1,16 @@
+import asyncio
+from src.api.client import async_api_client
+
+def _post_write(monkeypatch, status):
+    async def attempt(endpoint, json_payload, timeout, attempt, stream=False):
+        return True, None, status
+    monkeypatch.setattr(async_api_client, "_attempt", attempt)
+    return asyncio.run(async_api_client.post_write("api/Invoice", []))[0]
+
+def test_refused_token_is_sent_again(monkeypatch):
+    # 401 that survived the re-login: nothing was saved, so the outbox retries it
+    assert _post_write(monkeypatch, 401) == "unsent"
+    assert _post_write(monkeypatch, 403) == "unsent"
+
+def test_validation_error_is_rejected(monkeypatch):
+    assert _post_write(monkeypatch, 400) == "rejected"
@@ -0,0 +1,26 @@
+import asyncio
+from datetime import datetime
+from src.config import Config
+from src.api.records import Debtor
+import src.bot.reports as reports
+from src.bot.reports import office_hours
+
+def test_office_hours_accept_single_digit_hours(monkeypatch):
+    monkeypatch.setattr(Config, "REPORT_DAYS", (0, 1, 2, 3, 4, 5, 6))
+    monkeypatch.setattr(Config, "REPORTS_PRECOMPUTE_AT", "8:30")
+    monkeypatch.setattr(Config, "REPORTS_WARM_UNTIL", "18:00")
+    assert not office_hours(datetime(2026, 10, 14, 8, 29))
+    assert office_hours(datetime(2026, 10, 14, 8, 30))
+    assert office_hours(datetime(2026, 10, 14, 10, 0))  # "10:00" < "8:30" as strings
+    assert not office_hours(datetime(2026, 10, 14, 18, 0))
+
+def test_top_debtors_are_a_snapshot(monkeypatch):
+    debtor = Debtor("300-A001", "Tech Corp", balance=500.0)
+
+    async def outstanding(limit=5, min_balance=None):
+        return [debtor]
+
+    monkeypatch.setattr(reports.debtor_api, "get_debtor_outstanding_async", outstanding)
+    top = asyncio.run(reports._debtors_top())
+    debtor.balance = 0.0  # an invoice payment re-ranks the cached record in place
+    assert top == [("Tech Corp", 500.0)]
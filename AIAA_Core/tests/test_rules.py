@@ -0,0 +1,46 @@
+from datetime import datetime
+from src.ai.rules import classify
+from src.config import Config
+from src.bot.handlers import _limit
+
+NOW = datetime(2026, 10, 19, 9, 0)
+
+def _rules(text):
+    """(intent_data, confidence) as the bot sees it, without master data."""
+    return classify(text, now=NOW)
+
+def test_keyword_guesses_go_to_the_llm():
+    for text in ("how much stock do we have left", "Add a new customer called Acme", "what is the price trend this quarter"):
+        _, confidence = _rules(text)
+        assert confidence < Config.INTENT_RULE_CONFIDENCE, text
+
+def test_known_codes_stay_on_the_rules():
+    intent, confidence = classify("stock HLMINK", item_lookup={"HLMINK": object()}.get, now=NOW)
+    assert intent == {"intent": "profile_stock", "args": {"keyword": "HLMINK"}}
+    assert confidence >= Config.INTENT_RULE_CONFIDENCE
+
+def test_unreadable_dates_are_not_today():
+    for text in ("sales on 2026/13/45", "sales on 31 feb", "compare sales 2026/01/29 vs 2026/02/30"):
+        intent, confidence = _rules(text)
+        assert intent["intent"] == "unknown" and confidence < Config.INTENT_RULE_CONFIDENCE, text
+
+def test_dates():
+    assert _rules("sales on 2026/01/29")[0] == {"intent": "get_sales", "args": {"date": "2026/01/29"}}
+    assert _rules("sales 29/01/2026")[0] == {"intent": "get_sales", "args": {"date": "2026/01/29"}}
+    assert _rules("sales today")[0] == {"intent": "get_sales", "args": {"date": "2026/10/19"}}
+    assert _rules("compare sales 29 Jan vs 12 Aug")[0] == {"intent": "compare_sales", "args": {"date1": "2026/01/29", "date2": "2026/08/12"}}
+
+def test_fast_track_invoice():
+    intent, confidence = _rules("Invoice Green for 5 Apple and 2 Helmet")
+    assert intent == {"intent": "create_invoice_fast", "args": {"debtor": "Green", "lines": [{"item": "Apple", "qty": 5.0}, {"item": "Helmet", "qty": 2.0}]}}
+    assert confidence >= Config.INTENT_RULE_CONFIDENCE
+    assert _rules("invoice for 300-T001 for 5 apple")[0] == {"intent": "create_invoice_fast", "args": {"debtor": "300-T001", "item": "apple", "qty": 5.0}}
+    assert _rules("create invoice to Green for 2 x Helmet")[0]["args"] == {"debtor": "Green", "item": "Helmet", "qty": 2.0}
+
+def test_limits_are_clamped():
+    assert _limit({}) == 5
+    assert _limit({"limit": "10"}) == 10
+    assert _limit({"limit": 500}) == 20
+    assert _limit({"limit": -3}) == 1
+    assert _limit({"limit": "ten"}) == 5
+    assert _limit({"limit": None}) == 5
@@ -0,0 +1,9 @@
+from src.api.stock import QuantityTracker
+import src.api.stock as stock_api
+
+def test_never_refreshed_items_are_stale(monkeypatch):
+    # Shortly after boot the monotonic clock can still be below the TTL
+    monkeypatch.setattr(stock_api.time, "monotonic", lambda: 5.0)
+    tracker = QuantityTracker(ttl=60, hot_size=10)
+    tracker.refreshed_at["FRESH"] = 4.0
+    assert tracker.stale(["NEW", "FRESH"]) == ["NEW"]